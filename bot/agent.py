@@ -1,4 +1,5 @@
-import yaml
+import logging
+import threading
 from dotenv import load_dotenv
 from langchain_groq import ChatGroq
 from langchain.agents import AgentExecutor
@@ -6,48 +7,179 @@ from langchain.agents.format_scratchpad import format_to_tool_messages
 from langchain.agents.output_parsers import ToolsAgentOutputParser
 
 # custom tools and prompt
-from .tools import insert_data, search_data, update_data, delete_data
+from .tools import insert_data, search_data, update_data, delete_data, check_availability, get_chains
 from .prompt import custom_prompt
-from .chatstore import ChatHistoryHandler
+from .chatstore import get_chat_history_handler
+from .history_policy import HistoryPolicy, estimate_tokens
+from .router import IntentRouter
+from .config import get_config
+from .turns import get_turn_gate, get_async_turn_gate
+from .instrumentation import instrumented, traced_turn
 
 
-# loading the config file and environment variables
+logger = logging.getLogger(__name__)
+
+
+# loading the environment variables
 load_dotenv()
-with open("config.yaml", "r") as f:
-    config = yaml.safe_load(f)
 
 
 class DatabaseAgent:
     def __init__(self):
-        self.__tools = [insert_data, search_data, update_data, delete_data]
-        self.__llm_with_tool = ChatGroq(model=config["agent-model-name"]).bind_tools(tools=self.__tools)
-        self.__agent = (
+        self._tools = [insert_data, search_data, update_data, delete_data, check_availability]
+        config = get_config()
+        self._llm_with_tool = ChatGroq(model=config.agent_model_name).bind_tools(tools=self._tools)
+        self._agent = (
             {
                 "input": lambda x: x["input"],
                 "chat_history": lambda x: x["chat_history"],
                 "agent_scratchpad": lambda x: format_to_tool_messages(x["intermediate_steps"])
             }
             | custom_prompt
-            | self.__llm_with_tool
+            | self._llm_with_tool
             | ToolsAgentOutputParser()
         )
-        self.__agent_executor = AgentExecutor(agent=self.__agent, tools=self.__tools, verbose=True)
-        self.__chat_history_handler = ChatHistoryHandler()
+        self._agent_executor = instrumented(AgentExecutor(agent=self._agent, tools=self._tools, verbose=True), "agent")
+        self._chat_history_handler = get_chat_history_handler()
+        self._history_policy = HistoryPolicy(chat_history_handler=self._chat_history_handler,
+                                             mode=config.history_policy.mode,
+                                             max_messages=config.history_policy.max_messages,
+                                             max_tokens=config.history_policy.max_tokens,
+                                             summary_chain=get_chains().history_summary_chain)
+        self._router = IntentRouter(enabled=config.intent_router.enabled)
+
+    # function for logging how much of the chat history went into the prompt of a turn
+    def _log_history_tokens(self, chat_session_id, chat_history, prompt_history):
+        logger.info("Chat turn %s: history %d messages (~%d tokens), prompt history %d messages (~%d tokens).",
+                    chat_session_id, len(chat_history), estimate_tokens(chat_history),
+                    len(prompt_history), estimate_tokens(prompt_history))
     
     
     def get_response(self, chat_session_id, query):
-        response = self.__agent_executor.invoke(input={"input": query, "chat_history": self.__chat_history_handler.get_chat_history(chat_session_id)})
+        with get_turn_gate().turn(chat_session_id), traced_turn(chat_session_id):
+            return self._answer(chat_session_id, query)
+
+
+    # function for answering a turn, called with the turn of the session held
+    def _answer(self, chat_session_id, query):
+        # plain search and cancel commands are answered without the llm
+        routed_response = self._router.route(query)
+        if routed_response is not None:
+            self._chat_history_handler.add_turn(chat_session_id=chat_session_id, query_text=query, response_text=routed_response)
+            return routed_response
+
+        chat_history = self._chat_history_handler.get_chat_history(chat_session_id)
+        prompt_history = self._history_policy.apply(chat_session_id=chat_session_id, chat_history=chat_history)
+        self._log_history_tokens(chat_session_id, chat_history, prompt_history)
+        response = self._agent_executor.invoke(input={"input": query, "chat_history": prompt_history})
         # appending user query and agent response to the chat history in firebase
-        self.__chat_history_handler.add_query(chat_session_id=chat_session_id, query_text=query)
-        self.__chat_history_handler.add_response(chat_session_id=chat_session_id, response_text=response["output"])
+        self._chat_history_handler.add_turn(chat_session_id=chat_session_id, query_text=query, response_text=response["output"])
         return response["output"]
     
 
+    # function for getting the number of turns answered by the router and by the llm agent
+    def routing_stats(self):
+        return self._router.stats()
+
+
     # function for adding feedback message to the chat history
     def add_feedback_message_to_chat_history(self, chat_session_id, feedback_message):
-        self.__chat_history_handler.add_response(chat_session_id=chat_session_id, response_text=feedback_message)
+        self._chat_history_handler.add_response(chat_session_id=chat_session_id, response_text=feedback_message)
 
 
     # function for deleting chat history
     def clear_chat_history(self, chat_session_id):
-        self.__chat_history_handler.delete_chat_history(chat_session_id=chat_session_id)
+        self._chat_history_handler.delete_chat_history(chat_session_id=chat_session_id)
+
+
+# agent for the asgi views, a conversation waiting on groq or firestore does not hold a worker thread
+class AsyncDatabaseAgent(DatabaseAgent):
+    async def get_response(self, chat_session_id, query):
+        async with get_async_turn_gate().turn(chat_session_id):
+            with traced_turn(chat_session_id):
+                return await self._answer(chat_session_id, query)
+
+
+    # function for answering a turn, called with the turn of the session held
+    async def _answer(self, chat_session_id, query):
+        # plain search and cancel commands are answered without the llm
+        routed_response = await self._router.aroute(query)
+        if routed_response is not None:
+            await self._chat_history_handler.aadd_turn(chat_session_id=chat_session_id, query_text=query, response_text=routed_response)
+            return routed_response
+
+        chat_history = await self._chat_history_handler.aget_chat_history(chat_session_id)
+        prompt_history = await self._history_policy.aapply(chat_session_id=chat_session_id, chat_history=chat_history)
+        self._log_history_tokens(chat_session_id, chat_history, prompt_history)
+        response = await self._agent_executor.ainvoke(input={"input": query, "chat_history": prompt_history})
+        # appending user query and agent response to the chat history in firebase
+        await self._chat_history_handler.aadd_turn(chat_session_id=chat_session_id, query_text=query, response_text=response["output"])
+        return response["output"]
+
+
+    # async generator streaming a turn as events: token (text of the llm as it is generated), tool_start, tool_end and
+    # done (the final response, also the output of a return_direct tool which is never streamed as tokens)
+    async def stream_response(self, chat_session_id, query):
+        async with get_async_turn_gate().turn(chat_session_id):
+            with traced_turn(chat_session_id):
+                routed_response = await self._router.aroute(query)
+                if routed_response is not None:
+                    await self._chat_history_handler.aadd_turn(chat_session_id=chat_session_id, query_text=query, response_text=routed_response)
+                    yield {"event": "done", "text": routed_response}
+                    return
+
+                chat_history = await self._chat_history_handler.aget_chat_history(chat_session_id)
+                prompt_history = await self._history_policy.aapply(chat_session_id=chat_session_id, chat_history=chat_history)
+                self._log_history_tokens(chat_session_id, chat_history, prompt_history)
+
+                output = ""
+                async for event in self._agent_executor.astream_events({"input": query, "chat_history": prompt_history}, version="v2"):
+                    kind = event["event"]
+                    if kind == "on_chat_model_stream":
+                        text = event["data"]["chunk"].content
+                        if isinstance(text, str) and text:
+                            yield {"event": "token", "text": text}
+                    elif kind == "on_tool_start":
+                        yield {"event": "tool_start", "tool": event["name"]}
+                    elif kind == "on_tool_end":
+                        yield {"event": "tool_end", "tool": event["name"]}
+                    elif kind == "on_chain_end" and event["name"] == "AgentExecutor":
+                        output = event["data"]["output"]["output"]
+
+                await self._chat_history_handler.aadd_turn(chat_session_id=chat_session_id, query_text=query, response_text=output)
+                yield {"event": "done", "text": output}
+
+
+    # function for adding feedback message to the chat history
+    async def add_feedback_message_to_chat_history(self, chat_session_id, feedback_message):
+        await self._chat_history_handler.aadd_response(chat_session_id=chat_session_id, response_text=feedback_message)
+
+
+    # function for deleting chat history
+    async def clear_chat_history(self, chat_session_id):
+        await self._chat_history_handler.adelete_chat_history(chat_session_id=chat_session_id)
+
+
+_database_agent = None
+_async_database_agent = None
+_agents_lock = threading.Lock()
+
+
+# function for getting the process wide agent, the groq client and the chat history store are created on first use
+def get_database_agent():
+    global _database_agent
+    if _database_agent is None:
+        with _agents_lock:
+            if _database_agent is None:
+                _database_agent = DatabaseAgent()
+    return _database_agent
+
+
+# function for getting the process wide agent of the asgi views
+def get_async_database_agent():
+    global _async_database_agent
+    if _async_database_agent is None:
+        with _agents_lock:
+            if _async_database_agent is None:
+                _async_database_agent = AsyncDatabaseAgent()
+    return _async_database_agent
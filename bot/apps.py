@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class BotConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'bot'
+
+    def ready(self):
+        # config.yaml is read again when the process receives SIGHUP
+        from .config import install_reload_handler
+        install_reload_handler()
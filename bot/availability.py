@@ -0,0 +1,117 @@
+from bisect import bisect_left
+from datetime import date, datetime, time, timedelta
+from itertools import accumulate
+
+from .cache import TTLCache
+
+
+# function for converting a time of day (time, timedelta from mysql or "HH:MM[:SS]") into minutes since midnight
+def to_minutes(value):
+    if isinstance(value, timedelta):
+        return int(value.total_seconds()) // 60
+    if isinstance(value, str):
+        value = time.fromisoformat(value)
+    return value.hour * 60 + value.minute
+
+
+# function for converting a date or "YYYY-MM-DD" into a date
+def to_date(value):
+    return date.fromisoformat(value) if isinstance(value, str) else value
+
+
+# function for converting minutes since midnight into a time of day
+def from_minutes(minutes):
+    return time(hour=minutes // 60, minute=minutes % 60)
+
+
+# interval index of the appointments of one day, sorted by start time
+class DaySchedule:
+    def __init__(self, appointments):
+        # appointments are (user id, start minute, end minute)
+        self.appointments = sorted(appointments, key=lambda appointment: appointment[1])
+        self.starts = [start for _, start, _ in self.appointments]
+        # latest end time among the first i appointments, tells in O(log n) if anything starting before a time is still running
+        self.max_ends = list(accumulate((end for _, _, end in self.appointments), max))
+
+    # function for finding the appointments overlapping [start, end)
+    def overlapping(self, start, end, exclude_user_id=None):
+        count = bisect_left(self.starts, end)    # appointments starting before the end of the slot
+        if count == 0 or self.max_ends[count - 1] <= start:
+            return []
+        return [appointment for appointment in self.appointments[:count]
+                if appointment[2] > start and appointment[0] != exclude_user_id]
+
+    # function for getting the busy intervals merged together
+    def busy(self):
+        merged = []
+        for _, start, end in self.appointments:
+            if merged and start <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], end)
+            else:
+                merged.append([start, end])
+        return merged
+
+
+# engine answering slot questions from per day interval indexes, a day is loaded from the database once and cached until a write
+class AvailabilityEngine:
+    def __init__(self, load_day, opening_time="09:00", closing_time="21:00", slot_minutes=5, cache_days=64, cache_ttl=60):
+        self.load_day = load_day    # function returning the (user id, start time, end time) of the active appointments of a date
+        self.opening = to_minutes(opening_time)
+        self.closing = to_minutes(closing_time)
+        self.slot_minutes = slot_minutes
+        self.days = TTLCache(maxsize=cache_days, ttl=cache_ttl)
+
+    # function for building the interval index of the (user id, start time, end time) of the appointments of a day
+    def index(self, appointments):
+        return DaySchedule([(user_id, to_minutes(start), to_minutes(end) if end is not None else to_minutes(start) + self.slot_minutes)
+                            for user_id, start, end in appointments])
+
+    # function for getting the interval index of a day
+    def schedule(self, day: date):
+        day = to_date(day)
+        schedule = self.days.get(day)
+        if schedule is None:
+            schedule = self.index(self.load_day(day))
+            self.days.set(day, schedule)
+        return schedule
+
+    # function for checking whether a slot lies within the opening hours
+    def is_open(self, start, minutes=None):
+        start = to_minutes(start)
+        return self.opening <= start and start + (minutes or self.slot_minutes) <= self.closing
+
+    # function for checking whether a slot is free, the appointment of exclude_user_id is ignored when it is being moved
+    def is_free(self, day: date, start, minutes=None, exclude_user_id=None):
+        if not self.is_open(start, minutes):
+            return False
+        start = to_minutes(start)
+        return not self.schedule(day).overlapping(start, start + (minutes or self.slot_minutes), exclude_user_id)
+
+    # function for getting the next free slots of a day, starting from a time of day
+    def next_free_slots(self, day: date, count=5, after=None, minutes=None):
+        day = to_date(day)
+        minutes = minutes or self.slot_minutes
+        start = max(self.opening, to_minutes(after) if after is not None else self.opening)
+        if day == date.today():
+            now = datetime.now()
+            start = max(start, now.hour * 60 + now.minute)
+        # rounding up to the slot grid
+        start = self.opening + -(-(start - self.opening) // self.slot_minutes) * self.slot_minutes
+
+        slots = []
+        for busy_start, busy_end in self.schedule(day).busy() + [[self.closing, self.closing]]:
+            while start + minutes <= min(busy_start, self.closing) and len(slots) < count:
+                slots.append(from_minutes(start))
+                start += self.slot_minutes
+            if len(slots) >= count:
+                break
+            if busy_end > start:
+                start = self.opening + -(-(busy_end - self.opening) // self.slot_minutes) * self.slot_minutes
+        return slots
+
+    # function for dropping the cached index of a day after a write, without a day every cached day is dropped
+    def invalidate(self, day=None):
+        if day is None:
+            self.days.clear()
+        else:
+            self.days.delete(to_date(day))
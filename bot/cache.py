@@ -0,0 +1,60 @@
+import time
+import threading
+from collections import OrderedDict
+
+
+# thread safe LRU cache where every entry also expires after ttl seconds
+class TTLCache:
+    def __init__(self, maxsize=1024, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.__entries = OrderedDict()    # key -> (expires at, value), least recently used first
+        self.__lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    # function for getting a cached value, returns default when it is missing or expired
+    def get(self, key, default=None):
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self.__entries[key]
+                self.misses += 1
+                return default
+            self.__entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    # function for caching a value, the least recently used entry is dropped when the cache is full
+    def set(self, key, value):
+        with self.__lock:
+            self.__entries[key] = (time.monotonic() + self.ttl, value)
+            self.__entries.move_to_end(key)
+            while len(self.__entries) > self.maxsize:
+                self.__entries.popitem(last=False)
+                self.evictions += 1
+
+    # function for removing a cached value
+    def delete(self, key):
+        with self.__lock:
+            self.__entries.pop(key, None)
+
+    # function for removing every cached value
+    def clear(self):
+        with self.__lock:
+            self.__entries.clear()
+
+    # function for getting the hit/miss stats of the cache
+    def stats(self):
+        with self.__lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self.__entries),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
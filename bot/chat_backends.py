@@ -0,0 +1,218 @@
+import json
+import sqlite3
+import asyncio
+import weakref
+import threading
+
+from google.cloud import firestore
+from langchain_core.messages import messages_from_dict, messages_to_dict
+from langchain_google_firestore.chat_message_history import encode_messages, convert_messages_to_langchain
+
+from .config import get_config
+
+
+# interface of the chat history stores, every backend keeps the full message list of a chat session
+class ChatHistoryBackend:
+    # function to get the messages of a chat session, an unknown session has no messages
+    def get_messages(self, chat_session_id):
+        raise NotImplementedError
+
+    # function for replacing the messages of a chat session
+    def set_messages(self, chat_session_id, messages):
+        raise NotImplementedError
+
+    # function for appending messages to a chat session in one atomic step, returns the messages of the session after it,
+    # writers holding an old copy of the history can not overwrite what another writer appended or deleted meanwhile
+    def append_messages(self, chat_session_id, messages):
+        raise NotImplementedError
+
+    # function for deleting a chat session
+    def delete(self, chat_session_id):
+        raise NotImplementedError
+
+    # async versions run the blocking calls on a worker thread unless the backend has a native async client
+    async def aget_messages(self, chat_session_id):
+        return await asyncio.to_thread(self.get_messages, chat_session_id)
+
+    async def aset_messages(self, chat_session_id, messages):
+        await asyncio.to_thread(self.set_messages, chat_session_id, messages)
+
+    async def aappend_messages(self, chat_session_id, messages):
+        return await asyncio.to_thread(self.append_messages, chat_session_id, messages)
+
+    async def adelete(self, chat_session_id):
+        await asyncio.to_thread(self.delete, chat_session_id)
+
+
+# backend storing the chat history in google firestore, in the same format as FirestoreChatMessageHistory
+class FirestoreBackend(ChatHistoryBackend):
+    def __init__(self, project_id, collection_name):
+        self.project_id = project_id
+        self.collection_name = collection_name
+        self.client = None          # created on first use, creating it needs the google credentials
+        # async clients by event loop, the grpc channel of an async client only works on the loop it was created on and
+        # under wsgi every async view runs through async_to_sync on a loop of its own
+        self.async_clients = weakref.WeakKeyDictionary()
+        self.__lock = threading.Lock()
+
+    # function for getting the firestore document of a chat session
+    def fetch_chat_document(self, chat_session_id):
+        if self.client is None:
+            with self.__lock:
+                if self.client is None:
+                    self.client = firestore.Client(project=self.project_id)
+        return self.client.collection(self.collection_name).document(chat_session_id)
+
+    # function for getting the async client of the running event loop, created on first use on that loop
+    def get_async_client(self):
+        loop = asyncio.get_running_loop()
+        with self.__lock:
+            if loop not in self.async_clients:
+                self.async_clients[loop] = firestore.AsyncClient(project=self.project_id)
+            return self.async_clients[loop]
+
+    # function for getting the firestore document of a chat session for the async client
+    def fetch_async_chat_document(self, chat_session_id):
+        return self.get_async_client().collection(self.collection_name).document(chat_session_id)
+
+    @staticmethod
+    def decode_document(document):
+        if document.exists:
+            data = document.to_dict()
+            if "messages" in data:
+                return convert_messages_to_langchain(True, data["messages"])
+        return []
+
+    def get_messages(self, chat_session_id):
+        return self.decode_document(self.fetch_chat_document(chat_session_id).get())
+
+    def set_messages(self, chat_session_id, messages):
+        self.fetch_chat_document(chat_session_id).set({"messages": encode_messages(messages)})
+
+    # the document is read and written in a transaction, firestore retries it when another writer changed the document
+    # in between, ArrayUnion is not used as it drops a message equal to one already in the history
+    def append_messages(self, chat_session_id, messages):
+        document = self.fetch_chat_document(chat_session_id)
+
+        @firestore.transactional
+        def append(transaction):
+            snapshot = document.get(transaction=transaction)
+            encoded = ((snapshot.to_dict() or {}).get("messages", []) if snapshot.exists else []) + encode_messages(messages)
+            transaction.set(document, {"messages": encoded})
+            return encoded
+
+        return convert_messages_to_langchain(True, append(self.client.transaction()))
+
+    def delete(self, chat_session_id):
+        self.fetch_chat_document(chat_session_id).delete()
+
+    async def aget_messages(self, chat_session_id):
+        return self.decode_document(await self.fetch_async_chat_document(chat_session_id).get())
+
+    async def aset_messages(self, chat_session_id, messages):
+        await self.fetch_async_chat_document(chat_session_id).set({"messages": encode_messages(messages)})
+
+    async def aappend_messages(self, chat_session_id, messages):
+        document = self.fetch_async_chat_document(chat_session_id)
+
+        @firestore.async_transactional
+        async def append(transaction):
+            snapshot = await document.get(transaction=transaction)
+            encoded = ((snapshot.to_dict() or {}).get("messages", []) if snapshot.exists else []) + encode_messages(messages)
+            transaction.set(document, {"messages": encoded})
+            return encoded
+
+        return convert_messages_to_langchain(True, await append(self.get_async_client().transaction()))
+
+    async def adelete(self, chat_session_id):
+        await self.fetch_async_chat_document(chat_session_id).delete()
+
+
+# backend storing the chat history in a local sqlite file, one row per chat session
+class SQLiteBackend(ChatHistoryBackend):
+    def __init__(self, path="chat_history.sqlite3"):
+        self.__db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.__lock = threading.Lock()
+        with self.__lock:
+            self.__db.execute("CREATE TABLE IF NOT EXISTS chat_history (session_id TEXT PRIMARY KEY, messages TEXT NOT NULL)")
+
+    def get_messages(self, chat_session_id):
+        with self.__lock:
+            row = self.__db.execute("SELECT messages FROM chat_history WHERE session_id = ?", (chat_session_id,)).fetchone()
+        return messages_from_dict(json.loads(row[0])) if row else []
+
+    def set_messages(self, chat_session_id, messages):
+        with self.__lock:
+            self.__db.execute("INSERT INTO chat_history (session_id, messages) VALUES (?, ?) "
+                              "ON CONFLICT(session_id) DO UPDATE SET messages = excluded.messages",
+                              (chat_session_id, json.dumps(messages_to_dict(messages))))
+
+    # the immediate transaction takes the write lock of the file, other processes sharing it wait until the append is done
+    def append_messages(self, chat_session_id, messages):
+        with self.__lock:
+            self.__db.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.__db.execute("SELECT messages FROM chat_history WHERE session_id = ?", (chat_session_id,)).fetchone()
+                encoded = (json.loads(row[0]) if row else []) + messages_to_dict(messages)
+                self.__db.execute("INSERT INTO chat_history (session_id, messages) VALUES (?, ?) "
+                                  "ON CONFLICT(session_id) DO UPDATE SET messages = excluded.messages",
+                                  (chat_session_id, json.dumps(encoded)))
+                self.__db.execute("COMMIT")
+            except BaseException:
+                self.__db.execute("ROLLBACK")
+                raise
+        return messages_from_dict(encoded)
+
+    def delete(self, chat_session_id):
+        with self.__lock:
+            self.__db.execute("DELETE FROM chat_history WHERE session_id = ?", (chat_session_id,))
+
+
+# backend keeping the chat history in the memory of the process, for tests and offline load tests
+class InMemoryBackend(ChatHistoryBackend):
+    def __init__(self):
+        self.__sessions = {}
+        self.__lock = threading.Lock()
+
+    def get_messages(self, chat_session_id):
+        with self.__lock:
+            return list(self.__sessions.get(chat_session_id, []))
+
+    def set_messages(self, chat_session_id, messages):
+        with self.__lock:
+            self.__sessions[chat_session_id] = list(messages)
+
+    def append_messages(self, chat_session_id, messages):
+        with self.__lock:
+            chat_history = self.__sessions[chat_session_id] = self.__sessions.get(chat_session_id, []) + list(messages)
+            return list(chat_history)
+
+    def delete(self, chat_session_id):
+        with self.__lock:
+            self.__sessions.pop(chat_session_id, None)
+
+    async def aget_messages(self, chat_session_id):
+        return self.get_messages(chat_session_id)
+
+    async def aset_messages(self, chat_session_id, messages):
+        self.set_messages(chat_session_id, messages)
+
+    async def aappend_messages(self, chat_session_id, messages):
+        return self.append_messages(chat_session_id, messages)
+
+    async def adelete(self, chat_session_id):
+        self.delete(chat_session_id)
+
+
+# function for building the chat history backend selected in the config
+def get_chat_history_backend():
+    config = get_config()
+    backend = config.chat_history.backend
+    if backend == 'firestore':
+        return FirestoreBackend(project_id=config.google_firestore.project_id,
+                                collection_name=config.google_firestore.collection_name)
+    if backend == 'sqlite':
+        return SQLiteBackend(path=config.chat_history.sqlite_path)
+    if backend == 'memory':
+        return InMemoryBackend()
+    raise ValueError(f"Unknown chat history backend {backend}.")
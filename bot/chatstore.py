@@ -1,40 +1,159 @@
-import yaml
-from google.cloud import firestore
-from langchain_google_firestore import FirestoreChatMessageHistory
+import threading
 
+from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
 
-# loading the config file
-with open("config.yaml", "r") as f:
-    config = yaml.safe_load(f)
+from .cache import TTLCache
+from .chat_backends import get_chat_history_backend
+from .config import get_config
+from .metrics import timed, CHAT_HISTORY_SECONDS, CHAT_HISTORY_ERRORS
 
 
 class ChatHistoryHandler:
-    def __init__(self):
-        self.client = firestore.Client(project=config['google-firestore']['PROJECT_ID'])
-    
-    # function for fetching specific chat history
-    def fetch_chat_history(self, chat_session_id:str):
-        return FirestoreChatMessageHistory(session_id=chat_session_id,
-                                           collection=config['google-firestore']['COLLECTION_NAME'],
-                                           client=self.client)
-    
+    def __init__(self, backend=None):
+        # store of the chat history, selected with chat-history.backend in the config
+        self.backend = backend if backend is not None else get_chat_history_backend()
+
+        # write through cache of the recent chat sessions, reads are served locally and every write also updates the backend
+        config = get_config()
+        self.cache = TTLCache(maxsize=config.chat_history.cache.max_sessions, ttl=config.chat_history.cache.ttl)
+
+        # rolling summaries are only stored with the summary history policy
+        self.keeps_summary = config.history_policy.mode == 'summary'
+
+    # function for timing an operation of the backend, a cache hit does not reach the backend and is not timed
+    def _timed(self, operation):
+        return timed(CHAT_HISTORY_SECONDS, CHAT_HISTORY_ERRORS, type(self.backend).__name__, operation)
+
+    # function for appending messages to the chat history, the backend appends atomically and returns the stored history,
+    # so a cached copy missing the writes of another handler never overwrites them and is refreshed instead
+    def add_messages(self, chat_session_id, messages):
+        with self._timed("append_messages"):
+            chat_history = self.backend.append_messages(chat_session_id, messages)
+        self.cache.set(chat_session_id, chat_history)
+
     # function for adding human messages to the chat history
     def add_query(self, chat_session_id, query_text):
-        chat_history = self.fetch_chat_history(chat_session_id=chat_session_id)
-        chat_history.add_user_message(query_text)
-    
+        self.add_messages(chat_session_id=chat_session_id, messages=[HumanMessage(content=query_text)])
+
     # function for adding ai responses to the chat history
     def add_response(self, chat_session_id, response_text):
-        chat_history = self.fetch_chat_history(chat_session_id=chat_session_id)
-        chat_history.add_ai_message(response_text)
+        self.add_messages(chat_session_id=chat_session_id, messages=[AIMessage(content=response_text)])
+
+    # function for adding the user query and the ai response of one chat turn together
+    def add_turn(self, chat_session_id, query_text, response_text):
+        self.add_messages(chat_session_id=chat_session_id, messages=[HumanMessage(content=query_text), AIMessage(content=response_text)])
 
     # function to get the full chat history
     def get_chat_history(self, chat_session_id):
-        chat_history = self.fetch_chat_history(chat_session_id=chat_session_id)
-        return chat_history.messages
-    
+        chat_history = self.cache.get(chat_session_id)
+        if chat_history is None:
+            with self._timed("get_messages"):
+                chat_history = self.backend.get_messages(chat_session_id)
+            self.cache.set(chat_session_id, chat_history)
+        return list(chat_history)
+
     # function to clear chat history
     def delete_chat_history(self, chat_session_id):
-        chat_history = self.fetch_chat_history(chat_session_id=chat_session_id)
-        chat_history.clear()
+        self.cache.delete(chat_session_id)
+        with self._timed("delete"):
+            self.backend.delete(chat_session_id)
+        if self.keeps_summary:
+            self.set_summary(chat_session_id=chat_session_id, summary="", summarized=0)
+
+    # the rolling summary of a chat session is stored next to its history under its own session id
+    @staticmethod
+    def summary_session_id(chat_session_id):
+        return f"{chat_session_id}:summary"
+
+    # function to get the rolling summary of a chat session and the number of messages it covers
+    def get_summary(self, chat_session_id):
+        messages = self.get_chat_history(chat_session_id=self.summary_session_id(chat_session_id))
+        if messages:
+            return messages[0].content, messages[0].additional_kwargs.get("summarized_messages", 0)
+        return "", 0
+
+    # function for storing the rolling summary of a chat session
+    def set_summary(self, chat_session_id, summary, summarized):
+        summary_session_id = self.summary_session_id(chat_session_id)
+        messages = [SystemMessage(content=summary, additional_kwargs={"summarized_messages": summarized})] if summary else []
+        if messages:
+            with self._timed("set_messages"):
+                self.backend.set_messages(summary_session_id, messages)
+        else:
+            with self._timed("delete"):
+                self.backend.delete(summary_session_id)
+        self.cache.set(summary_session_id, messages)
+
+    # function for getting the hit/miss stats of the chat history cache
+    def cache_stats(self):
+        return self.cache.stats()
+
+    # async function to get the full chat history
+    async def aget_chat_history(self, chat_session_id):
+        chat_history = self.cache.get(chat_session_id)
+        if chat_history is None:
+            with self._timed("get_messages"):
+                chat_history = await self.backend.aget_messages(chat_session_id)
+            self.cache.set(chat_session_id, chat_history)
+        return list(chat_history)
+
+    # async function for appending messages to the chat history, the backend appends atomically
+    async def aadd_messages(self, chat_session_id, messages):
+        with self._timed("append_messages"):
+            chat_history = await self.backend.aappend_messages(chat_session_id, messages)
+        self.cache.set(chat_session_id, chat_history)
+
+    # async function for adding human messages to the chat history
+    async def aadd_query(self, chat_session_id, query_text):
+        await self.aadd_messages(chat_session_id=chat_session_id, messages=[HumanMessage(content=query_text)])
+
+    # async function for adding ai responses to the chat history
+    async def aadd_response(self, chat_session_id, response_text):
+        await self.aadd_messages(chat_session_id=chat_session_id, messages=[AIMessage(content=response_text)])
+
+    # async function for adding the user query and the ai response of one chat turn together
+    async def aadd_turn(self, chat_session_id, query_text, response_text):
+        await self.aadd_messages(chat_session_id=chat_session_id, messages=[HumanMessage(content=query_text), AIMessage(content=response_text)])
+
+    # async function to clear chat history
+    async def adelete_chat_history(self, chat_session_id):
+        self.cache.delete(chat_session_id)
+        with self._timed("delete"):
+            await self.backend.adelete(chat_session_id)
+        if self.keeps_summary:
+            await self.aset_summary(chat_session_id=chat_session_id, summary="", summarized=0)
+
+    # async function to get the rolling summary of a chat session and the number of messages it covers
+    async def aget_summary(self, chat_session_id):
+        messages = await self.aget_chat_history(chat_session_id=self.summary_session_id(chat_session_id))
+        if messages:
+            return messages[0].content, messages[0].additional_kwargs.get("summarized_messages", 0)
+        return "", 0
+
+    # async function for storing the rolling summary of a chat session
+    async def aset_summary(self, chat_session_id, summary, summarized):
+        summary_session_id = self.summary_session_id(chat_session_id)
+        messages = [SystemMessage(content=summary, additional_kwargs={"summarized_messages": summarized})] if summary else []
+        if messages:
+            with self._timed("set_messages"):
+                await self.backend.aset_messages(summary_session_id, messages)
+        else:
+            with self._timed("delete"):
+                await self.backend.adelete(summary_session_id)
+        self.cache.set(summary_session_id, messages)
+
+
+_chat_history_handler = None
+_chat_history_handler_lock = threading.Lock()
+
 
+# function for getting the chat history handler shared by the sync and the async agent, with one cache per process a
+# feedback message written by a dashboard view is seen by the next whatsapp turn, the caches of other processes sharing
+# the backend may miss it until their entry expires or their next write refreshes it
+def get_chat_history_handler():
+    global _chat_history_handler
+    if _chat_history_handler is None:
+        with _chat_history_handler_lock:
+            if _chat_history_handler is None:
+                _chat_history_handler = ChatHistoryHandler()
+    return _chat_history_handler
@@ -0,0 +1,70 @@
+import time
+import threading
+
+
+# function for starting a timer on a daemon thread, the timers of the coalescer of the worker threads
+def start_thread_timer(delay, callback):
+    timer = threading.Timer(delay, callback)
+    timer.daemon = True
+    timer.start()
+    return timer
+
+
+# debouncer merging the messages a sender writes in quick succession into one agent turn, a turn is started once the
+# sender has been quiet for window seconds, or max_wait seconds after the first message when they keep writing
+class MessageCoalescer:
+    def __init__(self, flush, window=2.0, max_wait=10.0, timer=start_thread_timer, clock=time.monotonic):
+        self.flush = flush    # function starting the turn, called as flush(key, messages, context)
+        self.window = window
+        self.max_wait = max_wait
+        self.__timer = timer    # function calling back after a delay, returns a handle with cancel()
+        self.__clock = clock
+        self.__pending = {}     # key -> {"messages", "context", "first_at", "timer"}
+        self.__lock = threading.Lock()
+        self.turns = 0
+        self.merged_turns = 0
+        self.messages = 0
+
+    # function for adding a message of a sender, the context of the first message is passed to flush
+    def add(self, key, message, **context):
+        if self.window <= 0:
+            self.__flush_batch(key, {"messages": [message], "context": context})
+            return
+        with self.__lock:
+            batch = self.__pending.get(key)
+            if batch is None:
+                batch = self.__pending[key] = {"messages": [], "context": context, "first_at": self.__clock(), "timer": None}
+            else:
+                batch["timer"].cancel()
+            batch["messages"].append(message)
+            delay = max(0.0, min(self.window, batch["first_at"] + self.max_wait - self.__clock()))
+            batch["timer"] = self.__timer(delay, lambda: self.__expire(key, batch))
+
+    # function called by the timer of a batch, a batch which has already been flushed is ignored
+    def __expire(self, key, batch):
+        with self.__lock:
+            if self.__pending.get(key) is not batch:
+                return
+            del self.__pending[key]
+        self.__flush_batch(key, batch)
+
+    def __flush_batch(self, key, batch):
+        with self.__lock:
+            self.turns += 1
+            self.messages += len(batch["messages"])
+            if len(batch["messages"]) > 1:
+                self.merged_turns += 1
+        self.flush(key, batch["messages"], batch["context"])
+
+    # function for getting the number of merged and single message turns
+    def stats(self):
+        with self.__lock:
+            return {
+                "window": self.window,
+                "pending_senders": len(self.__pending),
+                "turns": self.turns,
+                "merged_turns": self.merged_turns,
+                "single_turns": self.turns - self.merged_turns,
+                "messages": self.messages,
+                "turns_saved": self.messages - self.turns,
+            }
@@ -0,0 +1,215 @@
+import os
+import re
+import signal
+import logging
+import threading
+from pathlib import Path
+from typing import Literal, Optional
+
+import yaml
+from pydantic import BaseModel, field_validator
+from pydantic_settings import BaseSettings, SettingsConfigDict, PydanticBaseSettingsSource
+
+
+logger = logging.getLogger(__name__)
+
+# the config file is found next to manage.py whatever the working directory is, BOT_CONFIG_FILE points to another one
+CONFIG_FILE = Path(os.environ.get("BOT_CONFIG_FILE", Path(__file__).resolve().parent.parent / "config.yaml"))
+
+
+class ErrorMessagesConfig(BaseModel):
+    mode: Literal["template", "llm"] = "template"
+
+
+class ResultRendererConfig(BaseModel):
+    mode: Literal["template", "llm"] = "template"
+    style: Literal["whatsapp", "plain"] = "whatsapp"
+    language: Literal["en", "bn"] = "en"
+    cache_size: int = 256
+    updated_details: Literal["changes", "full"] = "changes"
+
+
+class PoolConfig(BaseModel):
+    name: str = "appointment-pool"
+    size: int = 5
+    checkout_timeout: float = 5
+    health_check: bool = True
+
+
+class DatabaseConfig(BaseModel):
+    host: str = "localhost"
+    user: str = "root"
+    password: Optional[str] = None
+    database: str = "db"
+    table: str = "mytable"
+    pool: PoolConfig = PoolConfig()
+
+    # the table name is put into the sql text, so it has to be a plain identifier
+    @field_validator("table")
+    def table_validate(cls, value):
+        if not re.fullmatch(r"[A-Za-z_][A-Za-z0-9_]*", value):
+            raise ValueError(f"{value!r} is not a valid table name")
+        return value
+
+
+class FirestoreConfig(BaseModel):
+    project_id: str = "appointment-schedule-manager"
+    session_id: str = "user1_session_new"
+    collection_name: str = "chat_history"
+
+
+class ChatHistoryCacheConfig(BaseModel):
+    max_sessions: int = 1024
+    ttl: float = 600
+
+
+class ChatHistoryConfig(BaseModel):
+    backend: Literal["firestore", "sqlite", "memory"] = "firestore"
+    sqlite_path: str = "chat_history.sqlite3"
+    cache: ChatHistoryCacheConfig = ChatHistoryCacheConfig()
+
+
+class HistoryPolicyConfig(BaseModel):
+    mode: Literal["all", "last-n", "token-budget", "summary"] = "last-n"
+    max_messages: int = 20
+    max_tokens: int = 2000
+
+
+class IntentRouterConfig(BaseModel):
+    enabled: bool = True
+
+
+class LLMPriceConfig(BaseModel):
+    model: str
+    prompt: float = 0       # usd per million prompt tokens
+    completion: float = 0   # usd per million completion tokens
+
+
+class InstrumentationConfig(BaseModel):
+    trace_log: bool = True
+    llm_prices: list[LLMPriceConfig] = []
+
+
+class TurnsConfig(BaseModel):
+    max_concurrent: int = 4
+
+
+class CoalescingConfig(BaseModel):
+    window: float = 2
+    max_wait: float = 10
+
+
+class JobQueueConfig(BaseModel):
+    backend: Literal["inprocess", "sqlite"] = "inprocess"
+    workers: int = 4
+    sqlite_path: str = "jobs.sqlite3"
+    lease_seconds: float = 60
+
+
+class AvailabilityConfig(BaseModel):
+    opening_time: str = "09:00"
+    closing_time: str = "21:00"
+    slot_minutes: int = 5
+    cache_days: int = 64
+    cache_ttl: float = 60
+
+
+class SearchCacheConfig(BaseModel):
+    max_entries: int = 2048
+    ttl: float = 300
+
+
+class IdempotencyConfig(BaseModel):
+    max_entries: int = 10000
+    ttl: float = 3600
+
+
+class NotificationsConfig(BaseModel):
+    rate_per_second: float = 1
+    burst: int = 1
+    max_retries: int = 4
+    backoff: float = 1
+    backoff_max: float = 30
+
+
+# function for turning the keys of the config file into field names, e.g. checkout-timeout -> checkout_timeout
+def normalize_keys(value):
+    if isinstance(value, dict):
+        return {str(key).replace("-", "_").lower(): normalize_keys(item) for key, item in value.items()}
+    return value
+
+
+# settings source reading the yaml config file
+class YamlConfigSource(PydanticBaseSettingsSource):
+    def get_field_value(self, field, field_name):
+        return None, field_name, False
+
+    def __call__(self):
+        with open(CONFIG_FILE, "r") as f:
+            return normalize_keys(yaml.safe_load(f) or {})
+
+
+# settings of the bot, read from config.yaml and overridden by BOT_ environment variables,
+# nested keys are separated by a double underscore, e.g. BOT_DATABASE__PASSWORD or BOT_HISTORY_POLICY__MODE
+class Settings(BaseSettings):
+    model_config = SettingsConfigDict(env_prefix="BOT_", env_nested_delimiter="__", extra="ignore")
+
+    agent_model_name: str
+    error_model_name: str
+    whatsapp_bot_number: str
+    error_messages: ErrorMessagesConfig = ErrorMessagesConfig()
+    result_renderer: ResultRendererConfig = ResultRendererConfig()
+    database: DatabaseConfig = DatabaseConfig()
+    google_firestore: FirestoreConfig = FirestoreConfig()
+    chat_history: ChatHistoryConfig = ChatHistoryConfig()
+    history_policy: HistoryPolicyConfig = HistoryPolicyConfig()
+    intent_router: IntentRouterConfig = IntentRouterConfig()
+    instrumentation: InstrumentationConfig = InstrumentationConfig()
+    turns: TurnsConfig = TurnsConfig()
+    coalescing: CoalescingConfig = CoalescingConfig()
+    job_queue: JobQueueConfig = JobQueueConfig()
+    availability: AvailabilityConfig = AvailabilityConfig()
+    search_cache: SearchCacheConfig = SearchCacheConfig()
+    idempotency: IdempotencyConfig = IdempotencyConfig()
+    notifications: NotificationsConfig = NotificationsConfig()
+
+    @classmethod
+    def settings_customise_sources(cls, settings_cls, init_settings, env_settings, dotenv_settings, file_secret_settings):
+        # environment variables take precedence over the config file
+        return init_settings, env_settings, YamlConfigSource(settings_cls)
+
+
+_config = None
+_config_lock = threading.Lock()
+
+
+# function for getting the settings shared by every module, the config file is parsed and validated once
+def get_config():
+    global _config
+    if _config is None:
+        with _config_lock:
+            if _config is None:
+                _config = Settings()
+    return _config
+
+
+# function for reading the config file again, values read on every call change at once,
+# the sizes of the pool, caches and job queue workers only change on restart
+def reload_config():
+    global _config
+    try:
+        config = Settings()
+    except Exception:
+        logger.exception("Reloading %s failed, the previous config is kept.", CONFIG_FILE)
+        return get_config()
+    with _config_lock:
+        _config = config
+    logger.info("Reloaded %s.", CONFIG_FILE)
+    return config
+
+
+# function for reloading the config on SIGHUP, signal handlers can only be installed from the main thread
+def install_reload_handler():
+    if hasattr(signal, "SIGHUP") and threading.current_thread() is threading.main_thread():
+        # the handler only starts the reload, it must not wait on a lock the interrupted code may hold
+        signal.signal(signal.SIGHUP, lambda signum, frame: threading.Thread(target=reload_config, daemon=True).start())
@@ -0,0 +1,120 @@
+import time
+import threading
+from contextlib import contextmanager
+
+from mysql.connector import pooling, errors
+
+from .config import get_config
+
+
+class ConnectionPool:
+    def __init__(self, name, size, checkout_timeout, health_check, **connection_kwargs):
+        self.__pool = pooling.MySQLConnectionPool(pool_name=name, pool_size=size, pool_reset_session=True, **connection_kwargs)
+        self.__size = size
+        self.__checkout_timeout = checkout_timeout
+        self.__health_check = health_check
+        self.__lock = threading.Lock()
+        self.__stats = {
+            "checkouts": 0,
+            "in_use": 0,
+            "waits": 0,
+            "timeouts": 0,
+            "reconnects": 0,
+            "errors": 0,
+        }
+
+    # function for updating a counter of the pool stats
+    def __count(self, key, amount=1):
+        with self.__lock:
+            self.__stats[key] += amount
+
+    # function for taking a connection out of the pool, waiting while every connection is busy
+    def __checkout(self):
+        deadline = time.monotonic() + self.__checkout_timeout
+        waited = False
+        while True:
+            try:
+                conn = self.__pool.get_connection()
+                break
+            except errors.PoolError:
+                if time.monotonic() >= deadline:
+                    self.__count("timeouts")
+                    raise
+                if not waited:
+                    self.__count("waits")
+                    waited = True
+                time.sleep(0.05)
+
+        # making sure the connection is still alive before handing it out
+        if self.__health_check:
+            try:
+                conn.ping(reconnect=False)
+            except errors.Error:
+                try:
+                    conn.reconnect(attempts=3, delay=1)
+                except errors.Error:
+                    conn.close()    # the dead connection still goes back to the pool, it is reconnected on its next checkout
+                    raise
+                self.__count("reconnects")
+        return conn
+
+    # context manager yielding a connection and cursor, the connection always goes back to the pool
+    @contextmanager
+    def connection(self):
+        conn = self.__checkout()
+        self.__count("checkouts")
+        self.__count("in_use")
+        cursor = None
+        try:
+            # created inside the try, a connection lost while opening the cursor is still returned to the pool
+            cursor = conn.cursor()
+            yield conn, cursor
+        except Exception:
+            self.__count("errors")
+            try:
+                conn.rollback()
+            except errors.Error:
+                pass
+            raise
+        finally:
+            try:
+                if cursor is not None:
+                    cursor.close()
+            finally:
+                conn.close()    # returns the connection to the pool
+                self.__count("in_use", -1)
+
+    # function for getting a snapshot of the pool stats
+    def stats(self):
+        with self.__lock:
+            stats = dict(self.__stats)
+        stats["size"] = self.__size
+        stats["idle"] = self.__size - stats["in_use"]
+        return stats
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+# function for getting the process wide connection pool, it is created on first use
+def get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                database_config = get_config().database
+                _pool = ConnectionPool(name=database_config.pool.name,
+                                       size=database_config.pool.size,
+                                       checkout_timeout=database_config.pool.checkout_timeout,
+                                       health_check=database_config.pool.health_check,
+                                       host=database_config.host,
+                                       user=database_config.user,
+                                       password=database_config.password,
+                                       database=database_config.database)
+    return _pool
+
+
+# function for getting the stats of the connection pool
+def get_pool_stats():
+    return get_pool().stats()
@@ -0,0 +1,68 @@
+import re
+import threading
+
+
+# field aware templates for the feedback messages of validation errors and tool exceptions
+ERROR_TEMPLATES = {
+    "user_id": "Invalid user ID. It should look like SC_01XXXXXXXXX_YYYYMMDD_HH_MM as given on booking. Please provide correct information.",
+    "phone_number": "Invalid phone number. {detail}Please provide correct information.",
+    "person_name": "Invalid person name. Please provide correct information.",
+    "age": "Invalid age. It should be between 20-100. Please provide correct information.",
+    "appointment_date": "Invalid appointment date. It must be in the format YYYY-MM-DD. Please provide correct information.",
+    "appointment_time": "Invalid appointment time. It must be in the format HH:MM or HH:MM:SS. Please provide correct information.",
+    "appointment_end_time": "Invalid appointment time. It must be in the format HH:MM or HH:MM:SS. Please provide correct information.",
+    "status": "Invalid appointment status. Please provide correct information.",
+    "default": "Sorry, we could not process your appointment request right now. Please verify your details and try again later.",
+}
+
+
+class ErrorMessageStats:
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.templated = 0    # messages served from the templates, each one is an llm call saved
+        self.rephrased = 0    # messages sent to the error generator llm
+
+    def count_templated(self):
+        with self.__lock:
+            self.templated += 1
+
+    def count_rephrased(self):
+        with self.__lock:
+            self.rephrased += 1
+
+    def snapshot(self):
+        with self.__lock:
+            return {"llm_calls_saved": self.templated, "llm_calls_made": self.rephrased}
+
+
+stats = ErrorMessageStats()
+
+
+# function for rendering the feedback message of a data field
+def render_error_message(field, detail=""):
+    template = ERROR_TEMPLATES.get(field, ERROR_TEMPLATES["default"])
+    return template.format(detail=f"{detail.strip()} " if detail else "")
+
+
+# function for finding out which data field produced an exception, e.g. "Data too long for column 'phone_number'"
+def field_from_exception(exception):
+    text = str(exception)
+    for field in ERROR_TEMPLATES:
+        if re.search(rf"\b{field}\b", text):
+            return field
+    return "default"
+
+
+# value returned by the validators for an invalid data field, it reads as the templated message but is told apart
+# from a real value by its type, the tools turn it into the feedback message when they answer
+class InvalidField(str):
+    def __new__(cls, field, detail=""):
+        invalid_field = super().__new__(cls, render_error_message(field=field, detail=detail))
+        invalid_field.field = field
+        invalid_field.detail = detail
+        return invalid_field
+
+
+# function to check whether a validated value is actually an invalid data field
+def is_error_message(value):
+    return isinstance(value, InvalidField)
@@ -0,0 +1,87 @@
+from langchain_core.messages import HumanMessage, SystemMessage
+
+
+# function for estimating the tokens of a message list, about four characters per token plus the message overhead
+def estimate_tokens(messages):
+    return sum(len(str(message.content)) // 4 + 4 for message in messages)
+
+
+# function for rendering messages as plain text for the summarizer
+def render_messages(messages):
+    return "\n".join(f"{'User' if isinstance(message, HumanMessage) else 'Assistant'}: {message.content}" for message in messages)
+
+
+# policy deciding which part of the chat history goes into the agent prompt
+class HistoryPolicy:
+    MODES = ("all", "last-n", "token-budget", "summary")
+
+    def __init__(self, chat_history_handler, mode="last-n", max_messages=20, max_tokens=2000, summary_chain=None):
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown history policy {mode}.")
+        self.chat_history_handler = chat_history_handler
+        self.mode = mode
+        self.max_messages = max_messages
+        self.max_tokens = max_tokens
+        self.summary_chain = summary_chain
+
+    # function for keeping the newest messages which fit in the token budget
+    def trim_to_budget(self, chat_history):
+        window = []
+        tokens = 0
+        for message in reversed(chat_history):
+            tokens += estimate_tokens([message])
+            if tokens > self.max_tokens:
+                break
+            window.append(message)
+        return window[::-1]
+
+    # function for selecting the messages given to the agent when no summary is used
+    def window(self, chat_history):
+        if self.mode == "all":
+            return chat_history
+        if self.mode == "token-budget":
+            return self.trim_to_budget(chat_history)
+        return chat_history[-self.max_messages:] if self.max_messages else []
+
+    # function for deciding which messages of the unsummarized part of the history have to be folded into the summary
+    def messages_to_fold(self, chat_history, summarized):
+        unsummarized = chat_history[summarized:]
+        if len(unsummarized) <= self.max_messages:
+            return []
+        # folding half of the window at once, so the summarizer runs every few turns instead of on every turn
+        return unsummarized[:len(unsummarized) - self.max_messages // 2]
+
+    @staticmethod
+    def with_summary(summary, window):
+        return [SystemMessage(content=f"Summary of the earlier conversation: {summary}")] + window if summary else window
+
+    # function for applying the policy to the chat history of a session
+    def apply(self, chat_session_id, chat_history):
+        if self.mode != "summary":
+            return self.window(chat_history)
+
+        # rolling summary stored alongside the history, only the messages leaving the window are summarized
+        summary, summarized = self.chat_history_handler.get_summary(chat_session_id=chat_session_id)
+        if summarized > len(chat_history):
+            summary, summarized = "", 0
+        fold = self.messages_to_fold(chat_history, summarized)
+        if fold:
+            summary = self.summary_chain.invoke(input={"summary": summary, "messages": render_messages(fold)})
+            summarized += len(fold)
+            self.chat_history_handler.set_summary(chat_session_id=chat_session_id, summary=summary, summarized=summarized)
+        return self.with_summary(summary, chat_history[summarized:])
+
+    # async function for applying the policy to the chat history of a session
+    async def aapply(self, chat_session_id, chat_history):
+        if self.mode != "summary":
+            return self.window(chat_history)
+
+        summary, summarized = await self.chat_history_handler.aget_summary(chat_session_id=chat_session_id)
+        if summarized > len(chat_history):
+            summary, summarized = "", 0
+        fold = self.messages_to_fold(chat_history, summarized)
+        if fold:
+            summary = await self.summary_chain.ainvoke(input={"summary": summary, "messages": render_messages(fold)})
+            summarized += len(fold)
+            await self.chat_history_handler.aset_summary(chat_session_id=chat_session_id, summary=summary, summarized=summarized)
+        return self.with_summary(summary, chat_history[summarized:])
@@ -0,0 +1,56 @@
+import threading
+
+from .cache import TTLCache
+from .config import get_config
+
+
+# store of the inbound messages already taken in, twilio retries a webhook with the same MessageSid when it
+# does not get an answer in time, the retry is answered from here instead of running the agent again
+class IdempotencyStore:
+    def __init__(self, maxsize=10000, ttl=3600):
+        self.messages = TTLCache(maxsize=maxsize, ttl=ttl)    # message id -> {"state": "processing"|"done", "reply": ...}
+        self.duplicates = 0
+        self.__lock = threading.Lock()
+
+    # function for claiming a message id, returns None for a new message and the stored record for a duplicate
+    def claim(self, message_id):
+        with self.__lock:
+            record = self.messages.get(message_id)
+            if record is None:
+                self.messages.set(message_id, {"state": "processing", "reply": None})
+                return None
+            self.duplicates += 1
+            return dict(record)
+
+    # function for storing the reply computed for a message
+    def complete(self, message_id, reply):
+        with self.__lock:
+            self.messages.set(message_id, {"state": "done", "reply": reply})
+
+    # function for getting the stored reply of a message, None when it is unknown or still processing
+    def reply(self, message_id):
+        record = self.messages.get(message_id)
+        return None if record is None else record["reply"]
+
+    # function for forgetting a message whose processing failed, so a retry of it is processed again
+    def release(self, message_id):
+        self.messages.delete(message_id)
+
+    # function for getting the stats of the store
+    def stats(self):
+        return {**self.messages.stats(), "duplicates": self.duplicates}
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+# function for getting the process wide idempotency store, configured in the idempotency section of the config
+def get_idempotency_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                idempotency_config = get_config().idempotency
+                _store = IdempotencyStore(maxsize=idempotency_config.max_entries, ttl=idempotency_config.ttl)
+    return _store
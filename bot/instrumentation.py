@@ -0,0 +1,161 @@
+import json
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from langchain_core.callbacks import BaseCallbackHandler
+from prometheus_client import Counter, Histogram
+
+from .config import get_config
+
+
+trace_logger = logging.getLogger("bot.trace")
+
+
+LLM_CALL_SECONDS = Histogram("bot_llm_call_seconds", "Latency of the calls to the llm.", ["chain", "model"],
+                             buckets=(0.1, 0.25, 0.5, 1, 2, 4, 8, 16, 32))
+LLM_TOKENS = Counter("bot_llm_tokens", "Tokens sent to and generated by the llm.", ["chain", "model", "kind"])
+LLM_COST = Counter("bot_llm_cost_usd", "Estimated cost of the llm calls, from the prices in the config.", ["chain", "model"])
+LLM_ERRORS = Counter("bot_llm_errors", "Failed calls to the llm.", ["chain", "model"])
+TOOL_CALL_SECONDS = Histogram("bot_tool_call_seconds", "Latency of the agent tools.", ["tool"],
+                              buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8))
+TOOL_ERRORS = Counter("bot_tool_errors", "Agent tool calls which raised.", ["tool"])
+
+
+# steps of the chat turn being answered, every llm and tool call made while answering it is added to it
+_current_turn = ContextVar("current_turn", default=None)
+
+
+# trace of one chat turn, logged as a json line when the turn is done
+class TurnTrace:
+    def __init__(self, chat_session_id):
+        self.chat_session_id = chat_session_id
+        self.started = time.monotonic()
+        self.steps = []
+        self.__lock = threading.Lock()
+
+    def add(self, step):
+        with self.__lock:
+            self.steps.append(step)
+
+    def summary(self):
+        with self.__lock:
+            steps = list(self.steps)
+        return {
+            "chat_session_id": self.chat_session_id,
+            "seconds": round(time.monotonic() - self.started, 4),
+            "llm_calls": sum(1 for step in steps if step["type"] == "llm"),
+            "tool_calls": sum(1 for step in steps if step["type"] == "tool"),
+            "slowest": max(steps, key=lambda step: step["seconds"], default=None),
+            "steps": steps,
+        }
+
+
+# context manager tracing the llm and tool calls of a chat turn, the trace is logged to the bot.trace logger
+@contextmanager
+def traced_turn(chat_session_id):
+    trace = TurnTrace(chat_session_id)
+    token = _current_turn.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_turn.reset(token)
+        # turns answered by the intent router make no llm or tool call and are not logged
+        if trace.steps and get_config().instrumentation.trace_log:
+            trace_logger.info(json.dumps(trace.summary(), default=str))
+
+
+# function for getting the prompt and completion tokens of an llm response, groq reports them in llm_output,
+# streamed responses only carry them in the usage metadata of the message
+def token_usage(response):
+    usage = (response.llm_output or {}).get("token_usage") or {}
+    if usage:
+        return usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0)
+    for generations in response.generations:
+        for generation in generations:
+            usage_metadata = getattr(getattr(generation, "message", None), "usage_metadata", None)
+            if usage_metadata:
+                return usage_metadata.get("input_tokens", 0), usage_metadata.get("output_tokens", 0)
+    return 0, 0
+
+
+# function for estimating the cost of an llm call from the llm-prices of the config, in usd
+def llm_cost(model, prompt_tokens, completion_tokens):
+    for price in get_config().instrumentation.llm_prices:
+        if price.model == model:
+            return (prompt_tokens * price.prompt + completion_tokens * price.completion) / 1_000_000
+    return 0.0
+
+
+# callback handler timing every llm and tool call of the agent and the chains, the chain name comes from the
+# "chain" metadata given to the runnable with with_config
+class LLMInstrumentation(BaseCallbackHandler):
+    run_inline = True    # the handler does not block, async runs call it on the event loop instead of a thread
+
+    def __init__(self):
+        self.__runs = {}    # run id -> (started at, step)
+        self.__lock = threading.Lock()
+
+    def __start(self, run_id, step):
+        with self.__lock:
+            self.__runs[run_id] = (time.monotonic(), step)
+
+    def __finish(self, run_id):
+        with self.__lock:
+            started, step = self.__runs.pop(run_id, (None, None))
+        if step is None:
+            return None
+        step["seconds"] = round(time.monotonic() - started, 4)
+        trace = _current_turn.get()
+        if trace is not None:
+            trace.add(step)
+        return step
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, parent_run_id=None, tags=None, metadata=None, **kwargs):
+        metadata = metadata or {}
+        model = metadata.get("ls_model_name") or (serialized or {}).get("kwargs", {}).get("model_name", "unknown")
+        self.__start(run_id, {"type": "llm", "chain": metadata.get("chain", "unknown"), "model": model})
+
+    def on_llm_end(self, response, *, run_id, parent_run_id=None, **kwargs):
+        started_step = self.__finish(run_id)
+        if started_step is None:
+            return
+        chain, model = started_step["chain"], started_step["model"]
+        prompt_tokens, completion_tokens = token_usage(response)
+        started_step.update(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+        LLM_CALL_SECONDS.labels(chain, model).observe(started_step["seconds"])
+        LLM_TOKENS.labels(chain, model, "prompt").inc(prompt_tokens)
+        LLM_TOKENS.labels(chain, model, "completion").inc(completion_tokens)
+        LLM_COST.labels(chain, model).inc(llm_cost(model, prompt_tokens, completion_tokens))
+
+    def on_llm_error(self, error, *, run_id, parent_run_id=None, **kwargs):
+        step = self.__finish(run_id)
+        if step is not None:
+            step["error"] = type(error).__name__
+            LLM_ERRORS.labels(step["chain"], step["model"]).inc()
+
+    def on_tool_start(self, serialized, input_str, *, run_id, parent_run_id=None, tags=None, metadata=None, inputs=None, **kwargs):
+        self.__start(run_id, {"type": "tool", "tool": (serialized or {}).get("name") or kwargs.get("name", "unknown")})
+
+    def on_tool_end(self, output, *, run_id, parent_run_id=None, **kwargs):
+        step = self.__finish(run_id)
+        if step is not None:
+            TOOL_CALL_SECONDS.labels(step["tool"]).observe(step["seconds"])
+
+    def on_tool_error(self, error, *, run_id, parent_run_id=None, **kwargs):
+        step = self.__finish(run_id)
+        if step is not None:
+            step["error"] = type(error).__name__
+            TOOL_CALL_SECONDS.labels(step["tool"]).observe(step["seconds"])
+            TOOL_ERRORS.labels(step["tool"]).inc()
+
+
+# the handler shared by the agents and the chains
+llm_instrumentation = LLMInstrumentation()
+
+
+# function for giving a runnable the instrumentation callback and the chain name of its llm calls
+def instrumented(runnable, chain):
+    return runnable.with_config(callbacks=[llm_instrumentation], metadata={"chain": chain})
@@ -0,0 +1,274 @@
+import os
+import json
+import time
+import uuid
+import queue
+import socket
+import sqlite3
+import logging
+import threading
+import zlib
+
+from .config import get_config
+
+
+logger = logging.getLogger(__name__)
+
+
+# registry of the functions which can be run as background jobs, keyed by job name
+JOBS = {}
+# queue of the jobs which do not run on the shared workers, keyed by job name
+JOB_QUEUES = {}
+
+# job being run by the current worker thread, read by get_checkpoint and save_checkpoint
+_running = threading.local()
+
+
+# decorator for registering a function as a background job, the jobs of a named queue run on a worker of their own
+# so a long job like a bulk notification send does not hold up the jobs sharing its shard
+def register_job(name, queue=None):
+    def decorator(func):
+        JOBS[name] = func
+        if queue:
+            JOB_QUEUES[name] = queue
+        return func
+    return decorator
+
+
+# function for getting the checkpoint the running job saved before, None when it starts for the first time or when
+# the function is not running as a job
+def get_checkpoint():
+    if getattr(_running, "job_queue", None) is None:
+        return None
+    return _running.job_queue._get_checkpoint(_running.job_id)
+
+
+# function for saving the progress of the running job, a job resumed after a restart gets it back from get_checkpoint
+def save_checkpoint(checkpoint):
+    if getattr(_running, "job_queue", None) is not None:
+        _running.job_queue._save_checkpoint(_running.job_id, checkpoint)
+
+
+# job queue running jobs on worker threads, jobs with the same key always run on the same worker one after another
+class InProcessJobQueue:
+    def __init__(self, workers=4):
+        self._queues = [queue.Queue() for _ in range(workers)]
+        self._named_queues = {}     # queue name -> queue of its own worker, started with the first job of that queue
+        self._checkpoints = {}
+        self._held = {}     # job id -> (key, name) of the jobs waiting for release
+        self._lock = threading.Lock()
+        self._next_id = 0
+        for index, job_queue in enumerate(self._queues):
+            threading.Thread(target=self._work, args=(job_queue,), name=f"job-worker-{index}", daemon=True).start()
+
+    # function for picking the worker of a job, so the jobs of one sender keep their order
+    def _shard(self, key, name):
+        if name in JOB_QUEUES:
+            with self._lock:
+                if JOB_QUEUES[name] not in self._named_queues:
+                    job_queue = self._named_queues[JOB_QUEUES[name]] = queue.Queue()
+                    threading.Thread(target=self._work, args=(job_queue,), name=f"job-worker-{JOB_QUEUES[name]}", daemon=True).start()
+                return self._named_queues[JOB_QUEUES[name]]
+        return self._queues[zlib.crc32(key.encode()) % len(self._queues)]
+
+    def _new_id(self, key, name, kwargs):
+        with self._lock:
+            self._next_id += 1
+            return self._next_id
+
+    # function for adding a job to the queue, returns the job id
+    def enqueue(self, key, name, **kwargs):
+        if name not in JOBS:
+            raise KeyError(f"Unknown job {name}.")
+        job_id = self._new_id(key, name, kwargs)
+        self._shard(key, name).put((job_id, name, kwargs))
+        return job_id
+
+    # function for adding a job which only runs once it is released, the job is stored right away so a held job of the
+    # sqlite queue is resumed after a restart like any other unfinished job, returns the job id
+    def hold(self, key, name, **kwargs):
+        if name not in JOBS:
+            raise KeyError(f"Unknown job {name}.")
+        job_id = self._new_id(key, name, kwargs)
+        with self._lock:
+            self._held[job_id] = (key, name)
+        return job_id
+
+    # function for running held jobs as one job with the given arguments, it takes the id of the first of them
+    def release(self, job_ids, **kwargs):
+        with self._lock:
+            key, name = self._held.pop(job_ids[0])
+            for job_id in job_ids[1:]:
+                self._held.pop(job_id)
+        self._merge(job_ids, kwargs)
+        self._shard(key, name).put((job_ids[0], name, kwargs))
+
+    def _merge(self, job_ids, kwargs):
+        pass
+
+    def _get_checkpoint(self, job_id):
+        with self._lock:
+            return self._checkpoints.get(job_id)
+
+    def _save_checkpoint(self, job_id, checkpoint):
+        with self._lock:
+            self._checkpoints[job_id] = checkpoint
+
+    # function for running a job, failures are logged so a worker never dies
+    def _run(self, job_id, name, kwargs):
+        _running.job_queue, _running.job_id = self, job_id
+        try:
+            JOBS[name](**kwargs)
+            return None
+        except Exception as e:
+            logger.exception("Job %s (%s) failed.", job_id, name)
+            return str(e)
+        finally:
+            _running.job_queue = _running.job_id = None
+            with self._lock:
+                self._checkpoints.pop(job_id, None)
+
+    def _work(self, job_queue):
+        while True:
+            job_id, name, kwargs = job_queue.get()
+            try:
+                self._run(job_id, name, kwargs)
+            finally:
+                job_queue.task_done()
+
+    # function for blocking until every queued job has been processed
+    def join(self):
+        with self._lock:
+            job_queues = self._queues + list(self._named_queues.values())
+        for job_queue in job_queues:
+            job_queue.join()
+
+
+# job queue storing the jobs in a sqlite table, unfinished jobs are resumed when the queue starts again, several
+# processes may share the table, every job is leased to the process which queued or resumed it and renews the lease
+# while it is alive, only the jobs whose lease expired are taken over by another process
+class SQLiteJobQueue(InProcessJobQueue):
+    def __init__(self, path="jobs.sqlite3", workers=4, lease_seconds=60.0, clock=time.time):
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db_lock = threading.Lock()
+        self._owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._lease_seconds = lease_seconds
+        self._clock = clock
+        self._stopped = threading.Event()
+        with self._db_lock:
+            self._db.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                key TEXT NOT NULL,
+                name TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                error TEXT,
+                checkpoint TEXT,
+                owner TEXT,
+                heartbeat REAL
+            )""")
+            # job tables created before the checkpoint and lease columns were added
+            columns = [row[1] for row in self._db.execute("PRAGMA table_info(jobs)")]
+            for column, column_type in (("checkpoint", "TEXT"), ("owner", "TEXT"), ("heartbeat", "REAL")):
+                if column not in columns:
+                    self._db.execute(f"ALTER TABLE jobs ADD COLUMN {column} {column_type}")
+        super().__init__(workers=workers)
+
+        # resuming the jobs which were not finished before the last shutdown
+        self._resume_expired()
+        threading.Thread(target=self._renew_leases, name="job-lease", daemon=True).start()
+
+    # function for taking over the unfinished jobs whose owner has not renewed their lease, jobs stored before the
+    # lease columns were added have no owner and are taken over as well
+    def _resume_expired(self):
+        now = self._clock()
+        with self._db_lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                expired = self._db.execute("""
+                SELECT id, key, name, payload FROM jobs
+                WHERE status IN ('pending', 'running') AND (owner IS NULL OR owner != ?) AND (heartbeat IS NULL OR heartbeat < ?)
+                ORDER BY id""", (self._owner, now - self._lease_seconds)).fetchall()
+                self._db.executemany("UPDATE jobs SET owner = ?, heartbeat = ? WHERE id = ?", [(self._owner, now, row[0]) for row in expired])
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+        for job_id, key, name, payload in expired:
+            logger.info("Resuming job %s (%s).", job_id, name)
+            self._shard(key, name).put((job_id, name, json.loads(payload)))
+
+    # function renewing the lease of the unfinished jobs of this queue and taking over the jobs of stopped processes,
+    # runs on a thread of its own until the queue is stopped
+    def _renew_leases(self):
+        while not self._stopped.wait(self._lease_seconds / 3):
+            try:
+                with self._db_lock:
+                    self._db.execute("UPDATE jobs SET heartbeat = ? WHERE owner = ? AND status IN ('pending', 'running')",
+                                     (self._clock(), self._owner))
+                self._resume_expired()
+            except sqlite3.Error:
+                logger.exception("Renewing the job leases failed.")
+
+    # function for stopping the lease renewal, the unfinished jobs are taken over by another process once their lease expires
+    def stop(self):
+        self._stopped.set()
+
+    def _new_id(self, key, name, kwargs):
+        with self._db_lock:
+            cursor = self._db.execute("INSERT INTO jobs (key, name, payload, owner, heartbeat) VALUES (?, ?, ?, ?, ?)",
+                                      (key, name, json.dumps(kwargs), self._owner, self._clock()))
+            return cursor.lastrowid
+
+    # the merged jobs are marked in the same transaction the first one takes their arguments, a restart never runs
+    # a message twice or loses it
+    def _merge(self, job_ids, kwargs):
+        with self._db_lock:
+            self._db.execute("BEGIN")
+            try:
+                self._db.execute("UPDATE jobs SET payload = ? WHERE id = ?", (json.dumps(kwargs), job_ids[0]))
+                self._db.executemany("UPDATE jobs SET status = 'merged', error = ? WHERE id = ?",
+                                     [(f"merged into job {job_ids[0]}", job_id) for job_id in job_ids[1:]])
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def _get_checkpoint(self, job_id):
+        with self._db_lock:
+            row = self._db.execute("SELECT checkpoint FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return None if row is None or row[0] is None else json.loads(row[0])
+
+    def _save_checkpoint(self, job_id, checkpoint):
+        with self._db_lock:
+            self._db.execute("UPDATE jobs SET checkpoint = ? WHERE id = ?", (json.dumps(checkpoint), job_id))
+
+    def _set_status(self, job_id, status, error=None):
+        with self._db_lock:
+            self._db.execute("UPDATE jobs SET status = ?, error = ? WHERE id = ?", (status, error, job_id))
+
+    def _run(self, job_id, name, kwargs):
+        self._set_status(job_id, "running")
+        error = super()._run(job_id, name, kwargs)
+        self._set_status(job_id, "failed" if error else "done", error)
+        return error
+
+
+_job_queue = None
+_job_queue_lock = threading.Lock()
+
+
+# function for getting the process wide job queue, the backend is selected from the config
+def get_job_queue():
+    global _job_queue
+    if _job_queue is None:
+        with _job_queue_lock:
+            if _job_queue is None:
+                queue_config = get_config().job_queue
+                if queue_config.backend == "sqlite":
+                    _job_queue = SQLiteJobQueue(path=queue_config.sqlite_path, workers=queue_config.workers,
+                                                lease_seconds=queue_config.lease_seconds)
+                else:
+                    _job_queue = InProcessJobQueue(workers=queue_config.workers)
+    return _job_queue
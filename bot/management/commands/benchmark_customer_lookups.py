@@ -0,0 +1,124 @@
+import random
+import statistics
+import time
+from datetime import date, datetime, time as day_time, timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from bot.models import Customer
+
+
+# the hot queries of the tools and the dashboard, run with the same shape of parameters as in production
+LOOKUPS = {
+    "tool lookup by user_id": (
+        "SELECT * FROM mytable WHERE user_id = %s",
+        lambda row: (row.user_id,),
+    ),
+    "insert_data booking identity": (
+        "SELECT serial_no FROM mytable WHERE phone_number = %s AND appointment_date = %s AND appointment_time = %s",
+        lambda row: (row.phone_number, row.appointment_date, row.appointment_time),
+    ),
+    "dashboard status + date range": (
+        "SELECT * FROM mytable WHERE status = %s AND appointment_date BETWEEN %s AND %s "
+        "ORDER BY appointment_date, appointment_time, serial_no LIMIT 25",
+        lambda row: (row.status, row.appointment_date, row.appointment_date + timedelta(days=7)),
+    ),
+    "dashboard phone filter": (
+        "SELECT * FROM mytable WHERE phone_number LIKE %s ORDER BY serial_no DESC LIMIT 25",
+        lambda row: (row.phone_number[:8] + "%",),
+    ),
+    "appointments of a day": (
+        "SELECT appointment_time, appointment_end_time FROM mytable WHERE appointment_date = %s ORDER BY appointment_time",
+        lambda row: (row.appointment_date,),
+    ),
+}
+
+
+# management command seeding the customer table and timing the hot lookups without and with the indexes and constraints of the model
+class Command(BaseCommand):
+    help = ("Seeds the customer table and reports the latency of the hot lookups without and with the lookup indexes. "
+            "Run it against a scratch database, the indexes are dropped while measuring.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=1_000_000, help="number of customers to seed")
+        parser.add_argument("--repeat", type=int, default=50, help="executions of every lookup")
+        parser.add_argument("--batch-size", type=int, default=10_000)
+        parser.add_argument("--keep", action="store_true", help="keep the seeded rows")
+
+    # function for seeding customers, they are named "Benchmark customer <n>" so they can be removed again
+    def seed(self, rows, batch_size):
+        statuses = [status for status, _ in Customer.STATUS_CHOICES]
+        first_day = date.today() - timedelta(days=365)
+        for start in range(0, rows, batch_size):
+            customers = []
+            for number in range(start, min(start + batch_size, rows)):
+                phone_number = f"019{number:08d}"
+                appointment_date = first_day + timedelta(days=random.randrange(730))
+                appointment_time = day_time(hour=random.randrange(9, 21), minute=random.randrange(0, 60, 5))
+                customers.append(Customer(user_id=f"SC_{phone_number}_{appointment_date:%Y%m%d}_{appointment_time.hour:02d}_{appointment_time.minute:02d}",
+                                          phone_number=phone_number,
+                                          person_name=f"Benchmark customer {number}",
+                                          age=random.randrange(20, 100),
+                                          appointment_date=appointment_date,
+                                          appointment_time=appointment_time,
+                                          appointment_end_time=(datetime_of(appointment_time) + timedelta(minutes=5)).time(),
+                                          status=random.choice(statuses)))
+            Customer.objects.bulk_create(customers, ignore_conflicts=True)
+            self.stdout.write(f"Seeded {min(start + batch_size, rows)}/{rows} customers.", ending="\r")
+        self.stdout.write("")
+
+    # function for timing every lookup with parameters taken from random seeded rows
+    def measure(self, samples, repeat):
+        results = {}
+        with connection.cursor() as cursor:
+            for name, (query, parameters) in LOOKUPS.items():
+                timings = []
+                for index in range(repeat):
+                    values = [value.isoformat() if isinstance(value, (date, day_time)) else value for value in parameters(samples[index % len(samples)])]
+                    started = time.perf_counter()
+                    cursor.execute(query, values)
+                    cursor.fetchall()
+                    timings.append((time.perf_counter() - started) * 1000)
+                timings.sort()
+                results[name] = (statistics.median(timings), timings[int(len(timings) * 0.95) - 1] if len(timings) > 1 else timings[0])
+        return results
+
+    def handle(self, *args, **options):
+        if options["rows"]:
+            self.seed(options["rows"], options["batch_size"])
+        samples = list(Customer.objects.order_by("?")[:options["repeat"]])
+        if not samples:
+            self.stderr.write("The customer table is empty.")
+            return
+
+        indexes = Customer._meta.indexes
+        constraints = Customer._meta.constraints
+        try:
+            with connection.schema_editor() as schema_editor:
+                for index in indexes:
+                    schema_editor.remove_index(Customer, index)
+                for constraint in constraints:
+                    schema_editor.remove_constraint(Customer, constraint)
+            without_indexes = self.measure(samples, options["repeat"])
+        finally:
+            with connection.schema_editor() as schema_editor:
+                for index in indexes:
+                    schema_editor.add_index(Customer, index)
+                for constraint in constraints:
+                    schema_editor.add_constraint(Customer, constraint)
+        with_indexes = self.measure(samples, options["repeat"])
+
+        self.stdout.write(f"{Customer.objects.count()} customers, {options['repeat']} executions per lookup, median / p95 in ms")
+        self.stdout.write(f"{'lookup':<32}{'without indexes':>24}{'with indexes':>24}")
+        for name in LOOKUPS:
+            before, after = without_indexes[name], with_indexes[name]
+            self.stdout.write(f"{name:<32}{before[0]:>12.2f} / {before[1]:>8.2f}{after[0]:>12.2f} / {after[1]:>8.2f}")
+
+        if options["rows"] and not options["keep"]:
+            Customer.objects.filter(person_name__startswith="Benchmark customer ").delete()
+
+
+# function for turning a time of day into a datetime to do time arithmetic
+def datetime_of(value):
+    return datetime.combine(date.today(), value)
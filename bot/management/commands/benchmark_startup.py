@@ -0,0 +1,56 @@
+import os
+import subprocess
+import sys
+
+from django.core.management.base import BaseCommand
+
+
+# code run in a fresh interpreter, importing the views the way a worker does on boot
+STARTUP = "import django; django.setup(); import bot.views"
+FIRST_USE = STARTUP + "; bot.views.get_database_agent(); bot.views.get_twilio_client()"
+
+
+# function for parsing the output of python -X importtime into {module: (self us, cumulative us)}
+def parse_importtime(output):
+    modules = {}
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, module = line[len("import time:"):].split("|")
+        modules[module.strip()] = (int(self_us), int(cumulative_us))
+    return modules
+
+
+# management command reporting the import time of the views and the cost moved to the first request by the lazy clients
+class Command(BaseCommand):
+    help = "Reports python -X importtime of bot.views and the time of creating the agent and twilio client on first use."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--top", type=int, default=15, help="slowest modules to list")
+        parser.add_argument("--first-use", action="store_true", help="also create the agent and twilio client, needs the credentials")
+
+    # function for running code in a fresh interpreter with -X importtime
+    def importtime(self, code):
+        process = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                                 capture_output=True, text=True, env=dict(os.environ), cwd=os.getcwd())
+        if process.returncode != 0:
+            self.stderr.write(process.stderr.splitlines()[-1] if process.stderr else "The interpreter failed.")
+            return None
+        return parse_importtime(process.stderr)
+
+    def handle(self, *args, **options):
+        modules = self.importtime(STARTUP)
+        if modules is None:
+            return
+
+        self.stdout.write(f"import bot.views: {modules['bot.views'][1] / 1000:.1f} ms cumulative")
+        self.stdout.write(f"{'module':<48}{'self ms':>10}{'cumulative ms':>16}")
+        for module, (self_us, cumulative_us) in sorted(modules.items(), key=lambda item: item[1][0], reverse=True)[:options["top"]]:
+            self.stdout.write(f"{module:<48}{self_us / 1000:>10.1f}{cumulative_us / 1000:>16.1f}")
+
+        if options["first_use"]:
+            first_use = self.importtime(FIRST_USE)
+            if first_use is not None:
+                extra = set(first_use) - set(modules)
+                self.stdout.write(f"modules imported on first use of the clients: {len(extra)}, "
+                                  f"{sum(first_use[module][0] for module in extra) / 1000:.1f} ms")
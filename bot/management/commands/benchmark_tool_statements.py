@@ -0,0 +1,123 @@
+import random
+import statistics
+import time
+from contextlib import contextmanager
+from datetime import date, datetime, time as day_time, timedelta
+from unittest import mock
+
+from django.core.management.base import BaseCommand
+
+from bot import tools
+from bot.config import get_config
+from bot.dbpool import get_pool
+from bot.models import Customer
+
+
+# statements the update_data and delete_data tools issued before they were rewritten around affected row counts
+LEGACY = {
+    "update_data": lambda table, user_id, person_name: [
+        (f"SELECT * FROM {table} WHERE user_id = %s", (user_id,)),
+        (f"UPDATE {table} SET person_name = %s WHERE user_id = %s", (person_name, user_id)),
+        (f"SELECT * FROM {table} WHERE user_id = %s", (user_id,)),
+    ],
+    "delete_data": lambda table, user_id, person_name: [
+        (f"SELECT * FROM {table} WHERE user_id = %s", (user_id,)),
+        (f"DELETE FROM {table} WHERE user_id = %s", (user_id,)),
+    ],
+}
+
+
+# cursor counting the statements executed through it
+class CountingCursor:
+    def __init__(self, cursor, counter):
+        self.__cursor = cursor
+        self.__counter = counter
+
+    def execute(self, *args, **kwargs):
+        self.__counter[0] += 1
+        return self.__cursor.execute(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.__cursor, name)
+
+
+# management command timing the database round trips of an update and a cancel turn, the legacy statements against the tools
+class Command(BaseCommand):
+    help = ("Seeds customers and reports the latency and statements per call of update_data and delete_data "
+            "against the statements they used to issue. Run it against a scratch database.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--repeat", type=int, default=200, help="calls of every path")
+
+    # function for seeding customers, they are named "Benchmark customer <n>" so they can be removed again
+    def seed(self, rows):
+        customers = []
+        appointment_date = date.today() + timedelta(days=3650)    # far away from real bookings and their slots
+        for number in range(rows):
+            phone_number = f"016{number:08d}"
+            appointment_time = day_time(hour=9 + number % 12, minute=5 * (number % 12))
+            customers.append(Customer(user_id=f"SC_{phone_number}_{appointment_date:%Y%m%d}_{appointment_time.hour:02d}_{appointment_time.minute:02d}",
+                                      phone_number=phone_number,
+                                      person_name=f"Benchmark customer {number}",
+                                      age=random.randrange(20, 100),
+                                      appointment_date=appointment_date,
+                                      appointment_time=appointment_time,
+                                      appointment_end_time=(datetime.combine(appointment_date, appointment_time) + timedelta(minutes=5)).time()))
+        Customer.objects.bulk_create(customers)
+        return [customer.user_id for customer in customers]
+
+    # function for timing the legacy statements of a tool on a pooled connection
+    def legacy(self, name, user_ids):
+        timings = []
+        for index, user_id in enumerate(user_ids):
+            statements = LEGACY[name](get_config().database.table, user_id, f"Benchmark customer legacy {index}")
+            started = time.perf_counter()
+            with get_pool().connection() as (conn, cursor):
+                for query, parameters in statements:
+                    cursor.execute(query, parameters)
+                    if query.startswith("SELECT"):
+                        cursor.fetchall()
+                    else:
+                        conn.commit()
+            timings.append((time.perf_counter() - started) * 1000)
+        return timings, len(statements)
+
+    # function for timing a tool while counting the statements it executes
+    def tool(self, name, user_ids):
+        counter = [0]
+
+        @contextmanager
+        def counting_connection():
+            with get_pool().connection() as (conn, cursor):
+                yield conn, CountingCursor(cursor, counter)
+
+        timings = []
+        with mock.patch.object(tools, "get_connection", counting_connection):
+            for index, user_id in enumerate(user_ids):
+                arguments = {"user_id": user_id}
+                if name == "update_data":
+                    arguments["person_name"] = f"Benchmark customer tool {index}"
+                started = time.perf_counter()
+                getattr(tools, name).invoke(arguments)
+                timings.append((time.perf_counter() - started) * 1000)
+        return timings, counter[0] / len(user_ids)
+
+    def handle(self, *args, **options):
+        repeat = options["repeat"]
+        user_ids = self.seed(repeat * 2)
+        try:
+            get_pool()    # opening the pool before timing
+            results = {
+                "update_data legacy": self.legacy("update_data", user_ids[:repeat]),
+                "update_data": self.tool("update_data", user_ids[:repeat]),
+                "delete_data legacy": self.legacy("delete_data", user_ids[:repeat]),
+                "delete_data": self.tool("delete_data", user_ids[repeat:]),
+            }
+        finally:
+            Customer.objects.filter(person_name__startswith="Benchmark customer ").delete()
+
+        self.stdout.write(f"{repeat} calls per path, latency in ms")
+        self.stdout.write(f"{'path':<24}{'statements':>12}{'median':>10}{'p95':>10}")
+        for name, (timings, statements) in results.items():
+            timings.sort()
+            self.stdout.write(f"{name:<24}{statements:>12.1f}{statistics.median(timings):>10.2f}{timings[int(len(timings) * 0.95) - 1]:>10.2f}")
@@ -0,0 +1,146 @@
+import time
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction
+from django.utils.decorators import sync_and_async_middleware
+from prometheus_client import Counter, Histogram, REGISTRY
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+
+VIEW_SECONDS = Histogram("bot_view_seconds", "Latency of the django views, until the response headers for a streamed response.",
+                         ["view", "method", "status"], buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30))
+DB_QUERY_SECONDS = Histogram("bot_db_query_seconds", "Latency of the mysql statements of the agent tools.", ["statement"],
+                             buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1))
+DB_QUERY_ERRORS = Counter("bot_db_query_errors", "Mysql statements of the agent tools which raised.", ["statement"])
+CHAT_HISTORY_SECONDS = Histogram("bot_chat_history_seconds", "Latency of the chat history store operations.", ["backend", "operation"],
+                                 buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5))
+CHAT_HISTORY_ERRORS = Counter("bot_chat_history_errors", "Chat history store operations which raised.", ["backend", "operation"])
+TWILIO_SEND_SECONDS = Histogram("bot_twilio_send_seconds", "Latency of the whatsapp messages sent with twilio.", ["kind"],
+                                buckets=(0.1, 0.25, 0.5, 1, 2, 4, 8, 16))
+TWILIO_SEND_FAILURES = Counter("bot_twilio_send_failures", "Whatsapp messages twilio did not accept.", ["kind"])
+
+
+# context manager observing the time spent in its block, an exception raised in it is also counted in errors
+@contextmanager
+def timed(histogram, errors, *labels):
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        errors.labels(*labels).inc()
+        raise
+    finally:
+        histogram.labels(*labels).observe(time.perf_counter() - started)
+
+
+# cursor recording the latency of every statement, labelled by its sql verb so the number of series stays small
+class TimedCursor:
+    def __init__(self, cursor):
+        self.__cursor = cursor
+
+    def execute(self, operation, params=None):
+        with timed(DB_QUERY_SECONDS, DB_QUERY_ERRORS, operation.lstrip().split(None, 1)[0].upper()):
+            return self.__cursor.execute(operation, params)
+
+    def __getattr__(self, name):
+        return getattr(self.__cursor, name)
+
+
+# function for recording the latency of a view, the url name keeps unmatched urls from adding series
+def observe_view(request, response, started):
+    view = request.resolver_match.url_name if request.resolver_match else "unmatched"
+    VIEW_SECONDS.labels(view or "unnamed", request.method, response.status_code).observe(time.perf_counter() - started)
+
+
+# middleware timing every request, it runs asynchronously under asgi so the async views are not moved to a thread
+@sync_and_async_middleware
+def metrics_middleware(get_response):
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            started = time.perf_counter()
+            response = await get_response(request)
+            observe_view(request, response, started)
+            return response
+    else:
+        def middleware(request):
+            started = time.perf_counter()
+            response = get_response(request)
+            observe_view(request, response, started)
+            return response
+    return middleware
+
+
+# collector turning the stats the bot already keeps into metrics when they are scraped, the connection pool and the agents
+# are only read once something else created them, a scrape never connects to mysql or groq
+class BotStatsCollector:
+    # the metric names are not declared up front, registering the collector must not import the views
+    def describe(self):
+        return []
+
+    def collect(self):
+        from . import dbpool, agent, chatstore
+        from .tools import search_cache, availability
+        from .error_messages import stats as error_stats
+        from .idempotency import get_idempotency_store
+        from .turns import get_turn_gate, get_async_turn_gate
+        from .views import whatsapp_coalescer, whatsapp_coalescer_async
+
+        caches = {"search_results": search_cache.stats(),
+                  "availability_days": availability.days.stats(),
+                  "whatsapp_messages": get_idempotency_store().stats()}
+        if chatstore._chat_history_handler is not None:
+            caches["chat_history"] = chatstore._chat_history_handler.cache_stats()
+        agents = {"sync": agent._database_agent, "async": agent._async_database_agent}
+        cache_size = GaugeMetricFamily("bot_cache_entries", "Entries in the in-process caches.", labels=["cache"])
+        cache_lookups = CounterMetricFamily("bot_cache_lookups", "Lookups of the in-process caches.", labels=["cache", "result"])
+        cache_evictions = CounterMetricFamily("bot_cache_evictions", "Entries dropped from the in-process caches because they were full.", labels=["cache"])
+        for name, stats in caches.items():
+            cache_size.add_metric([name], stats["size"])
+            cache_lookups.add_metric([name, "hit"], stats["hits"])
+            cache_lookups.add_metric([name, "miss"], stats["misses"])
+            cache_evictions.add_metric([name], stats["evictions"])
+        yield from (cache_size, cache_lookups, cache_evictions)
+
+        if dbpool._pool is not None:
+            pool_stats = dbpool.get_pool_stats()
+            pool_connections = GaugeMetricFamily("bot_db_pool_connections", "Connections of the mysql pool.", labels=["state"])
+            for state in ("in_use", "idle"):
+                pool_connections.add_metric([state], pool_stats[state])
+            pool_events = CounterMetricFamily("bot_db_pool_events", "Checkouts, waits, timeouts, reconnects and errors of the mysql pool.", labels=["event"])
+            for event in ("checkouts", "waits", "timeouts", "reconnects", "errors"):
+                pool_events.add_metric([event], pool_stats[event])
+            yield from (pool_connections, pool_events)
+
+        turns_waiting = GaugeMetricFamily("bot_turns_waiting", "Agent turns waiting for their session or a free slot.", labels=["path"])
+        turns_running = GaugeMetricFamily("bot_turns_running", "Agent turns running.", labels=["path"])
+        turns_completed = CounterMetricFamily("bot_turns_completed", "Agent turns answered.", labels=["path"])
+        for path, gate in (("sync", get_turn_gate()), ("async", get_async_turn_gate())):
+            gate_stats = gate.stats()
+            turns_waiting.add_metric([path], gate_stats["waiting"])
+            turns_running.add_metric([path], gate_stats["running"])
+            turns_completed.add_metric([path], gate_stats["completed"])
+        yield from (turns_waiting, turns_running, turns_completed)
+
+        coalesced_turns = CounterMetricFamily("bot_whatsapp_turns", "Whatsapp turns, merged from several messages or from a single one.", labels=["path", "kind"])
+        for path, coalescer in (("sync", whatsapp_coalescer), ("async", whatsapp_coalescer_async)):
+            coalescer_stats = coalescer.stats()
+            coalesced_turns.add_metric([path, "merged"], coalescer_stats["merged_turns"])
+            coalesced_turns.add_metric([path, "single"], coalescer_stats["single_turns"])
+        yield coalesced_turns
+
+        routed_turns = CounterMetricFamily("bot_agent_routes", "Chat turns answered by the intent router and by the llm agent.", labels=["path", "route"])
+        for path, database_agent in agents.items():
+            if database_agent is not None:
+                routing_stats = database_agent.routing_stats()
+                routed_turns.add_metric([path, "router"], routing_stats["routed_turns"])
+                routed_turns.add_metric([path, "llm"], routing_stats["llm_turns"])
+        yield routed_turns
+
+        error_messages = CounterMetricFamily("bot_error_messages", "Error messages rendered from the templates and by the llm.", labels=["source"])
+        error_snapshot = error_stats.snapshot()
+        error_messages.add_metric(["template"], error_snapshot["llm_calls_saved"])
+        error_messages.add_metric(["llm"], error_snapshot["llm_calls_made"])
+        yield error_messages
+
+
+REGISTRY.register(BotStatsCollector())
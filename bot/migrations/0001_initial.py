@@ -0,0 +1,41 @@
+# Generated by Django 5.1.1 on 2026-10-18 09:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Customer',
+            fields=[
+                ('serial_no', models.AutoField(primary_key=True, serialize=False)),
+                ('user_id', models.CharField(max_length=25, unique=True)),
+                ('phone_number', models.CharField(blank=True, max_length=15, null=True)),
+                ('person_name', models.CharField(max_length=100)),
+                ('age', models.IntegerField(blank=True, null=True)),
+                ('appointment_date', models.DateField()),
+                ('appointment_time', models.TimeField()),
+                ('appointment_end_time', models.TimeField(blank=True, null=True)),
+                ('status', models.CharField(choices=[('Pending', 'Pending'), ('Approved', 'Approved'), ('Rejected', 'Rejected'), ('Complete', 'Completed')], default='Pending', max_length=10)),
+            ],
+            options={
+                'db_table': 'mytable',
+            },
+        ),
+        migrations.CreateModel(
+            name='Users',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('username', models.CharField(max_length=150, unique=True)),
+                ('email', models.EmailField(max_length=254, unique=True)),
+                ('password', models.CharField(max_length=128)),
+                ('confirm_password', models.CharField(max_length=128)),
+            ],
+        ),
+    ]
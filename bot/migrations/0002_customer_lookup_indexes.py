@@ -0,0 +1,25 @@
+# Generated by Django 5.1.1 on 2026-10-18 09:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='customer',
+            index=models.Index(fields=['appointment_date', 'appointment_time'], name='mytable_date_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='customer',
+            index=models.Index(fields=['status', 'appointment_date', 'appointment_time'], name='mytable_status_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='customer',
+            index=models.Index(fields=['phone_number', 'appointment_date', 'appointment_time'], name='mytable_phone_date_idx'),
+        ),
+    ]
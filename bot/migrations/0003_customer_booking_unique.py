@@ -0,0 +1,21 @@
+# Generated by Django 5.1.1 on 2026-10-18 10:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0002_customer_lookup_indexes'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='customer',
+            name='mytable_phone_date_idx',
+        ),
+        migrations.AddConstraint(
+            model_name='customer',
+            constraint=models.UniqueConstraint(fields=('phone_number', 'appointment_date', 'appointment_time'), name='mytable_booking_uniq'),
+        ),
+    ]
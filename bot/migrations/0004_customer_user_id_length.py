@@ -0,0 +1,18 @@
+# Generated by Django 5.1.1 on 2026-10-18 16:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0003_customer_booking_unique'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='customer',
+            name='user_id',
+            field=models.CharField(max_length=32, unique=True),
+        ),
+    ]
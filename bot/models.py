@@ -16,7 +16,7 @@ class Customer(models.Model):
     ]
 
     serial_no = models.AutoField(primary_key=True)
-    user_id = models.CharField(max_length=25, unique=True, null=False, blank=False)
+    user_id = models.CharField(max_length=32, unique=True, null=False, blank=False)
     phone_number = models.CharField(max_length=15, blank=True, null=True)
     person_name = models.CharField(max_length=100)
     age = models.IntegerField(blank=True, null=True)
@@ -27,6 +27,17 @@ class Customer(models.Model):
 
     class Meta:
         db_table = 'mytable'
+        indexes = [
+            # slots of a day, dashboard date range filter and appointment sort
+            models.Index(fields=['appointment_date', 'appointment_time'], name='mytable_date_time_idx'),
+            # dashboard status filter sorted by appointment
+            models.Index(fields=['status', 'appointment_date', 'appointment_time'], name='mytable_status_date_idx'),
+        ]
+        constraints = [
+            # booking identity, insert_data relies on it to reject duplicate bookings in a single statement and books a rejected one again
+            # in the same statement, its index also serves the dashboard phone filter
+            models.UniqueConstraint(fields=['phone_number', 'appointment_date', 'appointment_time'], name='mytable_booking_uniq'),
+        ]
 
 
 class Users(models.Model):
@@ -0,0 +1,144 @@
+import os
+import time
+import random
+import logging
+import threading
+
+from .cache import TTLCache
+from .config import get_config
+from .metrics import timed, TWILIO_SEND_SECONDS, TWILIO_SEND_FAILURES
+
+
+logger = logging.getLogger(__name__)
+
+
+_twilio_client = None
+_twilio_client_lock = threading.Lock()
+
+
+# function for getting the twilio client, it is created on first use so the views import without the twilio credentials
+def get_twilio_client():
+    global _twilio_client
+    if _twilio_client is None:
+        with _twilio_client_lock:
+            if _twilio_client is None:
+                from twilio.rest import Client    # imported here, twilio.rest takes a noticeable part of the startup time
+                _twilio_client = Client(os.environ["TWILIO_ACCOUNT_SID"], os.environ["TWILIO_AUTH_TOKEN"])
+    return _twilio_client
+
+
+# function for sending a whatsapp message with twilio, the latency and failures are recorded per kind of message
+def send_whatsapp_message(kind, from_, to, body):
+    with timed(TWILIO_SEND_SECONDS, TWILIO_SEND_FAILURES, kind):
+        return get_twilio_client().messages.create(from_=from_, body=body, to=to)
+
+
+# token bucket shared by every sender thread, acquire blocks until a message may be sent
+class RateLimiter:
+    def __init__(self, rate, burst=1, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate        # messages per second
+        self.burst = burst      # messages which may be sent back to back after an idle period
+        self.__clock = clock
+        self.__sleep = sleep
+        self.__tokens = burst
+        self.__updated = clock()
+        self.__lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.__lock:
+                now = self.__clock()
+                self.__tokens = min(self.burst, self.__tokens + (now - self.__updated) * self.rate)
+                self.__updated = now
+                if self.__tokens >= 1:
+                    self.__tokens -= 1
+                    return
+                wait = (1 - self.__tokens) / self.rate
+            self.__sleep(wait)
+
+
+# function for deciding if a failed send is worth retrying, twilio errors carry the http status of the api response
+def is_retryable(exception):
+    status = getattr(exception, "status", None)
+    return status is None or status == 429 or status >= 500
+
+
+# sender of whatsapp notifications, every message waits for the rate limiter and transient failures are retried with backoff
+class NotificationSender:
+    def __init__(self, send, rate_limiter, max_retries=4, backoff=1.0, backoff_max=30.0, sleep=time.sleep):
+        self.send = send    # function sending one message, called as send(to, body)
+        self.rate_limiter = rate_limiter
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.__sleep = sleep
+
+    # function for sending a message, raises the last error when every attempt failed
+    def send_with_retry(self, to, body):
+        attempt = 0
+        while True:
+            self.rate_limiter.acquire()
+            try:
+                return self.send(to, body)
+            except Exception as e:
+                if attempt >= self.max_retries or not is_retryable(e):
+                    raise
+                # exponential backoff with jitter, so retries of many messages do not hit twilio together
+                delay = min(self.backoff_max, self.backoff * 2 ** attempt) * random.uniform(0.5, 1.0)
+                logger.warning("Sending a notification to %s failed (%s), retrying in %.1f s.", to, e, delay)
+                self.__sleep(delay)
+                attempt += 1
+
+
+_sender = None
+_sender_lock = threading.Lock()
+
+
+# function for getting the process wide notification sender, configured in the notifications section of the config
+def get_notification_sender():
+    global _sender
+    if _sender is None:
+        with _sender_lock:
+            if _sender is None:
+                notifications_config = get_config().notifications
+                _sender = NotificationSender(send=lambda to, body: send_whatsapp_message(kind="status",
+                                                                                         from_=get_config().whatsapp_bot_number,
+                                                                                         to=to,
+                                                                                         body=body),
+                                             rate_limiter=RateLimiter(rate=notifications_config.rate_per_second,
+                                                                      burst=notifications_config.burst),
+                                             max_retries=notifications_config.max_retries,
+                                             backoff=notifications_config.backoff,
+                                             backoff_max=notifications_config.backoff_max)
+    return _sender
+
+
+# progress of the bulk notification jobs, kept for a day
+_progress = TTLCache(maxsize=1024, ttl=24 * 3600)
+_progress_lock = threading.Lock()
+
+
+# function for registering a bulk notification job before it is queued
+def start_progress(job_id, total):
+    _progress.set(job_id, {"job_id": job_id, "state": "queued" if total else "done", "total": total, "sent": 0, "failed": 0, "errors": []})
+
+
+# function for updating the progress of a bulk notification job
+def update_progress(job_id, state=None, sent=0, failed=0, error=None):
+    with _progress_lock:
+        progress = _progress.get(job_id)
+        if progress is None:
+            return
+        if state:
+            progress["state"] = state
+        progress["sent"] += sent
+        progress["failed"] += failed
+        if error:
+            progress["errors"].append(error)
+
+
+# function for getting a copy of the progress of a bulk notification job, None for an unknown or expired job
+def get_progress(job_id):
+    with _progress_lock:
+        progress = _progress.get(job_id)
+        return None if progress is None else {**progress, "errors": list(progress["errors"])}
@@ -0,0 +1,53 @@
+import json
+import base64
+from datetime import date, time
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+
+# function for encoding the sort values of the last row of a page into an opaque cursor
+def encode_cursor(values):
+    values = [value.isoformat() if isinstance(value, (date, time)) else value for value in values]
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+# function for decoding a cursor, raises ValueError for a malformed cursor
+def decode_cursor(cursor, size):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+    except Exception as e:
+        raise ValueError("Invalid cursor.") from e
+    if not isinstance(values, list) or len(values) != size:
+        raise ValueError("Invalid cursor.")
+    return values
+
+
+# function for building the filter of the rows after a cursor, (a, b, c) > (x, y, z) written out for the orm
+def after_cursor(fields, values, descending=False):
+    lookup = "lt" if descending else "gt"
+    condition = Q()
+    for index, field in enumerate(fields):
+        step = Q(**{f"{field}__{lookup}": values[index]})
+        for previous_field, previous_value in zip(fields[:index], values[:index]):
+            step &= Q(**{previous_field: previous_value})
+        condition |= step
+    return condition
+
+
+# function for getting one page of a queryset with keyset pagination, the last field has to be unique
+def keyset_page(queryset, fields, page_size, cursor=None, descending=False):
+    if cursor:
+        try:
+            queryset = queryset.filter(after_cursor(fields, decode_cursor(cursor, len(fields)), descending))
+        except (ValidationError, TypeError) as e:
+            # a cursor holding values of the wrong type for its fields
+            raise ValueError("Invalid cursor.") from e
+    queryset = queryset.order_by(*[f"-{field}" if descending else field for field in fields])
+
+    # fetching one extra row to know if there is a next page
+    rows = list(queryset[:page_size + 1])
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+    next_cursor = encode_cursor([rows[-1][field] for field in fields]) if has_more else None
+    return rows, next_cursor
@@ -14,6 +14,7 @@ custom_prompt = ChatPromptTemplate.from_messages(
             - `update_data` -> Use this tool when the user asks to update their previously booked appointment.
             - `search_data` -> Use this tool when the user wants to see their appointment details.
             - `delete_data` -> Use this tool when the user asks you to cancel their appointment.
+            - `check_availability` -> Use this tool when the user asks which appointment times are free on a date or whether a time is available.
 
             **Important:** When you set to use tool, do not execute any tool more than once. It should be strictly followed.
 
@@ -122,3 +123,26 @@ result_rephraser_prompt = ChatPromptTemplate.from_messages(
         )
     ]
 )
+
+
+# prompt template for summarizing the older part of a conversation
+summary_prompt = ChatPromptTemplate.from_messages(
+    [
+        (
+            "system",
+            """
+            You are summarizing a conversation between a user and an appointment schedule manager. Extend the previous summary with the new messages.
+            Keep every detail needed to continue the conversation: person name, phone number, age, appointment date and time, user IDs and what the 
+            user asked for. Do not add any information that is not in the messages. Reply with the summary only.
+            """
+        ),
+        (
+            "user",
+            """Previous summary:
+            {summary}
+
+            New messages:
+            {messages}"""
+        )
+    ]
+)
@@ -0,0 +1,50 @@
+import threading
+
+from .config import get_config
+
+
+# sql text of the tools, built once per table name instead of on every call
+class Queries:
+    def __init__(self, table):
+        self.table = table
+        # a booking that already exists is left untouched, a rejected one is booked again as the availability treats its
+        # slot as free, status is assigned last as the other columns test its old value, the affected row count is 1 for
+        # a new row, 2 for a revived rejected row and 0 for an existing booking
+        self.insert = (f"INSERT INTO {table} (user_id, phone_number, person_name, age, appointment_date, appointment_time, appointment_end_time, status) "
+                       "VALUES (%s, %s, %s, %s, %s, %s, %s, %s) "
+                       "ON DUPLICATE KEY UPDATE "
+                       + ", ".join(f"{column} = IF(status = 'Rejected', VALUES({column}), {column})"
+                                   for column in ("user_id", "person_name", "age", "appointment_end_time", "status")))
+        self.search = f"SELECT * FROM {table} WHERE user_id = %s"
+        self.exists = f"SELECT 1 FROM {table} WHERE user_id = %s"
+        self.delete = f"DELETE FROM {table} WHERE user_id = %s"
+        self.day_appointments = (f"SELECT user_id, appointment_time, appointment_end_time FROM {table} "
+                                 "WHERE appointment_date = %s AND status <> 'Rejected'")
+        # the rows of the day stay locked until the booking is written, a booking is checked against the committed rows
+        self.lock_day_appointments = f"{self.day_appointments} FOR UPDATE"
+        self.lock_day = "SELECT GET_LOCK(%s, %s)"
+        self.unlock_day = "SELECT RELEASE_LOCK(%s)"
+        self.__updates = {}
+
+    # function for getting the update statement of a set of columns, each combination is built once
+    def update(self, columns):
+        columns = tuple(columns)
+        query = self.__updates.get(columns)
+        if query is None:
+            query = f"UPDATE {self.table} SET {', '.join(f'{column} = %s' for column in columns)} WHERE user_id = %s"
+            self.__updates[columns] = query
+        return query
+
+
+_queries = {}
+_queries_lock = threading.Lock()
+
+
+# function for getting the sql text of the configured table
+def get_queries():
+    table = get_config().database.table
+    queries = _queries.get(table)
+    if queries is None:
+        with _queries_lock:
+            queries = _queries.setdefault(table, Queries(table))
+    return queries
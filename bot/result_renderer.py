@@ -0,0 +1,80 @@
+from datetime import timedelta
+
+
+# labels of the appointment details message for every supported language
+LABELS = {
+    "en": {
+        "title": "Appointment Details for {person_name}.",
+        "user_id": "User ID",
+        "person_name": "Name",
+        "phone_number": "Phone Number",
+        "age": "Age",
+        "age_value": "{age} years old",
+        "not_provided": "Not provided",
+        "schedule": "Appointment Schedule",
+        "date": "Date",
+        "time": "Time",
+        "status": "Status",
+        "closing": "See you on due time.",
+    },
+    "bn": {
+        "title": "{person_name} এর অ্যাপয়েন্টমেন্টের বিবরণ।",
+        "user_id": "ইউজার আইডি",
+        "person_name": "নাম",
+        "phone_number": "ফোন নম্বর",
+        "age": "বয়স",
+        "age_value": "{age} বছর",
+        "not_provided": "দেওয়া হয়নি",
+        "schedule": "অ্যাপয়েন্টমেন্টের সময়সূচি",
+        "date": "তারিখ",
+        "time": "সময়",
+        "status": "অবস্থা",
+        "closing": "নির্ধারিত সময়ে দেখা হবে।",
+    },
+}
+
+
+# function for formatting a mysql TIME value (timedelta) in 12 hour format with AM/PM
+def format_time(value):
+    if isinstance(value, timedelta):
+        hours, remainder = divmod(int(value.total_seconds()), 3600)
+        minutes = remainder // 60
+    else:
+        hours, minutes = value.hour, value.minute
+    return f"{(hours % 12) or 12}:{minutes:02d} {'AM' if hours % 24 < 12 else 'PM'}"
+
+
+# function for rendering the appointment details without calling the rephraser llm
+def render_appointment_details(record: dict, style="whatsapp", language="en"):
+    labels = LABELS.get(language, LABELS["en"])
+    # whatsapp renders text between asterisks in bold
+    bold = (lambda text: f"*{text}*") if style == "whatsapp" else (lambda text: text)
+
+    age = labels["age_value"].format(age=record["age"]) if record["age"] is not None else labels["not_provided"]
+    return (f"{bold(labels['title'].format(person_name=record['person_name']))}\n\n"
+            f"{bold(labels['user_id'])}: {record['user_id']}\n"
+            f"{bold(labels['phone_number'])}: {record['phone_number']}\n"
+            f"{bold(labels['age'])}: {age}\n\n"
+            f"{bold(labels['schedule'])}:\n"
+            f"    {labels['date']}: {record['appointment_date'].strftime('%d-%m-%Y')}\n"
+            f"    {labels['time']}: {format_time(record['appointment_time'])} - {format_time(record['appointment_end_time'])}\n\n"
+            f"{bold(labels['status'])}: {record['status']}\n\n"
+            f"{labels['closing']}")
+
+
+# function for rendering only the changed fields of an appointment, used when the updated record is not read back
+def render_updated_fields(fields: dict, style="whatsapp", language="en"):
+    labels = LABELS.get(language, LABELS["en"])
+    bold = (lambda text: f"*{text}*") if style == "whatsapp" else (lambda text: text)
+
+    lines = []
+    for field in ("user_id", "person_name", "phone_number"):
+        if fields.get(field):
+            lines.append(f"{bold(labels[field])}: {fields[field]}")
+    if fields.get("age") is not None:
+        lines.append(f"{bold(labels['age'])}: {labels['age_value'].format(age=fields['age'])}")
+    if fields.get("appointment_date"):
+        lines.append(f"{bold(labels['date'])}: {fields['appointment_date'].strftime('%d-%m-%Y')}")
+    if fields.get("appointment_time"):
+        lines.append(f"{bold(labels['time'])}: {format_time(fields['appointment_time'])} - {format_time(fields['appointment_end_time'])}")
+    return "\n".join(lines)
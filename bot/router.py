@@ -0,0 +1,71 @@
+import re
+import threading
+
+from .tools import search_data, delete_data, BaseSchema
+
+
+# user id format produced by get_user_id, e.g. SC_01712345678_20301012_10_30, or SC_01712345678_12_10_30 before the full date was added
+USER_ID = r"SC_\d{11}_(?:\d{8}|\d{2})_\d{2}_\d{2}"
+FILLER = r"(?:\s*(?:my|the|an?|appointment|booking|schedule|of|for|with|user|id|no\.?|number|please|:|-|,))*"
+
+# a command is only routed when the whole message is the command word, filler words and one user id
+COMMANDS = {
+    "search_data": re.compile(rf"^\s*(?:status|search|check|show|find|view|details?){FILLER}\s*({USER_ID})\s*(?:please)?\s*[.?!]*\s*$", re.IGNORECASE),
+    "delete_data": re.compile(rf"^\s*(?:cancel|delete|remove){FILLER}\s*({USER_ID})\s*(?:please)?\s*[.?!]*\s*$", re.IGNORECASE),
+}
+
+TOOLS = {
+    "search_data": search_data,
+    "delete_data": delete_data,
+}
+
+
+# router answering unambiguous search and cancel commands without the llm agent
+class IntentRouter:
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.__lock = threading.Lock()
+        self.routed = 0         # turns answered by calling a tool directly
+        self.llm = 0            # turns handed to the agent
+
+    # function for finding the tool and user id of a message, returns None when the message is not a plain command
+    def parse(self, query):
+        if not self.enabled or not isinstance(query, str):
+            return None
+        for tool_name, pattern in COMMANDS.items():
+            match = pattern.match(query)
+            if match:
+                user_id = match.group(1).upper()
+                if BaseSchema.validate_user_id(user_id) == user_id:
+                    return tool_name, user_id
+        return None
+
+    def __count(self, routed):
+        with self.__lock:
+            if routed:
+                self.routed += 1
+            else:
+                self.llm += 1
+
+    # function for answering a message with a tool, returns None when the agent has to answer it
+    def route(self, query):
+        command = self.parse(query)
+        self.__count(command is not None)
+        if command is None:
+            return None
+        tool_name, user_id = command
+        return TOOLS[tool_name].invoke({"user_id": user_id})
+
+    # async function for answering a message with a tool, returns None when the agent has to answer it
+    async def aroute(self, query):
+        command = self.parse(query)
+        self.__count(command is not None)
+        if command is None:
+            return None
+        tool_name, user_id = command
+        return await TOOLS[tool_name].ainvoke({"user_id": user_id})
+
+    # function for getting the routed vs llm turn counts
+    def stats(self):
+        with self.__lock:
+            return {"routed_turns": self.routed, "llm_turns": self.llm}
@@ -72,3 +72,11 @@ def status_rejected_message(customer: Customer):
 
     Please contact with the support team to get the issue resolved.
     """
+
+
+# notification of every status change made from the dashboard, a change back to pending is not notified
+STATUS_MESSAGES = {
+    Customer.APPROVED: status_approved_message,
+    Customer.COMPLETE: status_completed_message,
+    Customer.REJECTED: status_rejected_message,
+}
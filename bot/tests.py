@@ -1,3 +1,1225 @@
-from django.test import TestCase
+import os
+import json
+import sqlite3
+import asyncio
+import tempfile
+import threading
+import unittest
+from time import sleep
+from contextlib import closing
+from datetime import date, datetime, time, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+from asgiref.sync import async_to_sync
 
-# Create your tests here.
+from django.db import IntegrityError, connection
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, Client, override_settings
+from langchain_core.messages import HumanMessage, AIMessage
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.tools import tool
+from prometheus_client import REGISTRY
+from mysql.connector import errors as mysql_errors
+
+from .chat_backends import FirestoreBackend, SQLiteBackend, InMemoryBackend
+from .config import get_config, Settings, normalize_keys
+from .queries import Queries
+from .notifications import NotificationSender, RateLimiter, get_progress
+from .idempotency import IdempotencyStore
+from .turns import TurnGate, AsyncTurnGate
+from .coalesce import MessageCoalescer
+from .instrumentation import instrumented, traced_turn
+from .metrics import TimedCursor
+from .jobqueue import InProcessJobQueue, SQLiteJobQueue, register_job
+from .views import process_whatsapp_turn, CUSTOMER_SORTS
+from .pagination import encode_cursor
+from .agent import DatabaseAgent, AsyncDatabaseAgent
+from .history_policy import HistoryPolicy
+from .router import IntentRouter
+from .chatstore import ChatHistoryHandler
+from .availability import AvailabilityEngine
+from .dbpool import ConnectionPool
+from .result_renderer import render_appointment_details, render_updated_fields, format_time
+from . import tools
+from .models import Customer
+
+
+# tests every chat history backend has to pass, mixed into one test case per backend
+class ChatHistoryBackendContract:
+    def make_backend(self):
+        raise NotImplementedError
+
+    def setUp(self):
+        self.backend = self.make_backend()
+        self.session_id = f"contract-test-{id(self)}"
+        self.other_session_id = f"{self.session_id}-other"
+        self.addCleanup(self.backend.delete, self.session_id)
+        self.addCleanup(self.backend.delete, self.other_session_id)
+
+    def test_unknown_session_has_no_messages(self):
+        self.assertEqual(self.backend.get_messages(self.session_id), [])
+
+    def test_messages_round_trip_in_order(self):
+        messages = [HumanMessage(content="Book an appointment"), AIMessage(content="What is your name?")]
+        self.backend.set_messages(self.session_id, messages)
+        self.assertEqual(self.backend.get_messages(self.session_id), messages)
+
+    def test_set_messages_replaces_the_history(self):
+        self.backend.set_messages(self.session_id, [HumanMessage(content="first")])
+        self.backend.set_messages(self.session_id, [HumanMessage(content="first"), AIMessage(content="second")])
+        self.assertEqual([m.content for m in self.backend.get_messages(self.session_id)], ["first", "second"])
+
+    def test_delete_clears_the_history(self):
+        self.backend.set_messages(self.session_id, [HumanMessage(content="hello")])
+        self.backend.delete(self.session_id)
+        self.assertEqual(self.backend.get_messages(self.session_id), [])
+
+    def test_delete_of_unknown_session_is_allowed(self):
+        self.backend.delete(self.session_id)
+
+    def test_sessions_are_isolated(self):
+        self.backend.set_messages(self.session_id, [HumanMessage(content="mine")])
+        self.backend.set_messages(self.other_session_id, [HumanMessage(content="theirs")])
+        self.backend.delete(self.other_session_id)
+        self.assertEqual([m.content for m in self.backend.get_messages(self.session_id)], ["mine"])
+
+    def test_returned_list_is_not_shared(self):
+        self.backend.set_messages(self.session_id, [HumanMessage(content="hello")])
+        self.backend.get_messages(self.session_id).append(AIMessage(content="not stored"))
+        self.assertEqual(len(self.backend.get_messages(self.session_id)), 1)
+
+    def test_async_methods_match_sync_methods(self):
+        async def scenario():
+            await self.backend.aset_messages(self.session_id, [HumanMessage(content="hello")])
+            stored = await self.backend.aget_messages(self.session_id)
+            await self.backend.adelete(self.session_id)
+            return stored, await self.backend.aget_messages(self.session_id)
+
+        stored, after_delete = asyncio.run(scenario())
+        self.assertEqual([m.content for m in stored], ["hello"])
+        self.assertEqual(after_delete, [])
+
+    def test_append_keeps_repeated_messages_and_returns_the_history(self):
+        self.backend.append_messages(self.session_id, [HumanMessage(content="hi")])
+        chat_history = self.backend.append_messages(self.session_id, [HumanMessage(content="hi")])
+        self.assertEqual([m.content for m in chat_history], ["hi", "hi"])
+        self.assertEqual(self.backend.get_messages(self.session_id), chat_history)
+
+    def test_concurrent_appends_are_not_lost(self):
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            list(executor.map(lambda number: self.backend.append_messages(self.session_id, [HumanMessage(content=str(number))]), range(12)))
+        self.assertEqual(sorted(int(m.content) for m in self.backend.get_messages(self.session_id)), list(range(12)))
+
+    def test_async_append_matches_sync_append(self):
+        async def scenario():
+            await self.backend.aappend_messages(self.session_id, [HumanMessage(content="hello")])
+            return await self.backend.aappend_messages(self.session_id, [AIMessage(content="hi")])
+
+        self.assertEqual([m.content for m in asyncio.run(scenario())], ["hello", "hi"])
+
+    def test_handlers_with_stale_caches_do_not_lose_or_revive_messages(self):
+        web_handler, whatsapp_handler = ChatHistoryHandler(backend=self.backend), ChatHistoryHandler(backend=self.backend)
+        whatsapp_handler.add_query(chat_session_id=self.session_id, query_text="hi")
+        web_handler.add_response(chat_session_id=self.session_id, response_text="Your appointment was approved.")
+        whatsapp_handler.add_response(chat_session_id=self.session_id, response_text="Hello!")
+        self.assertEqual([m.content for m in self.backend.get_messages(self.session_id)], ["hi", "Your appointment was approved.", "Hello!"])
+
+        web_handler.delete_chat_history(chat_session_id=self.session_id)
+        whatsapp_handler.add_query(chat_session_id=self.session_id, query_text="new booking")
+        self.assertEqual([m.content for m in self.backend.get_messages(self.session_id)], ["new booking"])
+
+    def test_handler_appends_a_turn(self):
+        handler = ChatHistoryHandler(backend=self.backend)
+        handler.add_query(chat_session_id=self.session_id, query_text="hi")
+        handler.add_turn(chat_session_id=self.session_id, query_text="status", response_text="Pending")
+        self.assertEqual([type(m) for m in self.backend.get_messages(self.session_id)], [HumanMessage, HumanMessage, AIMessage])
+        handler.delete_chat_history(chat_session_id=self.session_id)
+        self.assertEqual(handler.get_chat_history(chat_session_id=self.session_id), [])
+
+
+class InMemoryBackendTests(ChatHistoryBackendContract, SimpleTestCase):
+    def make_backend(self):
+        return InMemoryBackend()
+
+
+class SQLiteBackendTests(ChatHistoryBackendContract, SimpleTestCase):
+    def make_backend(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "chat_history.sqlite3")
+        return SQLiteBackend(path=self.path)
+
+    def test_appends_of_processes_sharing_the_file_are_not_lost(self):
+        other_process = SQLiteBackend(path=self.path)
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            list(executor.map(lambda number: (self.backend if number % 2 else other_process).append_messages(self.session_id, [HumanMessage(content=str(number))]),
+                              range(12)))
+        self.assertEqual(len(self.backend.get_messages(self.session_id)), 12)
+
+
+@unittest.skipUnless(os.environ.get("FIRESTORE_EMULATOR_HOST"), "needs the firestore emulator")
+class FirestoreBackendTests(ChatHistoryBackendContract, SimpleTestCase):
+    def make_backend(self):
+        return FirestoreBackend(project_id=get_config().google_firestore.project_id,
+                                collection_name=get_config().google_firestore.collection_name)
+
+    def test_async_turns_on_separate_event_loops(self):
+        # under wsgi every async view runs through async_to_sync on an event loop of its own
+        for number in range(2):
+            async_to_sync(self.backend.aappend_messages)(self.session_id, [HumanMessage(content=str(number))])
+        self.assertEqual([message.content for message in async_to_sync(self.backend.aget_messages)(self.session_id)], ["0", "1"])
+
+
+# async firestore client whose documents may only be used on the event loop the client was created on, like a grpc.aio channel
+class LoopBoundAsyncClient:
+    def __init__(self, project):
+        self.loop = asyncio.get_running_loop()
+
+    def collection(self, name):
+        return self
+
+    def document(self, chat_session_id):
+        return self
+
+    async def get(self):
+        if asyncio.get_running_loop() is not self.loop:
+            raise RuntimeError("attached to a different loop")
+        return mock.Mock(exists=False)
+
+
+class FirestoreAsyncClientTests(SimpleTestCase):
+    def test_each_event_loop_gets_its_own_async_client(self):
+        backend = FirestoreBackend(project_id="appointment-schedule-manager", collection_name="chat_history")
+        with mock.patch("bot.chat_backends.firestore.AsyncClient", LoopBoundAsyncClient):
+            for _ in range(2):
+                self.assertEqual(async_to_sync(backend.aget_messages)("whatsapp:+8801712345678"), [])
+
+
+class AvailabilityEngineTests(SimpleTestCase):
+    day = date(2030, 1, 15)
+
+    def setUp(self):
+        self.loads = 0
+        self.appointments = [("SC_01712345678_15_10_00", timedelta(hours=10), timedelta(hours=10, minutes=5)),
+                             ("SC_01812345678_15_10_05", timedelta(hours=10, minutes=5), timedelta(hours=10, minutes=10)),
+                             ("SC_01912345678_15_11_00", time(11, 0), time(11, 5))]
+        self.engine = AvailabilityEngine(load_day=self.load_day, opening_time="10:00", closing_time="12:00")
+
+    def load_day(self, day):
+        self.loads += 1
+        return list(self.appointments)
+
+    def test_overlapping_slot_is_not_free(self):
+        self.assertFalse(self.engine.is_free(self.day, "10:00"))
+        self.assertFalse(self.engine.is_free(self.day, "10:03"))
+        self.assertTrue(self.engine.is_free(self.day, "10:10"))
+
+    def test_own_appointment_is_ignored_when_moving_it(self):
+        self.assertTrue(self.engine.is_free(self.day, "11:00", exclude_user_id="SC_01912345678_15_11_00"))
+
+    def test_slots_outside_opening_hours_are_not_free(self):
+        self.assertFalse(self.engine.is_free(self.day, "09:55"))
+        self.assertFalse(self.engine.is_free(self.day, "11:58"))
+
+    def test_next_free_slots_skip_busy_intervals(self):
+        self.assertEqual(self.engine.next_free_slots(self.day, count=3), [time(10, 10), time(10, 15), time(10, 20)])
+        self.assertEqual(self.engine.next_free_slots(self.day, count=2, after="10:57"), [time(11, 5), time(11, 10)])
+
+    def test_day_is_loaded_once_until_invalidated(self):
+        self.engine.is_free(self.day, "10:00")
+        self.engine.next_free_slots(self.day)
+        self.assertEqual(self.loads, 1)
+
+        self.appointments.append(("SC_01612345678_15_10_10", time(10, 10), time(10, 15)))
+        self.engine.invalidate(self.day)
+        self.assertFalse(self.engine.is_free(self.day, "10:10"))
+        self.assertEqual(self.loads, 2)
+
+
+class AfternoonBookingTests(SimpleTestCase):
+    booking = {"phone_number": "01712345678", "person_name": "Rahim", "appointment_date": "2030-01-15", "age": 30}
+
+    def setUp(self):
+        self.cursor = mock.Mock(rowcount=1)
+        self.cursor.fetchone.return_value = (1,)    # the booking lock of the day is granted
+        self.cursor.fetchall.return_value = []
+        connection = mock.MagicMock()
+        connection.__enter__.return_value = (mock.Mock(), self.cursor)
+        engine = AvailabilityEngine(load_day=lambda day: [])    # an empty day, opening at 09:00 and closing at 21:00
+        for target, value in (("bot.tools.get_connection", mock.Mock(return_value=connection)), ("bot.tools.availability", engine)):
+            patcher = mock.patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_afternoon_slot_is_booked_in_24_hour_time(self):
+        message = tools.insert_data.invoke({**self.booking, "appointment_time": "15:30"})
+        self.assertTrue(message.startswith("Your appointment request have been posted"), message)
+        _, parameters = next(call.args for call in self.cursor.execute.call_args_list if call.args[0] == tools.get_queries().insert)
+        self.assertEqual(parameters[5:7], ("15:30:00", "15:35:00"))
+
+    def test_slot_booked_since_the_day_was_cached_is_refused_in_the_transaction(self):
+        self.cursor.fetchall.return_value = [("SC_01812345678_20300115_15_30", timedelta(hours=15, minutes=30), timedelta(hours=15, minutes=35))]
+        message = tools.insert_data.invoke({**self.booking, "appointment_time": "15:30"})
+        self.assertIn("already booked", message)
+        self.assertNotIn(tools.get_queries().insert, [call.args[0] for call in self.cursor.execute.call_args_list])
+
+    def test_rejected_booking_of_the_same_slot_is_booked_again(self):
+        self.cursor.rowcount = 2    # the rejected row was revived by the duplicate key update
+        message = tools.insert_data.invoke({**self.booking, "appointment_time": "15:30"})
+        self.assertTrue(message.startswith("Your appointment request have been posted"), message)
+
+    def test_move_to_a_slot_booked_since_the_day_was_cached_is_refused_in_the_transaction(self):
+        record = (1, "SC_01712345678_20300115_10_00", "01712345678", "Rahim", 30, date(2030, 1, 15), timedelta(hours=10), timedelta(hours=10, minutes=5), "Pending")
+        self.cursor.fetchone.side_effect = [record, (1,), (1,)]    # the appointment, then the booking lock taken and released
+        self.cursor.fetchall.return_value = [("SC_01812345678_20300115_15_30", timedelta(hours=15, minutes=30), timedelta(hours=15, minutes=35))]
+        message = tools.update_data.invoke({"user_id": record[1], "appointment_time": "15:30"})
+        self.assertIn("already booked", message)
+        self.assertFalse(any(call.args[0].startswith("UPDATE") for call in self.cursor.execute.call_args_list))
+
+    def test_slot_after_closing_is_reported_as_outside_opening_hours(self):
+        message = tools.insert_data.invoke({**self.booking, "appointment_time": "21:30"})
+        self.assertIn("outside our opening hours", message)
+        self.assertNotIn("already booked", message)
+        self.cursor.execute.assert_not_called()
+
+
+class UserIdTests(SimpleTestCase):
+    def test_same_phone_and_time_in_another_month_gets_another_id(self):
+        january = tools.get_user_id(phone_number="01712345678", sc_date="2030-01-15", sc_time="10:00:00")
+        february = tools.get_user_id(phone_number="01712345678", sc_date="2030-02-15", sc_time="10:00:00")
+        self.assertEqual(january, "SC_01712345678_20300115_10_00")
+        self.assertNotEqual(january, february)
+
+    def test_ids_given_before_the_full_date_are_still_valid(self):
+        for user_id in ("SC_01712345678_20300115_10_00", "SC_01712345678_15_10_00"):
+            self.assertEqual(tools.BaseSchema.validate_user_id(user_id), user_id)
+        self.assertTrue(tools.is_error_message(tools.BaseSchema.validate_user_id("SC_01712345678_2030_10_00")))
+
+
+class BookingConstraintTests(TestCase):
+    booking = {"phone_number": "01712345678", "appointment_date": date(2030, 1, 15), "appointment_time": time(10, 0)}
+
+    def test_same_booking_is_rejected_by_the_database(self):
+        Customer.objects.create(user_id="SC_01712345678_15_10_00", person_name="Rahim", **self.booking)
+        with self.assertRaises(IntegrityError):
+            Customer.objects.create(user_id="SC_01712345678_15_10_00_2", person_name="Rahim", **self.booking)
+
+
+@unittest.skipUnless(connection.vendor == "mysql", "insert_data speaks the mysql dialect")
+class ConcurrentInsertTests(TransactionTestCase):
+    booking = {"phone_number": "01712345678", "person_name": "Rahim", "age": 30,
+               "appointment_date": "2030-01-15", "appointment_time": "10:00:00"}
+
+    def setUp(self):
+        # pointing the tools at the test database
+        from . import tools
+        settings = connection.settings_dict
+        pool = ConnectionPool(name="insert-test-pool", size=8, checkout_timeout=10, health_check=True,
+                              host=settings["HOST"] or "localhost", port=int(settings["PORT"] or 3306),
+                              user=settings["USER"], password=settings["PASSWORD"], database=settings["NAME"])
+        patcher = mock.patch.object(tools, "get_pool", return_value=pool)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        tools.availability.invalidate()
+        self.insert_data = tools.insert_data
+
+    def test_parallel_identical_bookings_create_one_row(self):
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            messages = list(executor.map(lambda _: self.insert_data.invoke(dict(self.booking)), range(8)))
+
+        self.assertEqual(Customer.objects.filter(phone_number="01712345678").count(), 1)
+        self.assertEqual(sum(message.startswith("Your appointment request have been posted") for message in messages), 1)
+        self.assertEqual(sum(message.startswith("Your have already booked") for message in messages), 7)
+
+    def test_rejected_booking_is_booked_again_and_an_active_one_is_not(self):
+        Customer.objects.create(user_id="SC_01712345678_20300115_10_00", phone_number="01712345678", person_name="Rahim",
+                                appointment_date=date(2030, 1, 15), appointment_time=time(10, 0), status=Customer.REJECTED)
+        self.assertTrue(tools.check_availability.invoke({"appointment_date": "2030-01-15", "appointment_time": "10:00"}).endswith("is free."))
+
+        message = self.insert_data.invoke({**self.booking, "person_name": "Rahim Uddin"})
+        self.assertTrue(message.startswith("Your appointment request have been posted"), message)
+        customer = Customer.objects.get(phone_number="01712345678")
+        self.assertEqual((customer.status, customer.person_name), (Customer.PENDING, "Rahim Uddin"))
+
+        self.assertTrue(self.insert_data.invoke(dict(self.booking)).startswith("Your have already booked"))
+        self.assertEqual(Customer.objects.get(phone_number="01712345678").person_name, "Rahim Uddin")
+
+    def test_parallel_bookings_of_one_slot_by_different_phones_create_one_row(self):
+        bookings = [{**self.booking, "phone_number": f"0171234567{number}"} for number in range(2)]
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            messages = list(executor.map(self.insert_data.invoke, bookings))
+
+        self.assertEqual(Customer.objects.filter(appointment_date=date(2030, 1, 15)).count(), 1)
+        self.assertEqual(sum(message.startswith("Your appointment request have been posted") for message in messages), 1)
+        self.assertEqual(sum("is already booked" in message for message in messages), 1)
+
+
+class ConnectionPoolTests(SimpleTestCase):
+    def setUp(self):
+        patcher = mock.patch("bot.dbpool.pooling.MySQLConnectionPool")
+        self.mysql_pool = patcher.start().return_value
+        self.addCleanup(patcher.stop)
+        self.conn = self.mysql_pool.get_connection.return_value
+        self.pool = ConnectionPool(name="test-pool", size=2, checkout_timeout=1, health_check=False)
+
+    def test_connection_is_returned_when_the_cursor_cannot_be_opened(self):
+        self.conn.cursor.side_effect = mysql_errors.OperationalError("Lost connection to MySQL server")
+        with self.assertRaises(mysql_errors.OperationalError):
+            with self.pool.connection():
+                pass
+        self.conn.close.assert_called_once()
+        self.assertEqual(self.pool.stats()["in_use"], 0)
+
+
+class SettingsTests(SimpleTestCase):
+    def test_config_file_keys_become_field_names(self):
+        self.assertEqual(normalize_keys({"google-firestore": {"PROJECT_ID": "p"}, "database": {"pool": {"checkout-timeout": 3}}}),
+                         {"google_firestore": {"project_id": "p"}, "database": {"pool": {"checkout_timeout": 3}}})
+
+    def test_environment_overrides_the_config_file(self):
+        with mock.patch.dict(os.environ, {"BOT_DATABASE__POOL__SIZE": "9", "BOT_HISTORY_POLICY__MODE": "summary"}):
+            settings = Settings()
+        self.assertEqual(settings.database.pool.size, 9)
+        self.assertEqual(settings.history_policy.mode, "summary")
+        self.assertEqual(settings.database.table, get_config().database.table)
+
+    def test_invalid_values_are_rejected(self):
+        for name, value in (("BOT_DATABASE__TABLE", "mytable; DROP TABLE mytable"), ("BOT_CHAT_HISTORY__BACKEND", "redis")):
+            with self.subTest(name=name), mock.patch.dict(os.environ, {name: value}), self.assertRaises(ValueError):
+                Settings()
+
+    def test_update_statement_is_built_once_per_column_set(self):
+        queries = Queries("mytable")
+        self.assertEqual(queries.update(["person_name", "age"]), "UPDATE mytable SET person_name = %s, age = %s WHERE user_id = %s")
+        self.assertIs(queries.update(["person_name", "age"]), queries.update(("person_name", "age")))
+
+
+# twilio style error carrying the http status of the api response
+class SendError(Exception):
+    def __init__(self, status):
+        super().__init__(f"HTTP {status}")
+        self.status = status
+
+
+class NotificationSenderTests(SimpleTestCase):
+    def make_sender(self, failures):
+        self.sent = []
+        self.sleeps = []
+
+        def send(to, body):
+            if failures:
+                raise failures.pop(0)
+            self.sent.append((to, body))
+
+        return NotificationSender(send=send, rate_limiter=RateLimiter(rate=1000, burst=1000), max_retries=3,
+                                  backoff=1, backoff_max=3, sleep=self.sleeps.append)
+
+    def test_transient_errors_are_retried_with_backoff(self):
+        sender = self.make_sender([SendError(429), SendError(503), ConnectionError()])
+        with self.assertLogs("bot.notifications", "WARNING"):
+            sender.send_with_retry("whatsapp:+8801712345678", "Approved")
+        self.assertEqual(self.sent, [("whatsapp:+8801712345678", "Approved")])
+        self.assertEqual(len(self.sleeps), 3)
+        for delay, ceiling in zip(self.sleeps, (1, 2, 3)):
+            self.assertTrue(ceiling / 2 <= delay <= ceiling)
+
+    def test_client_errors_and_exhausted_retries_are_raised(self):
+        with self.assertRaises(SendError):
+            self.make_sender([SendError(400)]).send_with_retry("whatsapp:+8801712345678", "Approved")
+        self.assertEqual(self.sleeps, [])
+        with self.assertRaises(SendError), self.assertLogs("bot.notifications", "WARNING"):
+            self.make_sender([SendError(500)] * 4).send_with_retry("whatsapp:+8801712345678", "Approved")
+        self.assertEqual(len(self.sleeps), 3)
+
+    def test_rate_limiter_spaces_messages_after_the_burst(self):
+        now = [0.0]
+        sleeps = []
+
+        def sleep(seconds):
+            sleeps.append(seconds)
+            now[0] += seconds
+
+        limiter = RateLimiter(rate=2, burst=2, clock=lambda: now[0], sleep=sleep)
+        for _ in range(4):
+            limiter.acquire()
+        self.assertEqual(sleeps, [0.5, 0.5])
+
+
+class BulkStatusTests(TestCase):
+    def setUp(self):
+        for number, status in enumerate((Customer.PENDING, Customer.PENDING, Customer.APPROVED)):
+            Customer.objects.create(user_id=f"SC_0171234567{number}_15_10_00", phone_number=f"0171234567{number}", person_name="Rahim",
+                                    appointment_date=date(2030, 1, 15), appointment_time=time(10, number), status=status)
+        session = self.client.session
+        session["username"] = "admin"
+        session.save()
+
+    def test_statuses_change_in_one_request_and_notifications_are_queued(self):
+        with mock.patch("bot.views.get_job_queue") as get_job_queue:
+            response = self.client.post("/bulk-status/", data={"user_ids": [f"SC_0171234567{number}_15_10_00" for number in range(3)], "status": Customer.APPROVED},
+                                        content_type="application/json")
+        self.assertEqual(response.status_code, 202)
+        data = response.json()
+        self.assertEqual((data["updated"], data["notifications"]), (2, 2))
+        self.assertEqual(Customer.objects.filter(status=Customer.APPROVED).count(), 3)
+
+        _, kwargs = get_job_queue.return_value.enqueue.call_args
+        self.assertEqual(kwargs["job_id"], data["job_id"])
+        self.assertEqual([notification["to"] for notification in kwargs["notifications"]], ["whatsapp:+8801712345670", "whatsapp:+8801712345671"])
+        self.assertEqual(get_progress(data["job_id"])["state"], "queued")
+
+    def test_unknown_status_is_rejected(self):
+        response = self.client.post("/bulk-status/", data={"user_ids": ["SC_01712345670_15_10_00"], "status": "Done"}, content_type="application/json")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Customer.objects.filter(status=Customer.PENDING).count(), 2)
+
+
+class JobQueueTests(SimpleTestCase):
+    def test_named_queue_does_not_hold_up_the_shared_workers(self):
+        release, ran = threading.Event(), []
+        register_job("test_long_send", queue="test_notifications")(lambda: release.wait(5))
+        register_job("test_turn")(lambda: ran.append("turn"))
+        job_queue = InProcessJobQueue(workers=1)
+        job_queue.enqueue(key="whatsapp:+8801712345678", name="test_long_send")
+        job_queue.enqueue(key="whatsapp:+8801712345678", name="test_turn")
+        for _ in range(100):
+            if ran:
+                break
+            sleep(0.01)
+        release.set()
+        job_queue.join()
+        self.assertEqual(ran, ["turn"])
+
+    def test_held_jobs_are_released_as_one_job_and_resumed_after_a_restart(self):
+        turns = []
+        register_job("test_held_turn")(lambda messages: turns.append(messages))
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "jobs.sqlite3")
+            job_queue = SQLiteJobQueue(path=path, workers=1)
+            job_ids = [job_queue.hold(key="whatsapp:+8801712345678", name="test_held_turn", messages=[message]) for message in ("Hi", "my name is Rahim")]
+            job_queue.release(job_ids, messages=["Hi", "my name is Rahim"])
+            job_queue.join()
+            # messages still held when the process stops
+            for message in ("01712345678", "tomorrow at 4 pm"):
+                job_queue.hold(key="whatsapp:+8801712345678", name="test_held_turn", messages=[message])
+            job_queue.stop()
+
+            SQLiteJobQueue(path=path, workers=1, clock=lambda: datetime.now().timestamp() + 120).join()
+            with closing(sqlite3.connect(path)) as db:
+                statuses = [status for status, in db.execute("SELECT status FROM jobs ORDER BY id")]
+
+        self.assertEqual(turns, [["Hi", "my name is Rahim"], ["01712345678"], ["tomorrow at 4 pm"]])
+        self.assertEqual(statuses, ["done", "merged", "done", "done"])
+
+    def test_jobs_of_a_live_process_are_only_resumed_once_its_lease_expires(self):
+        turns = []
+        register_job("test_leased_turn")(lambda message: turns.append(message))
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "jobs.sqlite3")
+            job_queue = SQLiteJobQueue(path=path, workers=1)
+            job_queue.hold(key="whatsapp:+8801712345678", name="test_leased_turn", message="Hi")
+
+            SQLiteJobQueue(path=path, workers=1).join()
+            self.assertEqual(turns, [])
+
+            job_queue.stop()
+            SQLiteJobQueue(path=path, workers=1, clock=lambda: datetime.now().timestamp() + 120).join()
+        self.assertEqual(turns, ["Hi"])
+
+    def test_resumed_bulk_notification_job_skips_the_users_already_notified(self):
+        notifications = [{"user_id": f"SC_0171234567{number}_20300115_10_00", "to": f"whatsapp:+880171234567{number}", "body": "Approved."}
+                         for number in range(3)]
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "jobs.sqlite3")
+            with closing(sqlite3.connect(path)) as db, db:
+                # a job interrupted by a restart after the first notification was sent
+                db.execute("CREATE TABLE jobs (id INTEGER PRIMARY KEY AUTOINCREMENT, key TEXT NOT NULL, name TEXT NOT NULL, payload TEXT NOT NULL, "
+                           "status TEXT NOT NULL DEFAULT 'pending', error TEXT)")
+                db.execute("INSERT INTO jobs (key, name, payload, status) VALUES (?, ?, ?, 'pending')",
+                           ("bulk_status_notifications", "bulk_status_notifications", json.dumps({"job_id": "resumed", "notifications": notifications})))
+                db.execute("ALTER TABLE jobs ADD COLUMN checkpoint TEXT")
+                db.execute("UPDATE jobs SET checkpoint = ?", (json.dumps([notifications[0]["user_id"]]),))
+
+            with mock.patch("bot.views.get_notification_sender") as get_sender, mock.patch("bot.views.get_database_agent"):
+                job_queue = SQLiteJobQueue(path=path, workers=1)
+                job_queue.join()
+            with closing(sqlite3.connect(path)) as db:
+                status, checkpoint = db.execute("SELECT status, checkpoint FROM jobs").fetchone()
+
+        self.assertEqual([kwargs["to"] for _, kwargs in get_sender.return_value.send_with_retry.call_args_list],
+                         ["whatsapp:+8801712345671", "whatsapp:+8801712345672"])
+        self.assertEqual(status, "done")
+        self.assertEqual(json.loads(checkpoint), [notification["user_id"] for notification in notifications])
+        self.assertEqual(get_progress("resumed")["sent"], 3)
+
+
+class CustomerListTests(TestCase):
+    def setUp(self):
+        # sort keys tied in every field but serial_no
+        for number, (day, hour, name, status) in enumerate([(15, 10, "Rahim", Customer.PENDING), (15, 10, "Rahim", Customer.PENDING),
+                                                            (15, 11, "Karim", Customer.APPROVED), (16, 10, "Rahim", Customer.PENDING),
+                                                            (16, 10, "Abdul", Customer.REJECTED), (14, 9, "Karim", Customer.APPROVED),
+                                                            (15, 10, "Abdul", Customer.PENDING)]):
+            Customer.objects.create(user_id=f"SC_0181234567{number}_203001{day}_{hour}_00", phone_number=f"0181234567{number}",
+                                    person_name=name, appointment_date=date(2030, 1, day), appointment_time=time(hour, 0), status=status)
+        session = self.client.session
+        session["username"] = "admin"
+        session.save()
+
+    def walk(self, **params):
+        serial_nos, cursor = [], None
+        while True:
+            response = self.client.get("/customers/", {**params, "page_size": 2, **({"cursor": cursor} if cursor else {})})
+            self.assertEqual(response.status_code, 200)
+            data = response.json()
+            serial_nos += [row["serial_no"] for row in data["results"]]
+            cursor = data["next_cursor"]
+            if cursor is None:
+                return serial_nos
+
+    def test_every_sort_visits_each_row_once_in_both_directions(self):
+        rows = list(Customer.objects.values())
+        for sort, fields in CUSTOMER_SORTS.items():
+            for descending in (False, True):
+                with self.subTest(sort=sort, descending=descending):
+                    expected = [row["serial_no"] for row in sorted(rows, key=lambda row: [row[field] for field in fields], reverse=descending)]
+                    self.assertEqual(self.walk(sort=f"-{sort}" if descending else sort), expected)
+
+    def test_filters(self):
+        customers = Customer.objects.order_by("serial_no")
+        self.assertEqual(self.walk(sort="created", status=Customer.PENDING), [customer.serial_no for customer in customers.filter(status=Customer.PENDING)])
+        self.assertEqual(self.walk(sort="created", date_from="2030-01-15", date_to="2030-01-15"),
+                         [customer.serial_no for customer in customers.filter(appointment_date=date(2030, 1, 15))])
+        self.assertEqual(self.walk(sort="created", phone="01812345673"), [customers.get(phone_number="01812345673").serial_no])
+
+    def test_malformed_requests_are_rejected(self):
+        wrong_type_cursor = encode_cursor(["tomorrow", "10:00:00", 1])
+        for params in ({"cursor": "not a cursor"}, {"cursor": encode_cursor([1, 2])}, {"sort": "appointment", "cursor": wrong_type_cursor},
+                       {"sort": "appointment", "cursor": encode_cursor([{"day": 15}, "10:00:00", 1])},
+                       {"page_size": "ten"}, {"date_from": "2030-13-01"}, {"sort": "age"}):
+            with self.subTest(params=params):
+                self.assertEqual(self.client.get("/customers/", params).status_code, 400)
+
+    def test_login_is_required(self):
+        self.client.logout()
+        self.assertEqual(self.client.get("/customers/").status_code, 401)
+
+
+class ResultRendererTests(SimpleTestCase):
+    record = {"user_id": "SC_01712345678_20300115_15_30", "phone_number": "01712345678", "person_name": "Rahim", "age": 30,
+              "appointment_date": date(2030, 1, 15), "appointment_time": timedelta(hours=15, minutes=30),
+              "appointment_end_time": timedelta(hours=15, minutes=35), "status": "Pending"}
+
+    def test_whatsapp_style_in_english(self):
+        self.assertEqual(render_appointment_details(self.record, style="whatsapp", language="en"),
+                         "*Appointment Details for Rahim.*\n\n"
+                         "*User ID*: SC_01712345678_20300115_15_30\n"
+                         "*Phone Number*: 01712345678\n"
+                         "*Age*: 30 years old\n\n"
+                         "*Appointment Schedule*:\n"
+                         "    Date: 15-01-2030\n"
+                         "    Time: 3:30 PM - 3:35 PM\n\n"
+                         "*Status*: Pending\n\n"
+                         "See you on due time.")
+
+    def test_plain_style_has_no_formatting(self):
+        message = render_appointment_details(self.record, style="plain", language="en")
+        self.assertNotIn("*", message)
+        self.assertTrue(message.startswith("Appointment Details for Rahim.\n\nUser ID: SC_01712345678_20300115_15_30\n"))
+
+    def test_bengali_labels(self):
+        message = render_appointment_details(self.record, style="plain", language="bn")
+        for label in ("Rahim এর অ্যাপয়েন্টমেন্টের বিবরণ।", "ইউজার আইডি: SC_01712345678_20300115_15_30", "বয়স: 30 বছর", "অবস্থা: Pending"):
+            self.assertIn(label, message)
+        self.assertEqual(render_appointment_details(self.record, style="plain", language="fr"), render_appointment_details(self.record, style="plain"))
+
+    def test_missing_age_is_not_provided(self):
+        self.assertIn("*Age*: Not provided", render_appointment_details({**self.record, "age": None}))
+        self.assertIn("বয়স: দেওয়া হয়নি", render_appointment_details({**self.record, "age": None}, style="plain", language="bn"))
+
+    def test_times_around_noon_and_midnight(self):
+        self.assertEqual([format_time(value) for value in (timedelta(0), timedelta(hours=12, minutes=5), time(23, 55))],
+                         ["12:00 AM", "12:05 PM", "11:55 PM"])
+
+    def test_only_the_changed_fields_of_an_update_are_rendered(self):
+        changes = {"user_id": self.record["user_id"], "age": 0, "appointment_time": time(15, 30), "appointment_end_time": time(15, 35)}
+        self.assertEqual(render_updated_fields(changes, style="whatsapp", language="en"),
+                         "*User ID*: SC_01712345678_20300115_15_30\n*Age*: 0 years old\n*Time*: 3:30 PM - 3:35 PM")
+        self.assertEqual(render_updated_fields({"user_id": self.record["user_id"], "person_name": "Karim"}, style="plain", language="bn"),
+                         "ইউজার আইডি: SC_01712345678_20300115_15_30\nনাম: Karim")
+
+
+class InvalidFieldTests(SimpleTestCase):
+    def test_rephrased_error_is_never_used_as_a_value(self):
+        chains = mock.Mock()
+        chains.error_generator_chain.invoke.return_value = "Hmm, that phone number does not look right."
+        with mock.patch.object(get_config().error_messages, "mode", "llm"), \
+             mock.patch("bot.tools.get_chains", return_value=chains), \
+             mock.patch("bot.tools.get_connection") as get_connection:
+            message = tools.update_data.invoke({"user_id": "SC_01712345678_15_10_00", "phone_number": "12345"})
+        self.assertEqual(message, "Hmm, that phone number does not look right.")
+        get_connection.assert_not_called()
+        self.assertIn("Invalid phone number", chains.error_generator_chain.invoke.call_args.kwargs["input"]["input"])
+
+    def test_validators_do_not_call_the_llm(self):
+        with mock.patch.object(get_config().error_messages, "mode", "llm"), mock.patch("bot.tools.get_chains") as get_chains:
+            self.assertEqual(tools.BaseSchema.validate_user_id("SC_1").field, "user_id")
+        get_chains.assert_not_called()
+
+
+class SearchCacheTests(SimpleTestCase):
+    user_id = "SC_01712345678_15_10_00"
+    record = (1, user_id, "01712345678", "Rahim", 30, date(2030, 1, 15), timedelta(hours=10), timedelta(hours=10, minutes=5), "Pending")
+
+    def setUp(self):
+        tools.search_cache.clear()
+        self.cursor = mock.Mock(rowcount=1)
+        self.cursor.fetchone.return_value = self.record
+        connection = mock.MagicMock()
+        connection.__enter__.return_value = (mock.Mock(), self.cursor)
+        patcher = mock.patch("bot.tools.get_connection", return_value=connection)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_repeated_search_is_answered_from_the_cache(self):
+        first = tools.search_data.func(self.user_id)
+        self.assertEqual(tools.search_data.func(self.user_id), first)
+        self.assertEqual(self.cursor.execute.call_count, 1)
+        self.assertEqual(tools.search_cache.stats()["hits"], 1)
+
+    def test_missing_appointment_is_not_cached(self):
+        self.cursor.fetchone.return_value = None
+        tools.search_data.func(self.user_id)
+        tools.search_data.func(self.user_id)
+        self.assertEqual(self.cursor.execute.call_count, 2)
+
+    def test_delete_drops_the_cached_result(self):
+        tools.search_data.func(self.user_id)
+        with mock.patch.object(tools.availability, "invalidate"):
+            tools.delete_data.func(self.user_id)
+        self.assertIsNone(tools.search_cache.get(self.user_id))
+
+
+# summarizer recording what it was asked to fold, the summary names the folded messages
+class FakeSummaryChain:
+    def __init__(self):
+        self.inputs = []
+
+    def invoke(self, input):
+        self.inputs.append(input)
+        return " + ".join(filter(None, [input["summary"], input["messages"].replace("\n", ", ")]))
+
+    async def ainvoke(self, input):
+        return self.invoke(input)
+
+
+class HistoryPolicyTests(SimpleTestCase):
+    session_id = "whatsapp:+8801712345678"
+
+    def setUp(self):
+        self.backend = InMemoryBackend()
+        self.chain = FakeSummaryChain()
+
+    def policy(self, mode, **kwargs):
+        return HistoryPolicy(chat_history_handler=ChatHistoryHandler(backend=self.backend), mode=mode, summary_chain=self.chain, **kwargs)
+
+    @staticmethod
+    def history(count):
+        return [(HumanMessage if number % 2 == 0 else AIMessage)(content=f"m{number}") for number in range(count)]
+
+    def test_last_n_keeps_the_newest_messages(self):
+        chat_history = self.history(5)
+        self.assertEqual(self.policy("last-n", max_messages=3).apply(self.session_id, chat_history), chat_history[-3:])
+        self.assertEqual(self.policy("last-n", max_messages=0).apply(self.session_id, chat_history), [])
+        self.assertEqual(self.policy("all", max_messages=3).apply(self.session_id, chat_history), chat_history)
+
+    def test_token_budget_keeps_the_newest_messages_that_fit(self):
+        chat_history = [HumanMessage(content="x" * 400), AIMessage(content="short"), HumanMessage(content="x" * 40), AIMessage(content="ok")]
+        # 4 + 14 + 5 tokens fit in 30, the 104 token message does not and nothing older is taken after it
+        self.assertEqual(self.policy("token-budget", max_tokens=30).apply(self.session_id, chat_history), chat_history[1:])
+        self.assertEqual(self.policy("token-budget", max_tokens=3).apply(self.session_id, chat_history), [])
+
+    def test_half_a_window_is_folded_only_once_the_window_overflows(self):
+        policy = self.policy("summary", max_messages=4)
+        chat_history = self.history(4)
+        self.assertEqual(policy.apply(self.session_id, chat_history), chat_history)
+        self.assertEqual(self.chain.inputs, [])
+
+        chat_history = self.history(5)
+        messages = policy.apply(self.session_id, chat_history)
+        self.assertEqual(messages[0].content, "Summary of the earlier conversation: User: m0, Assistant: m1, User: m2")
+        self.assertEqual(messages[1:], chat_history[3:])
+
+        # the window has room again, the summarizer is not run on every turn
+        chat_history = self.history(7)
+        self.assertEqual(policy.apply(self.session_id, chat_history)[1:], chat_history[3:])
+        self.assertEqual(len(self.chain.inputs), 1)
+
+        chat_history = self.history(8)
+        messages = policy.apply(self.session_id, chat_history)
+        self.assertEqual(self.chain.inputs[-1]["summary"], "User: m0, Assistant: m1, User: m2")
+        self.assertEqual(messages[1:], chat_history[6:])
+
+    def test_summary_is_stored_with_the_number_of_folded_messages(self):
+        self.policy("summary", max_messages=4).apply(self.session_id, self.history(5))
+        self.assertEqual(ChatHistoryHandler(backend=self.backend).get_summary(chat_session_id=self.session_id),
+                         ("User: m0, Assistant: m1, User: m2", 3))
+
+        # a policy of another process continues from the stored summary instead of folding again
+        chat_history = self.history(6)
+        messages = self.policy("summary", max_messages=4).apply(self.session_id, chat_history)
+        self.assertEqual(len(self.chain.inputs), 1)
+        self.assertEqual(messages[1:], chat_history[3:])
+
+    def test_summary_is_dropped_when_the_history_was_cleared(self):
+        policy = self.policy("summary", max_messages=4)
+        policy.apply(self.session_id, self.history(5))
+        chat_history = self.history(1)    # a new conversation after a booking cleared the history
+        self.assertEqual(policy.apply(self.session_id, chat_history), chat_history)
+        self.assertEqual(len(self.chain.inputs), 1)
+
+    def test_async_apply_matches_apply(self):
+        chat_history = self.history(5)
+        messages = asyncio.run(self.policy("summary", max_messages=4).aapply(self.session_id, chat_history))
+        self.assertEqual(messages[0].content, "Summary of the earlier conversation: User: m0, Assistant: m1, User: m2")
+        self.assertEqual(asyncio.run(ChatHistoryHandler(backend=self.backend).aget_summary(chat_session_id=self.session_id)),
+                         ("User: m0, Assistant: m1, User: m2", 3))
+
+
+class IntentRouterTests(SimpleTestCase):
+    user_id = "SC_01712345678_20300115_10_00"
+
+    def setUp(self):
+        self.router = IntentRouter()
+        self.tools = {"search_data": mock.Mock(), "delete_data": mock.Mock()}
+        for tool_name, tool_mock in self.tools.items():
+            tool_mock.invoke.return_value = f"{tool_name} answer"
+        patcher = mock.patch.dict("bot.router.TOOLS", self.tools)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_plain_cancel_command_calls_delete_data(self):
+        for query in (f"cancel my appointment {self.user_id}", f"Cancel {self.user_id.lower()} please.", f"delete booking id: {self.user_id}"):
+            with self.subTest(query=query):
+                self.assertEqual(self.router.route(query), "delete_data answer")
+        self.tools["delete_data"].invoke.assert_called_with({"user_id": self.user_id})
+
+    def test_plain_status_command_calls_search_data(self):
+        self.assertEqual(self.router.route(f"status of {self.user_id}?"), "search_data answer")
+        self.tools["search_data"].invoke.assert_called_once_with({"user_id": self.user_id})
+
+    def test_anything_beyond_the_command_goes_to_the_agent(self):
+        for query in (f"don't cancel {self.user_id}",
+                      f"cancel {self.user_id} and SC_01812345678_20300115_10_05",
+                      f"cancel {self.user_id} tomorrow?",
+                      f"can you cancel {self.user_id}",
+                      f"cancel SC_0171234567_20300115_10_00",
+                      "cancel my appointment"):
+            with self.subTest(query=query):
+                self.assertIsNone(self.router.route(query))
+        self.tools["delete_data"].invoke.assert_not_called()
+
+    def test_old_user_ids_with_the_day_of_the_month_are_routed(self):
+        self.assertEqual(self.router.parse("cancel SC_01712345678_15_10_00"), ("delete_data", "SC_01712345678_15_10_00"))
+
+    def test_disabled_router_hands_every_turn_to_the_agent(self):
+        self.assertIsNone(IntentRouter(enabled=False).route(f"cancel {self.user_id}"))
+        self.tools["delete_data"].invoke.assert_not_called()
+
+    def test_routed_and_llm_turns_are_counted(self):
+        self.router.route(f"cancel {self.user_id}")
+        self.router.route(f"status {self.user_id}")
+        self.router.route("I want to book an appointment")
+        self.assertEqual(self.router.stats(), {"routed_turns": 2, "llm_turns": 1})
+
+    def test_async_route_matches_route(self):
+        self.tools["delete_data"].ainvoke = mock.AsyncMock(return_value="delete_data answer")
+        self.assertEqual(asyncio.run(self.router.aroute(f"cancel {self.user_id}")), "delete_data answer")
+        self.assertIsNone(asyncio.run(self.router.aroute(f"don't cancel {self.user_id}")))
+        self.assertEqual(self.router.stats(), {"routed_turns": 1, "llm_turns": 1})
+
+
+class SingleStatementWriteTests(SimpleTestCase):
+    user_id = "SC_01712345678_20300115_10_00"
+
+    def setUp(self):
+        self.cursor = mock.Mock(rowcount=1)
+        connection = mock.MagicMock()
+        connection.__enter__.return_value = (mock.Mock(), self.cursor)
+        self.availability = mock.Mock()
+        for target, value in (("bot.tools.get_connection", mock.Mock(return_value=connection)), ("bot.tools.availability", self.availability)):
+            patcher = mock.patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def statements(self):
+        return [call.args[0] for call in self.cursor.execute.call_args_list]
+
+    def test_cancel_is_one_statement_and_drops_only_the_day_of_the_user_id(self):
+        message = tools.delete_data.func(self.user_id)
+        self.assertEqual(message, f"Appointment canceled for user id {self.user_id}.")
+        self.assertEqual(self.statements(), [tools.get_queries().delete])
+        self.availability.invalidate.assert_called_once_with(date(2030, 1, 15))
+
+    def test_cancel_of_an_old_user_id_drops_every_cached_day(self):
+        tools.delete_data.func("SC_01712345678_15_10_00")
+        self.availability.invalidate.assert_called_once_with(None)
+
+    def test_cancel_of_a_missing_user_id_is_reported_from_the_row_count(self):
+        self.cursor.rowcount = 0
+        message = tools.delete_data.func(self.user_id)
+        self.assertEqual(message, f"No appointment details found with the user id {self.user_id}.")
+        self.assertEqual(self.statements(), [tools.get_queries().delete])
+        self.availability.invalidate.assert_not_called()
+
+    def test_update_is_one_statement(self):
+        message = tools.update_data.invoke({"user_id": self.user_id, "person_name": "Karim"})
+        self.assertTrue(message.startswith("Your appointment details have been updated."), message)
+        self.assertEqual(self.statements(), [tools.get_queries().update(["person_name"])])
+
+    def test_update_of_a_missing_user_id_is_reported_from_the_row_count(self):
+        self.cursor.rowcount = 0
+        self.cursor.fetchone.return_value = None
+        message = tools.update_data.invoke({"user_id": self.user_id, "person_name": "Karim"})
+        self.assertEqual(message, f"No appointment details found for user id {self.user_id}.")
+        # 0 affected rows is also reported for unchanged values, only then the user id is looked up
+        self.assertEqual(self.statements(), [tools.get_queries().update(["person_name"]), tools.get_queries().exists])
+
+
+class TurnGateTests(SimpleTestCase):
+    sessions = ["whatsapp:+8801712345678", "whatsapp:+8801812345678", "whatsapp:+8801912345678"]
+
+    def setUp(self):
+        self.lock = threading.Lock()
+        self.running = {}
+        self.peak = {"total": 0}
+
+    # function for recording how many turns run at once, in total and per session
+    def enter(self, session):
+        with self.lock:
+            self.running[session] = self.running.get(session, 0) + 1
+            total = sum(self.running.values())
+            self.peak["total"] = max(self.peak["total"], total)
+            self.peak[session] = max(self.peak.get(session, 0), self.running[session])
+
+    def leave(self, session):
+        with self.lock:
+            self.running[session] -= 1
+
+    def test_turns_of_a_session_are_serialised_and_the_total_is_limited(self):
+        gate = TurnGate(max_concurrent=2)
+
+        def turn(session):
+            with gate.turn(session):
+                self.enter(session)
+                sleep(0.01)
+                self.leave(session)
+
+        with ThreadPoolExecutor(max_workers=9) as executor:
+            list(executor.map(turn, self.sessions * 3))
+        self.assertEqual(self.peak["total"], 2)
+        self.assertTrue(all(self.peak[session] == 1 for session in self.sessions))
+        stats = gate.stats()
+        self.assertEqual((stats["completed"], stats["waiting"], stats["running"]), (9, 0, 0))
+        self.assertGreater(stats["peak_waiting"], 0)
+
+    def test_async_turns_of_a_session_are_serialised_and_the_total_is_limited(self):
+        gate = AsyncTurnGate(max_concurrent=2)
+
+        async def turn(session):
+            async with gate.turn(session):
+                self.enter(session)
+                await asyncio.sleep(0.01)
+                self.leave(session)
+
+        async def main():
+            await asyncio.gather(*(turn(session) for session in self.sessions * 3))
+
+        asyncio.run(main())
+        self.assertEqual(self.peak["total"], 2)
+        self.assertTrue(all(self.peak[session] == 1 for session in self.sessions))
+        self.assertEqual(gate.stats()["completed"], 9)
+
+    def test_async_turns_of_a_session_are_serialised_across_event_loops(self):
+        # under wsgi every async view runs through async_to_sync on an event loop of its own
+        gate = AsyncTurnGate(max_concurrent=2)
+
+        async def turn(session):
+            async with gate.turn(session):
+                self.enter(session)
+                await asyncio.sleep(0.05)
+                self.leave(session)
+
+        threads = [threading.Thread(target=async_to_sync(turn), args=(self.sessions[0],), daemon=True) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(timeout=5)
+        self.assertFalse(any(thread.is_alive() for thread in threads))
+        self.assertEqual(self.peak[self.sessions[0]], 1)
+        self.assertEqual(gate.stats()["completed"], 2)
+
+    def test_cancelled_async_turn_does_not_keep_the_session(self):
+        gate = AsyncTurnGate(max_concurrent=1)
+
+        async def turn(session, seconds):
+            async with gate.turn(session):
+                await asyncio.sleep(seconds)
+
+        async def main():
+            first = asyncio.create_task(turn(self.sessions[0], 0.02))
+            waiting = asyncio.create_task(turn(self.sessions[0], 0))
+            await asyncio.sleep(0)
+            waiting.cancel()
+            await first
+            await asyncio.wait_for(turn(self.sessions[0], 0), timeout=1)
+
+        asyncio.run(main())
+        self.assertEqual(gate.stats()["completed"], 2)
+
+
+@tool
+def lookup_slots(day: str) -> str:
+    """Looks up the free slots of a day."""
+    return f"10:00 and 10:05 are free on {day}."
+
+
+class LLMInstrumentationTests(SimpleTestCase):
+    def test_llm_and_tool_calls_are_traced_and_counted(self):
+        chain = instrumented(ChatPromptTemplate.from_messages([("human", "{input}")]) | FakeListChatModel(responses=["Rephrased."]) | StrOutputParser(),
+                             "result_rephraser")
+        calls_before = REGISTRY.get_sample_value("bot_llm_call_seconds_count", {"chain": "result_rephraser", "model": "unknown"}) or 0
+        with self.assertLogs("bot.trace", "INFO") as logs, traced_turn("web:test") as trace:
+            self.assertEqual(chain.invoke({"input": "Appointment details"}), "Rephrased.")
+            instrumented(lookup_slots, "agent").invoke({"day": "2030-01-15"})
+
+        self.assertEqual([step["type"] for step in trace.steps], ["llm", "tool"])
+        self.assertEqual(trace.steps[0]["chain"], "result_rephraser")
+        self.assertEqual(trace.steps[1]["tool"], "lookup_slots")
+        self.assertIn('"chat_session_id": "web:test"', logs.output[0])
+        self.assertEqual(REGISTRY.get_sample_value("bot_llm_call_seconds_count", {"chain": "result_rephraser", "model": "unknown"}), calls_before + 1)
+        self.assertGreaterEqual(REGISTRY.get_sample_value("bot_tool_call_seconds_count", {"tool": "lookup_slots"}), 1)
+
+
+class MetricsTests(SimpleTestCase):
+    def sample(self, name, labels):
+        return REGISTRY.get_sample_value(name, labels) or 0
+
+    def test_views_and_bot_stats_are_scraped(self):
+        self.client.get("/metrics/")
+        response = self.client.get("/metrics/")
+        self.assertEqual(response.status_code, 200)
+        body = response.content.decode()
+        self.assertIn('bot_view_seconds_count{method="GET",status="200",view="metrics"}', body)
+        for family in ("bot_cache_entries", "bot_cache_lookups_total", "bot_turns_waiting", "bot_whatsapp_turns_total", "bot_error_messages_total"):
+            self.assertIn(f"\n{family}{{", body)
+
+    def test_statements_are_timed_by_verb(self):
+        cursor = TimedCursor(mock.Mock(rowcount=1))
+        before = self.sample("bot_db_query_seconds_count", {"statement": "DELETE"})
+        cursor.execute(" DELETE FROM mytable WHERE user_id = %s", ("SC_01712345678_15_10_00",))
+        self.assertEqual(self.sample("bot_db_query_seconds_count", {"statement": "DELETE"}), before + 1)
+        self.assertEqual(cursor.rowcount, 1)
+
+        cursor = TimedCursor(mock.Mock(**{"execute.side_effect": IntegrityError("duplicate")}))
+        errors_before = self.sample("bot_db_query_errors_total", {"statement": "INSERT"})
+        with self.assertRaises(IntegrityError):
+            cursor.execute("INSERT INTO mytable VALUES (%s)", (1,))
+        self.assertEqual(self.sample("bot_db_query_errors_total", {"statement": "INSERT"}), errors_before + 1)
+
+    def test_chat_history_reads_from_the_backend_are_timed(self):
+        handler = ChatHistoryHandler(backend=InMemoryBackend())
+        labels = {"backend": "InMemoryBackend", "operation": "get_messages"}
+        before = self.sample("bot_chat_history_seconds_count", labels)
+        handler.get_chat_history("web:metrics")
+        handler.get_chat_history("web:metrics")    # served by the cache
+        self.assertEqual(self.sample("bot_chat_history_seconds_count", labels), before + 1)
+
+
+# timer which only fires when the test says so
+class ManualTimer:
+    def __init__(self, delay, callback):
+        self.delay = delay
+        self.callback = callback
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class MessageCoalescerTests(SimpleTestCase):
+    def setUp(self):
+        self.now = 0.0
+        self.timers = []
+        self.turns = []
+        self.coalescer = MessageCoalescer(flush=lambda key, messages, context: self.turns.append((key, messages, context)),
+                                          window=2, max_wait=5, timer=self.start_timer, clock=lambda: self.now)
+
+    def start_timer(self, delay, callback):
+        self.timers.append(ManualTimer(delay, callback))
+        return self.timers[-1]
+
+    # function for firing the timers which have not been cancelled
+    def fire(self):
+        for timer in [timer for timer in self.timers if not timer.cancelled]:
+            timer.callback()
+
+    def test_messages_within_the_window_are_one_turn(self):
+        for message in ("Hi", "my name is Rahim", "01712345678"):
+            self.coalescer.add("whatsapp:+8801712345678", message, receiver_number="whatsapp:+14155238886")
+            self.now += 1
+        self.coalescer.add("whatsapp:+8801812345678", "status of SC_01812345678_15_10_00", receiver_number="whatsapp:+14155238886")
+        self.fire()
+        self.assertEqual(self.turns, [("whatsapp:+8801712345678", ["Hi", "my name is Rahim", "01712345678"], {"receiver_number": "whatsapp:+14155238886"}),
+                                      ("whatsapp:+8801812345678", ["status of SC_01812345678_15_10_00"], {"receiver_number": "whatsapp:+14155238886"})])
+        stats = self.coalescer.stats()
+        self.assertEqual((stats["turns"], stats["merged_turns"], stats["single_turns"], stats["turns_saved"]), (2, 1, 1, 2))
+
+    def test_a_sender_who_keeps_writing_is_answered_after_max_wait(self):
+        for _ in range(4):
+            self.coalescer.add("whatsapp:+8801712345678", "...")
+            self.now += 1.5
+        self.assertEqual(self.timers[-1].delay, 0.5)    # 5 seconds after the first message
+
+    def test_zero_window_starts_a_turn_per_message(self):
+        self.coalescer.window = 0
+        self.coalescer.add("whatsapp:+8801712345678", "Hi")
+        self.assertEqual(len(self.turns), 1)
+        self.assertEqual(self.timers, [])
+
+
+class WhatsappIdempotencyTests(SimpleTestCase):
+    payload = {"ProfileName": "Rahim", "MessageType": "text", "WaId": "8801712345678", "SmsStatus": "received",
+               "Body": "What is the status of my appointment?", "To": "whatsapp:+14155238886", "From": "whatsapp:+8801712345678",
+               "MessageSid": "SM0123456789abcdef0123456789abcdef"}
+
+    def setUp(self):
+        self.store = IdempotencyStore()
+        self.job_queue = mock.Mock()
+        for target, value in (("bot.views.get_idempotency_store", self.store), ("bot.views.get_job_queue", self.job_queue)):
+            patcher = mock.patch(target, return_value=value)
+            self.addCleanup(patcher.stop)
+            patcher.start()
+        patcher = mock.patch("bot.views.whatsapp_coalescer.window", 0)
+        self.addCleanup(patcher.stop)
+        patcher.start()
+
+    def test_concurrent_replays_of_a_webhook_are_processed_once(self):
+        with self.assertLogs("bot.views", "INFO"), ThreadPoolExecutor(max_workers=8) as executor:
+            responses = list(executor.map(lambda _: Client().post("/whatsapp-chat/", data=self.payload), range(16)))
+        self.assertTrue(all(response.status_code == 200 for response in responses))
+        self.assertEqual(self.job_queue.hold.call_count, 1)
+        self.assertEqual(self.store.duplicates, 15)
+
+    def test_replay_after_the_turn_gets_the_previous_reply(self):
+        agent = mock.Mock()
+        agent.get_response.return_value = "Your appointment is pending."
+        with mock.patch("bot.views.get_database_agent", return_value=agent), mock.patch("bot.notifications.get_twilio_client") as get_twilio_client:
+            self.client.post("/whatsapp-chat/", data=self.payload)
+            process_whatsapp_turn(sender_number=self.payload["From"], receiver_number=self.payload["To"],
+                                  message_content=self.payload["Body"], message_sids=[self.payload["MessageSid"]])
+            with self.assertLogs("bot.views", "INFO"):
+                response = self.client.post("/whatsapp-chat/", data=self.payload)
+        self.assertEqual(response.content.decode(), "Your appointment is pending.")
+        self.assertEqual(agent.get_response.call_count, 1)
+        self.assertEqual(get_twilio_client.return_value.messages.create.call_count, 1)
+
+    def test_turn_resumed_after_a_restart_is_not_answered_twice(self):
+        agent = mock.Mock()
+        payload = {"sender_number": self.payload["From"], "receiver_number": self.payload["To"],
+                   "message_content": self.payload["Body"], "message_sids": [self.payload["MessageSid"]]}
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "jobs.sqlite3")
+            SQLiteJobQueue(path=path, workers=1).stop()
+            with closing(sqlite3.connect(path)) as db, db:
+                # turns interrupted by a restart, the first after its reply was sent, the second before
+                for sent in (True, False):
+                    db.execute("INSERT INTO jobs (key, name, payload, status, checkpoint) VALUES (?, 'whatsapp_turn', ?, 'running', ?)",
+                               (self.payload["From"], json.dumps(payload), json.dumps({"reply": f"Reply sent {sent}.", "sent": sent})))
+
+            # the idempotency store of the restarted process is empty
+            with mock.patch("bot.views.get_database_agent", return_value=agent), mock.patch("bot.notifications.get_twilio_client") as get_twilio_client:
+                SQLiteJobQueue(path=path, workers=1).join()
+
+        self.assertEqual(agent.get_response.call_count, 0)
+        self.assertEqual([kwargs["body"] for _, kwargs in get_twilio_client.return_value.messages.create.call_args_list], ["Reply sent False."])
+        self.assertEqual(self.store.reply(self.payload["MessageSid"]), "Reply sent False.")
+
+
+# agent executor replaying the events of a turn in which the agent booked an appointment
+class FakeAgentExecutor:
+    async def astream_events(self, input, version):
+        for event in ({"event": "on_chat_model_stream", "name": "ChatGroq", "data": {"chunk": AIMessage(content="Booking")}},
+                      {"event": "on_chat_model_stream", "name": "ChatGroq", "data": {"chunk": AIMessage(content="")}},
+                      {"event": "on_tool_start", "name": "insert_data", "data": {}},
+                      {"event": "on_tool_end", "name": "insert_data", "data": {}},
+                      {"event": "on_chain_end", "name": "AgentExecutor", "data": {"output": {"output": "Your appointment request have been posted."}}}):
+            yield event
+
+
+class StreamResponseTests(SimpleTestCase):
+    def setUp(self):
+        self.agent = AsyncDatabaseAgent.__new__(AsyncDatabaseAgent)    # without the groq client
+        self.agent._chat_history_handler = ChatHistoryHandler(backend=InMemoryBackend())
+        self.agent._history_policy = HistoryPolicy(chat_history_handler=self.agent._chat_history_handler, mode="all",
+                                                   max_messages=20, max_tokens=2000, summary_chain=None)
+        self.agent._router = IntentRouter(enabled=False)
+        self.agent._agent_executor = FakeAgentExecutor()
+
+    async def collect(self, query):
+        return [event async for event in self.agent.stream_response(chat_session_id="web-test", query=query)]
+
+    def test_tokens_and_tool_progress_are_streamed_before_the_response(self):
+        with self.assertLogs("bot.agent", "INFO"):
+            events = asyncio.run(self.collect("Book me for tomorrow at 10"))
+        self.assertEqual(events, [{"event": "token", "text": "Booking"},
+                                  {"event": "tool_start", "tool": "insert_data"},
+                                  {"event": "tool_end", "tool": "insert_data"},
+                                  {"event": "done", "text": "Your appointment request have been posted."}])
+        self.assertEqual([message.content for message in self.agent._chat_history_handler.get_chat_history("web-test")],
+                         ["Book me for tomorrow at 10", "Your appointment request have been posted."])
+
+
+# agent executor answering every message with an echo of it
+class EchoAgentExecutor:
+    def invoke(self, input):
+        return {"output": f"echo: {input['input']}"}
+
+
+@override_settings(SESSION_ENGINE="django.contrib.sessions.backends.signed_cookies")
+class WebChatSessionTests(SimpleTestCase):
+    browsers = 20
+    messages = 5
+
+    def setUp(self):
+        agent = DatabaseAgent.__new__(DatabaseAgent)    # without the groq client
+        agent._chat_history_handler = ChatHistoryHandler(backend=InMemoryBackend())
+        agent._history_policy = HistoryPolicy(chat_history_handler=agent._chat_history_handler, mode="all",
+                                              max_messages=20, max_tokens=2000, summary_chain=None)
+        agent._router = IntentRouter(enabled=False)
+        agent._agent_executor = EchoAgentExecutor()
+        self.agent = agent
+        patcher = mock.patch("bot.views.get_database_agent", return_value=agent)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    # function for chatting from one browser, returns its chat session id
+    def chat(self, browser):
+        client = Client()
+        client.get("/chat/")
+        for number in range(self.messages):
+            response = client.get("/get-response/", {"userMessage": f"browser {browser} message {number}"})
+            self.assertEqual(response.content.decode(), f"echo: browser {browser} message {number}")
+        return client.session["chat_session_id"]
+
+    def test_concurrent_browsers_keep_separate_histories(self):
+        with self.assertLogs("bot.agent", "INFO"), ThreadPoolExecutor(max_workers=self.browsers) as executor:
+            session_ids = list(executor.map(self.chat, range(self.browsers)))
+
+        self.assertEqual(len(set(session_ids)), self.browsers)
+        for browser, session_id in enumerate(session_ids):
+            history = self.agent._chat_history_handler.get_chat_history(session_id)
+            self.assertEqual([message.content for message in history[::2]],
+                             [f"browser {browser} message {number}" for number in range(self.messages)])
+            self.assertEqual(len(history), 2 * self.messages)
@@ -1,43 +1,89 @@
 # for config and env variables
-import yaml
+import threading
 from dotenv import load_dotenv
+from .config import get_config
+from .queries import get_queries
 
 # for database
-import mysql.connector
+from contextlib import contextmanager, nullcontext
 from datetime import timedelta, datetime
+from .dbpool import get_pool
 
 # for custom tool define
 import re
+from functools import lru_cache
 from typing import Optional, ClassVar, Union
 from pydantic import BaseModel, Field, field_validator
 from langchain.tools import tool
 
 # for error analyzer and response rephraser llm
 from langchain_groq import ChatGroq
-from .prompt import error_prompt, result_rephraser_prompt
+from .prompt import error_prompt, result_rephraser_prompt, summary_prompt
 from langchain_core.output_parsers import StrOutputParser
+from .error_messages import render_error_message, field_from_exception, is_error_message, InvalidField, stats as error_stats
+from .result_renderer import render_appointment_details, render_updated_fields
+from .availability import AvailabilityEngine, to_minutes, from_minutes
+from .cache import TTLCache
+from .instrumentation import instrumented
+from .metrics import TimedCursor
 
 
-# loading the config file and environment variables
+# loading the environment variables
 load_dotenv()
-with open("config.yaml", "r") as f:
-    config = yaml.safe_load(f)
 
 
 # building chains
 class Chains:
-    llm = ChatGroq(model=config["error-model-name"])
-    error_generator_chain = error_prompt | llm | StrOutputParser()    # creating error generator chain
-    result_rephraser_chain = result_rephraser_prompt | llm | StrOutputParser()    # result rephraser chain
+    def __init__(self):
+        self.llm = ChatGroq(model=get_config().error_model_name)
+        self.error_generator_chain = instrumented(error_prompt | self.llm | StrOutputParser(), "error_generator")    # creating error generator chain
+        self.result_rephraser_chain = instrumented(result_rephraser_prompt | self.llm | StrOutputParser(), "result_rephraser")    # result rephraser chain
+        self.history_summary_chain = instrumented(summary_prompt | self.llm | StrOutputParser(), "history_summary")    # chat history summarizer chain
 
 
-# establishing connection to the mysql server
+_chains = None
+_chains_lock = threading.Lock()
+
+
+# function for getting the process wide chains, the groq client is created on first use instead of at import
+def get_chains():
+    global _chains
+    if _chains is None:
+        with _chains_lock:
+            if _chains is None:
+                _chains = Chains()
+    return _chains
+
+
+# function for generating the feedback message of an invalid data field, the llm only rephrases it when enabled in the config
+def generate_error_message(field, detail="", llm_input=None):
+    message = render_error_message(field=field, detail=detail)
+    if get_config().error_messages.mode == "llm":
+        error_stats.count_rephrased()
+        return get_chains().error_generator_chain.invoke(input={"input": llm_input or message})
+    error_stats.count_templated()
+    return message
+
+
+# function for generating the feedback message of an exception raised inside a tool
+def generate_exception_message(exception):
+    return generate_error_message(field=field_from_exception(exception), llm_input=f"{exception}")
+
+
+# function for answering with the feedback message of the first invalid data field, None when every value is valid
+def invalid_field_message(*values):
+    for value in values:
+        if is_error_message(value):
+            return generate_error_message(field=value.field, detail=value.detail)
+    return None
+
+
+# checking out a pooled connection to the mysql server, use it as `with get_connection() as (conn, cursor):`,
+# the latency of every statement run on the cursor is recorded
+@contextmanager
 def get_connection():
-    conn = mysql.connector.connect(host=config["database"]["host"],
-                                   user=config["database"]["user"],
-                                   password=config["database"]["password"],
-                                   database=config["database"]["database"])
-    return conn, conn.cursor()
+    with get_pool().connection() as (conn, cursor):
+        yield conn, TimedCursor(cursor)
 
 
 # class of validators functions
@@ -47,55 +93,54 @@ class BaseSchema(BaseModel):
     @classmethod
     def validate_user_id(cls, value):
         if isinstance(value, str):
-            if len(value) == 23:
-                first, ph, d, t, s = value.split("_")
-                if first == 'SC' and len(ph) == 11 and len(d+t+s) == 6:
-                    return value
-        return "Invalid user id."
+            # SC_<phone>_<YYYYMMDD>_<HH>_<MM>, the ids given before the full date was added only carry the day, SC_<phone>_<DD>_<HH>_<MM>
+            if re.fullmatch(r"SC_\d{11}_(\d{8}|\d{2})_\d{2}_\d{2}", value):
+                return value
+        return InvalidField(field="user_id")
 
     @classmethod
     def validate_phone_number(cls, value:str):
         has_error = False
-        error_message = 'Invalid phone number. '
+        error_detail = ''
         # Check if the phone number has exactly 11 digits
         if not re.fullmatch(r'\d{11}', value):
-            error_message = error_message + 'It must have exactly 11 digits.'
+            error_detail = error_detail + 'It must have exactly 11 digits.'
             has_error = True
 
         # Check if the phone number starts with a valid prefix
         if not any(value.startswith(prefix) for prefix in cls.valid_prefixes):
-            error_message = error_message + f' It must start with one of the following prefixes: {cls.valid_prefixes}.'
+            error_detail = error_detail + f' It must start with one of the following prefixes: {", ".join(cls.valid_prefixes)}.'
             has_error = True
-        return Chains.error_generator_chain.invoke(input={"input": error_message}) if has_error else value
+        return InvalidField(field="phone_number", detail=error_detail) if has_error else value
     
     @classmethod
     def validate_appointment_date(cls, value:str):
         try:
             datetime.strptime(value, '%Y-%m-%d')
         except Exception as e:
-            return 'Invalid date. It must be in the format YYYY-MM-DD'
+            return InvalidField(field="appointment_date")
         return value
 
     @classmethod
     def validate_appointment_time(cls, value:str):
         try:
             formatted_time = datetime.strptime(value, "%H:%M:%S")
-            formatted_time = formatted_time.strftime("%I:%M:%S")  # 12-hour format with AM/PM
+            formatted_time = formatted_time.strftime("%H:%M:%S")  # 24-hour format, as stored and compared with the opening hours
             return formatted_time
         except:
             try:
                 formatted_time = datetime.strptime(value, "%H:%M")
-                formatted_time = formatted_time.strftime("%I:%M:%S")  # 12-hour format with AM/PM
+                formatted_time = formatted_time.strftime("%H:%M:%S")  # 24-hour format, as stored and compared with the opening hours
                 return formatted_time
             except:
-                return 'Invalid time. It must be in H:M:S and 12 hour format.'
+                return InvalidField(field="appointment_time")
     
     @classmethod
     def validate_age(cls, value):
         if isinstance(value, int):
             if value >= 20 and value <= 100:
                 return value
-        return "Invalid age. It should be between 20-100."
+        return InvalidField(field="age")
 
 
 # schema for insert_data tool
@@ -171,11 +216,115 @@ class DatabaseDeleteSchema(BaseSchema):
         return cls.validate_user_id(value)
 
 
+# schema for check_availability tool
+class DatabaseAvailabilitySchema(BaseSchema):
+    appointment_date: str = Field(description="It should be a date with the format YY-MM-DD")
+    appointment_time: Optional[str] = Field(description="It will be a time with the format H:M:S", default=None)
+    count: Optional[int] = Field(description="Number of free slots to suggest", default=5)
+
+    @field_validator('appointment_date')
+    def appointment_date_validate(cls, value:str):
+        return cls.validate_appointment_date(value)
+
+    @field_validator('appointment_time')
+    def appointment_time_validate(cls, value:str):
+        return cls.validate_appointment_time(value) if value else value
+
+
+# function for loading the active appointments of a date for the availability engine
+def load_day_appointments(day):
+    with get_connection() as (conn, cursor):
+        cursor.execute(get_queries().day_appointments, (day,))
+        return cursor.fetchall()
+
+
+# availability engine answering slot questions from an in memory interval index per day
+availability_config = get_config().availability
+availability = AvailabilityEngine(load_day=load_day_appointments,
+                                  opening_time=availability_config.opening_time,
+                                  closing_time=availability_config.closing_time,
+                                  slot_minutes=availability_config.slot_minutes,
+                                  cache_days=availability_config.cache_days,
+                                  cache_ttl=availability_config.cache_ttl)
+
+
+# seconds a booking waits for the bookings of the same day before it gives up
+BOOKING_LOCK_TIMEOUT = 10
+
+
+# context manager holding the booking lock of a day, the bookings of a day are checked and written one after another so
+# two overlapping slots can not both pass the check, the row locks alone let two bookings of an empty day deadlock
+@contextmanager
+def day_locked(cursor, day):
+    queries = get_queries()
+    name = f"{queries.table}:{day}"
+    cursor.execute(queries.lock_day, (name, BOOKING_LOCK_TIMEOUT))
+    if cursor.fetchone()[0] != 1:
+        raise TimeoutError(f"The bookings of {day} are busy, please try again.")
+    try:
+        yield
+    finally:
+        cursor.execute(queries.unlock_day, (name,))
+        cursor.fetchone()
+
+
+# function for checking a slot against the committed appointments of a day inside the booking transaction
+def is_slot_taken(cursor, day, start, exclude_user_id):
+    cursor.execute(get_queries().lock_day_appointments, (day,))
+    start = to_minutes(start)
+    return bool(availability.index(cursor.fetchall()).overlapping(start, start + availability.slot_minutes, exclude_user_id))
+
+
+# function for formatting the suggested free slots of a date
+def format_free_slots(appointment_date, slots):
+    if not slots:
+        return f"There is no free slot left on {appointment_date}."
+    return f"Free slots on {appointment_date}: " + ", ".join(slot.strftime("%I:%M %p") for slot in slots) + "."
+
+
+# function for answering a slot outside the opening hours with the first free slots of the day
+def format_outside_opening_hours(appointment_date, appointment_time):
+    return (f"{from_minutes(to_minutes(appointment_time)).strftime('%I:%M %p')} is outside our opening hours, appointments are taken "
+            f"from {from_minutes(availability.opening).strftime('%I:%M %p')} to {from_minutes(availability.closing).strftime('%I:%M %p')}. "
+            f"{format_free_slots(appointment_date, availability.next_free_slots(appointment_date))}")
+
+
+# formatted search results by user id, repeated status questions are answered without mysql and the rephraser llm,
+# every write to an appointment drops its entry
+search_cache_config = get_config().search_cache
+search_cache = TTLCache(maxsize=search_cache_config.max_entries, ttl=search_cache_config.ttl)
+
+
+# function for dropping the cached search result of a user id after its appointment changed
+def invalidate_search_result(user_id):
+    search_cache.delete(user_id)
+
+
+# function for rephrasing the appointment details with the llm, identical records are only rephrased once
+@lru_cache(maxsize=get_config().result_renderer.cache_size)
+def rephrase_search_result(response):
+    return get_chains().result_rephraser_chain.invoke(input={"input": response})
+
+
 # function for formatting search result
 def format_search_result(result):
     if result is None:
         return None
     _, user_id, phone_number, person_name, age, appointment_date, appointment_time, appointment_end_time, status = result
+
+    renderer_config = get_config().result_renderer
+    if renderer_config.mode != "llm":
+        return render_appointment_details(record={"user_id": user_id,
+                                                  "phone_number": phone_number,
+                                                  "person_name": person_name,
+                                                  "age": age,
+                                                  "appointment_date": appointment_date,
+                                                  "appointment_time": appointment_time,
+                                                  "appointment_end_time": appointment_end_time,
+                                                  "status": status},
+                                          style=renderer_config.style,
+                                          language=renderer_config.language)
+
     formatted_date = appointment_date.strftime("%d-%m-%Y")
     formatted_appointment_time = str(timedelta(seconds=appointment_time.seconds))[:-3]
     formatted_appointment_end_time = str(timedelta(seconds=appointment_end_time.seconds))[:-3]
@@ -187,7 +336,7 @@ def format_search_result(result):
                 f"Appointment time     : {formatted_appointment_time}\n"
                 f"Appointment end time : {formatted_appointment_end_time}\n"
                 f"Status               : {status}")
-    return Chains.result_rephraser_chain.invoke(input={"input": response})
+    return rephrase_search_result(response)
 
 
 # defining custom insert_data tool
@@ -195,71 +344,73 @@ def format_search_result(result):
 def insert_data(phone_number: str, person_name: str, appointment_date: str, appointment_time: str, age: int = None, status : str = "Pending"):
     """This function inserts data into database table. Use this function only when you need to insert some data into the database."""
 
+    # returning the feedback message of the first invalid data field
+    error_message = invalid_field_message(phone_number, appointment_date, appointment_time, age)
+    if error_message is not None:
+        return error_message
+
     # calculating appointment end time
     try:
         appointment_time_obj = datetime.strptime(appointment_time, "%H:%M:%S")
         appointment_end_time_obj = appointment_time_obj + timedelta(minutes=5)
         appointment_end_time = appointment_end_time_obj.strftime("%H:%M:%S")
     except Exception as e:
-        return Chains.error_generator_chain.invoke(input={"input": f"{e}"})
+        return generate_exception_message(e)
 
     user_id = get_user_id(phone_number=phone_number, sc_date=appointment_date, sc_time=appointment_time)
     
     try:
-        conn, cursor = get_connection()
-        # SQL query to search and insert data into the table
-        insert_query = f'''
-        INSERT INTO {config["database"]["table"]} (user_id, phone_number, person_name, age, appointment_date, appointment_time, appointment_end_time, status)
-        VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-        '''
-        search_query = f'''
-        SELECT * FROM {config["database"]["table"]} WHERE user_id = %s
-        AND person_name = %s
-        AND phone_number = %s
-        AND age = %s
-        AND appointment_date = %s
-        AND appointment_time = %s
-        AND appointment_end_time = %s
-        '''
-        # check if the data already exists in the database or not
-        cursor.execute(search_query, (user_id, person_name, phone_number, age, appointment_date, appointment_time, appointment_end_time))
-        search_result = cursor.fetchone()
-
-        if search_result is None:
-            cursor.execute(insert_query, (user_id, phone_number, person_name, age, appointment_date, appointment_time, appointment_end_time, status))
-            conn.commit()
-            message = f"Your appointment request have been posted. Your ID number is {user_id}."
-        else:
-            # escaping creating new appointment
-            message = f"Your have already booked an appointment. Your ID number is {search_result[1]}."
-
-        if conn.is_connected():
-            cursor.close()
-            conn.close()
-        return message
+        if not availability.is_open(appointment_time):
+            return format_outside_opening_hours(appointment_date, appointment_time)
+
+        with get_connection() as (conn, cursor), day_locked(cursor, appointment_date):
+            # refusing a slot that overlaps another appointment, the booking of the same user id is left to the duplicate check
+            taken = is_slot_taken(cursor, appointment_date, appointment_time, exclude_user_id=user_id)
+            if taken:
+                conn.rollback()
+            else:
+                # the unique user id and booking constraints make the duplicate check atomic under concurrent webhook retries
+                cursor.execute(get_queries().insert, (user_id, phone_number, person_name, age, appointment_date, appointment_time, appointment_end_time, status))
+                conn.commit()
+                inserted = cursor.rowcount in (1, 2)    # 1 for a new row, 2 for a revived rejected one, 0 when the booking already exists
+
+        if taken:
+            availability.invalidate(appointment_date)
+            slots = availability.next_free_slots(appointment_date, after=appointment_time)
+            return f"The slot at {appointment_time[:5]} on {appointment_date} is already booked. {format_free_slots(appointment_date, slots)}"
+        if inserted:
+            availability.invalidate(appointment_date)
+            invalidate_search_result(user_id)
+            return f"Your appointment request have been posted. Your ID number is {user_id}."
+        # escaping creating new appointment
+        return f"Your have already booked an appointment. Your ID number is {user_id}."
     except Exception as e:
-        return Chains.error_generator_chain.invoke(input={"input": f"{e}"})
+        return generate_exception_message(e)
 
 
 # defining custom search_data tool
 @tool("search_data", args_schema=DatabaseSearchSchema, return_direct=True)
 def search_data(user_id: str):
     """This function takes a phone number and searches record in database. Use this function only when you need to search some data into the database."""
-    conn, cursor = get_connection()
-    result = None
+    error_message = invalid_field_message(user_id)
+    if error_message is not None:
+        return error_message
+
+    result = search_cache.get(user_id)
+    if result is not None:
+        return result
     try:
-        search_query = f"SELECT * FROM {config["database"]["table"]} WHERE user_id = %s"   # sql query for searching data
-        cursor.execute(search_query, (user_id,))
-        result = format_search_result(cursor.fetchone())
-        if conn.is_connected():
-            cursor.close()
-            conn.close()
-        
-        if user_id.__contains__("Invalid"):
-            return user_id    # it would be an error message
-        return result if result is not None else f"No appointment booked with user id {user_id}."
+        with get_connection() as (conn, cursor):
+            cursor.execute(get_queries().search, (user_id,))
+            record = cursor.fetchone()
+        result = format_search_result(record)
+
+        if result is None:
+            return f"No appointment booked with user id {user_id}."
+        search_cache.set(user_id, result)
+        return result
     except Exception as e:
-        return Chains.error_generator_chain.invoke(input={"input": f"{e}"})
+        return generate_exception_message(e)
 
 
 # defining custom update_data tool
@@ -271,116 +422,189 @@ def update_data(user_id,
                 appointment_date: str = None,
                 appointment_time: str = None):
     """This function takes several data in order to update the database. Use this tool when you need to update some information in database table."""
+
+    # returning the feedback message of the first invalid data field
+    error_message = invalid_field_message(user_id, phone_number, appointment_date, appointment_time, age)
+    if error_message is not None:
+        return error_message
+
     try:
-        # establishing connection to the database
-        conn, cursor = get_connection()
+        update_fields = []
+        update_values = []
+        changes = {"user_id": user_id}    # changed fields, rendered when the updated record is not read back
+
+        if phone_number:
+            update_fields.append("phone_number")
+            update_values.append(phone_number)
+            changes["phone_number"] = phone_number
         
-        # Check if the phone number exists
-        search_query = f"SELECT * FROM {config["database"]["table"]} WHERE user_id = %s"    # sql query for searching data
-        cursor.execute(search_query, (user_id,))
-        result = cursor.fetchone()
+        if person_name:
+            update_fields.append("person_name")
+            update_values.append(person_name)
+            changes["person_name"] = person_name
         
-        if result:  # when there is a data exist to update
-            update_fields = []
-            update_values = []
-
-            if phone_number:
-                update_fields.append("phone_number = %s")
-                update_values.append(phone_number)
-            
-            if person_name:
-                update_fields.append("person_name = %s")
-                update_values.append(person_name)
-            
-            if age is not None:
-                update_fields.append("age = %s")
-                update_values.append(age)
-            
-            if appointment_date:
-                # Check if the date is in 'day-month-year' format and convert it if needed
-                try:
-                    # Try to convert from 'DD-MM-YYYY' format to 'YYYY-MM-DD' format
-                    appointment_date_obj = datetime.strptime(appointment_date, "%d-%m-%Y")
-                    formatted_appointment_date = appointment_date_obj.strftime("%Y-%m-%d")
-                except ValueError:
-                    # If it's already in 'YYYY-MM-DD', use it directly
-                    formatted_appointment_date = appointment_date
-
-                update_fields.append("appointment_date = %s")
-                update_values.append(formatted_appointment_date)
+        if age is not None:
+            update_fields.append("age")
+            update_values.append(age)
+            changes["age"] = age
+        
+        if appointment_date:
+            # Check if the date is in 'day-month-year' format and convert it if needed
+            try:
+                # Try to convert from 'DD-MM-YYYY' format to 'YYYY-MM-DD' format
+                appointment_date_obj = datetime.strptime(appointment_date, "%d-%m-%Y")
+                formatted_appointment_date = appointment_date_obj.strftime("%Y-%m-%d")
+            except ValueError:
+                # If it's already in 'YYYY-MM-DD', use it directly
+                formatted_appointment_date = appointment_date
+
+            update_fields.append("appointment_date")
+            update_values.append(formatted_appointment_date)
+            changes["appointment_date"] = datetime.strptime(formatted_appointment_date, "%Y-%m-%d").date()
+        
+        if appointment_time:
+            # Handle both 'HH:MM' and 'HH:MM:SS' formats by slicing to 'HH:MM'
+            try:
+                appointment_time_obj = datetime.strptime(appointment_time[:5], "%H:%M")
+            except Exception as e:
+                return generate_exception_message(e)
+
+            # Appointment end time is 5 minutes later
+            appointment_end_time_obj = appointment_time_obj + timedelta(minutes=5)
+            formatted_appointment_time = appointment_time_obj.strftime("%H:%M:%S")
+            formatted_appointment_end_time = appointment_end_time_obj.strftime("%H:%M:%S")
             
-            if appointment_time:
-                # Handle both 'HH:MM' and 'HH:MM:SS' formats by slicing to 'HH:MM'
-                try:
-                    appointment_time_obj = datetime.strptime(appointment_time[:5], "%H:%M")
-                except Exception as e:
-                    return Chains.error_generator_chain.invoke(input={"input": f"{e}"})
-
-                # Appointment end time is 5 minutes later
-                appointment_end_time_obj = appointment_time_obj + timedelta(minutes=5)
-                formatted_appointment_time = appointment_time_obj.strftime("%H:%M:%S")
-                formatted_appointment_end_time = appointment_end_time_obj.strftime("%H:%M:%S")
-                
-                update_fields.append("appointment_time = %s")
-                update_values.append(formatted_appointment_time)
-                
-                update_fields.append("appointment_end_time = %s")
-                update_values.append(formatted_appointment_end_time)
+            update_fields.append("appointment_time")
+            update_values.append(formatted_appointment_time)
             
-            # Only update if there are fields to update
-            if update_fields:
-                update_query = f"UPDATE {config["database"]["table"]} SET {', '.join(update_fields)} WHERE user_id = %s"
-                update_values.append(user_id)  # Add the phone_number to the end for the WHERE clause
-                cursor.execute(update_query, tuple(update_values))
-                conn.commit()
-
-                # fetch the updated result
-                cursor.execute(search_query, (user_id,))
+            update_fields.append("appointment_end_time")
+            update_values.append(formatted_appointment_end_time)
+            changes["appointment_time"] = appointment_time_obj.time()
+            changes["appointment_end_time"] = appointment_end_time_obj.time()
+
+        renderer_config = get_config().result_renderer
+        # the updated record is only read back when the whole record is shown
+        read_back = renderer_config.mode == "llm" or renderer_config.updated_details == "full"
+        queries = get_queries()
+
+        moving = bool(appointment_date or appointment_time)
+        result = None
+        updated_result = None
+        taken = False
+        with get_connection() as (conn, cursor):
+            # a move is checked against the other appointments of the day, which needs the current slot of the appointment
+            if moving:
+                cursor.execute(queries.search, (user_id,))
+                result = cursor.fetchone()
+                if result:
+                    new_date = formatted_appointment_date if appointment_date else result[5]
+                    new_time = formatted_appointment_time if appointment_time else result[6]
+                    if not availability.is_open(new_time):
+                        return format_outside_opening_hours(new_date, new_time)
+
+            found = result is not None
+            # the new slot is checked and the appointment moved while the bookings of its day are locked
+            with day_locked(cursor, new_date) if found else nullcontext():
+                taken = found and is_slot_taken(cursor, new_date, new_time, exclude_user_id=user_id)
+                if taken:
+                    conn.rollback()
+                elif update_fields and (found or not moving):
+                    # a single statement, the affected row count tells if the user id exists
+                    update_values.append(user_id)  # Add the user id to the end for the WHERE clause
+                    cursor.execute(queries.update(update_fields), tuple(update_values))
+                    conn.commit()
+                    found = found or cursor.rowcount > 0
+
+            # 0 affected rows is also reported when the values did not change, only then the existence is checked
+            if not found and not moving:
+                cursor.execute(queries.exists, (user_id,))
+                found = cursor.fetchone() is not None
+
+            if found and update_fields and read_back and not taken:
+                cursor.execute(queries.search, (user_id,))
                 updated_result = cursor.fetchone()
 
-                if conn.is_connected():
-                    cursor.close()
-                    conn.close()
-                
+        if taken:
+            availability.invalidate(new_date)
+            slots = availability.next_free_slots(new_date, after=new_time)
+            return f"The requested slot is already booked. {format_free_slots(new_date, slots)}"
+        if result is not None:
+            availability.invalidate(result[5])
+            if appointment_date:
+                availability.invalidate(changes["appointment_date"])
+        if found and update_fields:
+            invalidate_search_result(user_id)
+
+        if found:  # when there is a data exist to update
+            if not update_fields:
+                return "No new information provided to update."
+            if updated_result:
                 return ("Your appointment details have been updated.\n"
                         f"{format_search_result(updated_result)}")
-            else:
-                return "No new information provided to update."
-        else:
-            if user_id.__contains__("Invalid"):
-                return user_id    # it will be an error message rather than user id
-            return f"No appointment details found for user id {user_id}."
+            return ("Your appointment details have been updated.\n"
+                    f"{render_updated_fields(fields=changes, style=renderer_config.style, language=renderer_config.language)}")
+        return f"No appointment details found for user id {user_id}."
     except Exception as e:
-        return Chains.error_generator_chain.invoke(input={"input": f"{e}"})
+        return generate_exception_message(e)
 
 
 # defining custom delete_data tool
 @tool("delete_data", args_schema=DatabaseDeleteSchema, return_direct=True)
 def delete_data(user_id):
     """This function takes one argument which is the user id and deletes data with the id. Use this tool when you need to delete any data from the database table."""
+    error_message = invalid_field_message(user_id)
+    if error_message is not None:
+        return error_message
+
     try:
-        conn, cursor = get_connection()
-        search_query = f"SELECT * FROM {config["database"]["table"]} WHERE user_id = %s"
-        cursor.execute(search_query, (user_id,))
-        result = cursor.fetchone()   # fetch the search result
-        if result:
-            delete_query = f"DELETE FROM {config["database"]["table"]} WHERE user_id = %s"    # sql query for deleting data from table
-            cursor.execute(delete_query, (user_id,))
+        with get_connection() as (conn, cursor):
+            cursor.execute(get_queries().delete, (user_id,))
             conn.commit()
-
-            if conn.is_connected():
-                cursor.close()
-                conn.close()
+            deleted = cursor.rowcount > 0    # the affected row count tells if the user id existed
+
+        if deleted:
+            # the date of the appointment is taken from its user id instead of being read, every cached day is dropped for
+            # the old ids holding only the day of the month, an appointment moved to another day keeps the date of its id
+            # and the cached index of its new day expires after cache-ttl, bookings themselves are checked against the database
+            availability.invalidate(user_id_date(user_id))
+            invalidate_search_result(user_id)
             return f"Appointment canceled for user id {user_id}."
-        else:
-            if user_id.__contains__("Invalid"):
-                return user_id    # it will be an error message rather than user id
-            return f"No appointment details found with the user id {user_id}."
+        return f"No appointment details found with the user id {user_id}."
     except Exception as e:
-        return Chains.error_generator_chain.invoke(input={"input": f"{e}"})
+        return generate_exception_message(e)
+
+
+# defining custom check_availability tool
+@tool("check_availability", args_schema=DatabaseAvailabilitySchema, return_direct=True)
+def check_availability(appointment_date: str, appointment_time: str = None, count: int = 5):
+    """This function checks whether an appointment slot is free and suggests the next free slots of a date. Use this tool when the user asks for free or available appointment times."""
 
+    # returning the feedback message of the first invalid data field
+    error_message = invalid_field_message(appointment_date, appointment_time)
+    if error_message is not None:
+        return error_message
 
-# function for generating unique user ID
+    try:
+        count = max(1, min(count or 5, 20))
+        if appointment_time and not availability.is_open(appointment_time):
+            return format_outside_opening_hours(appointment_date, appointment_time)
+        if appointment_time and availability.is_free(appointment_date, appointment_time):
+            return f"The slot at {appointment_time[:5]} on {appointment_date} is free."
+        slots = availability.next_free_slots(appointment_date, count=count, after=appointment_time)
+        if appointment_time:
+            return f"The slot at {appointment_time[:5]} on {appointment_date} is not available. {format_free_slots(appointment_date, slots)}"
+        return format_free_slots(appointment_date, slots)
+    except Exception as e:
+        return generate_exception_message(e)
+
+
+# function for generating unique user ID, the full date keeps bookings of the same phone and time in different months apart
 def get_user_id(phone_number, sc_date, sc_time):
-    return f"SC_{phone_number}_{sc_date[8:]}_{sc_time[:2]}_{sc_time[3:5]}"
+    return f"SC_{phone_number}_{sc_date[:4]}{sc_date[5:7]}{sc_date[8:10]}_{sc_time[:2]}_{sc_time[3:5]}"
+
+
+# function for getting the appointment date of a user id, None for the old ids holding only the day of the month
+def user_id_date(user_id):
+    match = re.fullmatch(r"SC_\d{11}_(\d{8})_\d{2}_\d{2}", user_id)
+    return datetime.strptime(match.group(1), "%Y%m%d").date() if match else None
 
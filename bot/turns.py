@@ -0,0 +1,184 @@
+import time
+import asyncio
+import threading
+from collections import deque
+from contextlib import contextmanager, asynccontextmanager
+
+from .config import get_config
+
+
+# queue depth and wait time of the turns passing through a turn gate
+class TurnGateStats:
+    def __init__(self, max_concurrent):
+        self.max_concurrent = max_concurrent
+        self.waiting = 0        # turns waiting for the previous turn of their session or for a slot
+        self.running = 0
+        self.peak_waiting = 0
+        self.completed = 0
+        self.wait_seconds = 0.0
+        self._stats_lock = threading.Lock()
+
+    def _queued(self):
+        with self._stats_lock:
+            self.waiting += 1
+            self.peak_waiting = max(self.peak_waiting, self.waiting)
+        return time.monotonic()
+
+    def _started(self, queued_at):
+        with self._stats_lock:
+            self.waiting -= 1
+            self.running += 1
+            self.wait_seconds += time.monotonic() - queued_at
+
+    def _finished(self):
+        with self._stats_lock:
+            self.running -= 1
+            self.completed += 1
+
+    # function for getting the queue depth and wait time of the turns
+    def stats(self):
+        with self._stats_lock:
+            return {
+                "max_concurrent": self.max_concurrent,
+                "waiting": self.waiting,
+                "running": self.running,
+                "peak_waiting": self.peak_waiting,
+                "completed": self.completed,
+                "average_wait_seconds": self.wait_seconds / (self.completed + self.running) if self.completed + self.running else 0.0,
+            }
+
+
+# gate every agent turn passes through, the turns of one chat session run one after another so each turn reads
+# the history written by the previous one, and at most max_concurrent turns of all sessions run at the same time
+# so a burst of messages waits for a slot instead of running into the groq rate limit
+class TurnGate(TurnGateStats):
+    def __init__(self, max_concurrent=4):
+        super().__init__(max_concurrent)
+        self.__slots = threading.BoundedSemaphore(max_concurrent)
+        self.__sessions = {}    # chat session id -> [lock, turns holding or waiting for it], dropped when no turn uses it
+        self.__lock = threading.Lock()
+
+    @contextmanager
+    def turn(self, chat_session_id):
+        with self.__lock:
+            session = self.__sessions.setdefault(chat_session_id, [threading.Lock(), 0])
+            session[1] += 1
+        queued_at = self._queued()
+        try:
+            # the session lock is taken first, a turn waiting for its predecessor does not hold a slot
+            with session[0], self.__slots:
+                self._started(queued_at)
+                try:
+                    yield
+                finally:
+                    self._finished()
+        finally:
+            with self.__lock:
+                session[1] -= 1
+                if session[1] == 0:
+                    del self.__sessions[chat_session_id]
+
+
+# semaphore of the async turn gate, unlike asyncio.Semaphore it is not bound to one event loop, under wsgi every
+# async view runs through async_to_sync on an event loop of its own and a waiter is woken on the loop it waits on
+class CrossLoopSemaphore:
+    def __init__(self, value=1):
+        self.__value = value
+        self.__waiters = deque()    # (loop, future) of the waiting acquires, handed the released unit in order
+        self.__lock = threading.Lock()
+
+    async def acquire(self):
+        with self.__lock:
+            if self.__value > 0 and not self.__waiters:
+                self.__value -= 1
+                return
+            waiter = (asyncio.get_running_loop(), asyncio.get_running_loop().create_future())
+            self.__waiters.append(waiter)
+        try:
+            await waiter[1]
+        except asyncio.CancelledError:
+            with self.__lock:
+                if waiter in self.__waiters:
+                    self.__waiters.remove(waiter)
+                    raise
+            # the unit was handed to this waiter before it was cancelled, it is passed on to the next one
+            self.release()
+            raise
+
+    def release(self):
+        with self.__lock:
+            while self.__waiters:
+                loop, future = self.__waiters.popleft()
+                try:
+                    loop.call_soon_threadsafe(_wake, future)
+                    return
+                except RuntimeError:
+                    # the loop of the waiter is closed, nobody is waiting on it any more
+                    continue
+            self.__value += 1
+
+    async def __aenter__(self):
+        await self.acquire()
+
+    async def __aexit__(self, *exc_info):
+        self.release()
+
+
+def _wake(future):
+    # a cancelled waiter releases the unit itself
+    if not future.done():
+        future.set_result(None)
+
+
+# turn gate of the async views, waiting turns do not block the event loop and the turns of a session are serialised
+# across event loops as well
+class AsyncTurnGate(TurnGateStats):
+    def __init__(self, max_concurrent=4):
+        super().__init__(max_concurrent)
+        self.__slots = CrossLoopSemaphore(max_concurrent)
+        self.__sessions = {}
+        self.__lock = threading.Lock()
+
+    @asynccontextmanager
+    async def turn(self, chat_session_id):
+        with self.__lock:
+            session = self.__sessions.setdefault(chat_session_id, [CrossLoopSemaphore(1), 0])
+            session[1] += 1
+        queued_at = self._queued()
+        try:
+            async with session[0], self.__slots:
+                self._started(queued_at)
+                try:
+                    yield
+                finally:
+                    self._finished()
+        finally:
+            with self.__lock:
+                session[1] -= 1
+                if session[1] == 0:
+                    del self.__sessions[chat_session_id]
+
+
+_turn_gate = None
+_async_turn_gate = None
+_turn_gates_lock = threading.Lock()
+
+
+# function for getting the process wide turn gate, configured in the turns section of the config
+def get_turn_gate():
+    global _turn_gate
+    if _turn_gate is None:
+        with _turn_gates_lock:
+            if _turn_gate is None:
+                _turn_gate = TurnGate(max_concurrent=get_config().turns.max_concurrent)
+    return _turn_gate
+
+
+# function for getting the process wide turn gate of the asgi views
+def get_async_turn_gate():
+    global _async_turn_gate
+    if _async_turn_gate is None:
+        with _turn_gates_lock:
+            if _async_turn_gate is None:
+                _async_turn_gate = AsyncTurnGate(max_concurrent=get_config().turns.max_concurrent)
+    return _async_turn_gate
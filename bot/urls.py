@@ -1,12 +1,17 @@
 from django.urls import path
 from django.conf.urls import handler404
-from .views import fetch_data, register, login, chat, get_response, signout, delete_customer, edit_customer, add_customer, get_response_for_whatsapp
+from .views import fetch_data, register, login, chat, get_response, signout, delete_customer, edit_customer, add_customer, get_response_for_whatsapp, database_pool_stats, cache_stats, turn_stats, metrics
+from .views import get_response_async, stream_response_async, get_response_for_whatsapp_async, customer_list, availability_slots, bulk_update_status, bulk_status_progress
 
 
 handler404 = 'bot.views.custom_404_view'
 
 urlpatterns = [
     path("", view=fetch_data, name='fetch_data'),
+    path("customers/", view=customer_list, name='customer_list'),
+    path("availability/", view=availability_slots, name='availability_slots'),
+    path("bulk-status/", view=bulk_update_status, name='bulk_update_status'),
+    path("bulk-status/<str:job_id>/", view=bulk_status_progress, name='bulk_status_progress'),
     path("login/", view=login, name='login'),
     path("register/", view=register, name='register'),
     path("chat/", view=chat, name='chat'),
@@ -16,4 +21,11 @@ urlpatterns = [
     path('edit-customer/<str:user_id>/', view=edit_customer, name='edit_customer'),
     path('add-customer/', view=add_customer, name='add_customer'),
     path('whatsapp-chat/', view=get_response_for_whatsapp, name="get_response_for_whatsapp"),
+    path("async/get-response/", view=get_response_async, name='get_response_async'),
+    path("async/stream-response/", view=stream_response_async, name='stream_response_async'),
+    path('async/whatsapp-chat/', view=get_response_for_whatsapp_async, name="get_response_for_whatsapp_async"),
+    path('pool-stats/', view=database_pool_stats, name="database_pool_stats"),
+    path('cache-stats/', view=cache_stats, name="cache_stats"),
+    path('turn-stats/', view=turn_stats, name="turn_stats"),
+    path('metrics/', view=metrics, name="metrics"),
 ]
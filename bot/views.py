@@ -1,63 +1,255 @@
 from django.shortcuts import render, HttpResponse, redirect, get_object_or_404
 from django.views.decorators.csrf import csrf_exempt
 from django.contrib.auth.forms import UserCreationForm
-from django.http import JsonResponse
+from django.http import JsonResponse, StreamingHttpResponse
+from django.db import transaction
 from .models import Customer, Users
-import json, os, yaml
-from twilio.rest import Client
+import json, asyncio, uuid, logging
+from datetime import date, time
+from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
 
 
 # for chatbot agent
-from .tools import get_user_id
-from .agent import DatabaseAgent
-from .status_messages import data_update_message, status_approved_message, status_completed_message, status_rejected_message
+from .tools import get_user_id, availability, generate_exception_message, search_cache, invalidate_search_result
+from .dbpool import get_pool_stats
+from .jobqueue import get_job_queue, register_job, get_checkpoint, save_checkpoint
+from .pagination import keyset_page
+from .config import get_config
+from .notifications import send_whatsapp_message, get_notification_sender, start_progress, update_progress, get_progress
+from .agent import get_database_agent, get_async_database_agent
+from .idempotency import get_idempotency_store
+from .turns import get_turn_gate, get_async_turn_gate
+from .coalesce import MessageCoalescer
+from .status_messages import data_update_message, status_approved_message, status_completed_message, status_rejected_message, STATUS_MESSAGES
 
 
-database_agent = DatabaseAgent()
+logger = logging.getLogger(__name__)
 
-# creating twilio client
-client = Client(os.environ["TWILIO_ACCOUNT_SID"], os.environ["TWILIO_AUTH_TOKEN"])
 
-
-# loading the config file
-with open("config.yaml", "r") as f:
-    config = yaml.safe_load(f)
-
-
-# function to fetch all the data to the dashboard
+# function to render the dashboard, the schedules are loaded page by page from customer_list
 def fetch_data(request):
-    # fetching all the data from the database
     if 'username' in request.session:
-        customers = Customer.objects.all().values('user_id',
-                                                'person_name',
-                                                'phone_number',
-                                                'age',
-                                                'appointment_date',
-                                                'appointment_time',
-                                                'appointment_end_time',
-                                                'status')
         context = {
-            'content': customers,
-            'username': request.session['username']
+            'username': request.session['username'],
+            'status_choices': Customer.STATUS_CHOICES
         }
         return render(request=request, template_name='index.html', context=context)
     else:
         return redirect('login')
 
 
+# sort orders of the dashboard, serial_no is always the last field to make the keyset unique
+CUSTOMER_SORTS = {
+    "appointment": ("appointment_date", "appointment_time", "serial_no"),
+    "status": ("status", "appointment_date", "appointment_time", "serial_no"),
+    "name": ("person_name", "serial_no"),
+    "created": ("serial_no",),
+}
+
+
+# function for fetching one page of the schedules as json, filtered and sorted in the database
+def customer_list(request):
+    if 'username' not in request.session:
+        return JsonResponse({'success': False, 'error': 'Login required.'}, status=401)
+
+    sort = request.GET.get('sort', '-created')
+    descending = sort.startswith('-')
+    fields = CUSTOMER_SORTS.get(sort.lstrip('-'))
+    if fields is None:
+        return JsonResponse({'success': False, 'error': f'Unknown sort {sort}.'}, status=400)
+
+    try:
+        page_size = min(max(int(request.GET.get('page_size', 25)), 1), 100)
+        date_from = date.fromisoformat(request.GET['date_from']) if request.GET.get('date_from') else None
+        date_to = date.fromisoformat(request.GET['date_to']) if request.GET.get('date_to') else None
+    except ValueError:
+        return JsonResponse({'success': False, 'error': 'Invalid page size or date.'}, status=400)
+
+    customers = Customer.objects.values('serial_no',
+                                        'user_id',
+                                        'person_name',
+                                        'phone_number',
+                                        'age',
+                                        'appointment_date',
+                                        'appointment_time',
+                                        'appointment_end_time',
+                                        'status')
+    if request.GET.get('status'):
+        customers = customers.filter(status=request.GET['status'])
+    if date_from:
+        customers = customers.filter(appointment_date__gte=date_from)
+    if date_to:
+        customers = customers.filter(appointment_date__lte=date_to)
+    if request.GET.get('phone'):
+        customers = customers.filter(phone_number__startswith=request.GET['phone'])
+
+    try:
+        rows, next_cursor = keyset_page(customers, fields, page_size, cursor=request.GET.get('cursor'), descending=descending)
+    except ValueError as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=400)
+
+    return JsonResponse({
+        'success': True,
+        'results': rows,
+        'next_cursor': next_cursor,
+    })
+
+
+# responses after which the booking conversation is over and its chat history is deleted
+COMPLETED_ACTION_PHRASES = ("request have been posted.", "successfully booked", "Your appointment details have been updated.", "Appointment canceled for user id")
+
+
+# function for checking if an agent response completed an insertion, update or deletion
+def ends_conversation(agent_response):
+    return any(phrase in agent_response for phrase in COMPLETED_ACTION_PHRASES)
+
+
+# function for getting the chat session id of a browser, kept in the django session so every browser has its own chat history
+def web_chat_session_id(request):
+    if 'chat_session_id' not in request.session:
+        request.session['chat_session_id'] = f"web:{uuid.uuid4().hex}"
+    return request.session['chat_session_id']
+
+
+# async function for getting the chat session id of a browser
+async def aweb_chat_session_id(request):
+    chat_session_id = await request.session.aget('chat_session_id')
+    if chat_session_id is None:
+        chat_session_id = f"web:{uuid.uuid4().hex}"
+        await request.session.aset('chat_session_id', chat_session_id)
+    return chat_session_id
+
+
 # function for chatbot
 def chat(request):
+    web_chat_session_id(request)    # the session cookie is set before the first message is sent
     return render(request=request, template_name="chat.html")
 
 
 # function for bot response
 def get_response(request):
     user_message = request.GET.get('userMessage')
-    agent_response = database_agent.get_response(query=user_message)
+    chat_session_id = web_chat_session_id(request)
+    agent_response = get_database_agent().get_response(chat_session_id=chat_session_id, query=user_message)
+    if ends_conversation(agent_response):
+        get_database_agent().clear_chat_history(chat_session_id=chat_session_id)
     return HttpResponse(agent_response)
 
 
-# function for sending response to whatsapp
+# async function for bot response, used when the app is served over asgi
+async def get_response_async(request):
+    user_message = request.GET.get('userMessage')
+    chat_session_id = await aweb_chat_session_id(request)
+    agent_response = await get_async_database_agent().get_response(chat_session_id=chat_session_id, query=user_message)
+    if ends_conversation(agent_response):
+        await get_async_database_agent().clear_chat_history(chat_session_id=chat_session_id)
+    return HttpResponse(agent_response)
+
+
+# function for formatting an agent event as a server-sent event
+def server_sent_event(event):
+    return f"event: {event['event']}\ndata: {json.dumps(event)}\n\n"
+
+
+# async function streaming the bot response as server-sent events, tokens and tool progress arrive while the agent runs,
+# the events are only sent incrementally when the app is served over asgi
+async def stream_response_async(request):
+    user_message = request.GET.get('userMessage')
+    chat_session_id = await aweb_chat_session_id(request)
+
+    async def events():
+        try:
+            async for event in get_async_database_agent().stream_response(chat_session_id=chat_session_id, query=user_message):
+                yield server_sent_event(event)
+                if event["event"] == "done" and ends_conversation(event["text"]):
+                    await get_async_database_agent().clear_chat_history(chat_session_id=chat_session_id)
+        except Exception as e:
+            logger.exception("Streaming a chat turn failed.")
+            yield server_sent_event({"event": "failed", "text": generate_exception_message(e)})
+
+    response = StreamingHttpResponse(events(), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"    # keeps nginx from buffering the stream
+    return response
+
+
+# function for running the agent on the merged whatsapp messages of a sender and sending the reply, runs on the background job queue
+@register_job("whatsapp_turn")
+def process_whatsapp_turn(sender_number, receiver_number, message_content, message_sids=()):
+    # the reply is saved with the job before it is sent, a job resumed after a restart sends the saved reply without
+    # running the agent again and is not sent twice once it has been marked sent, only a restart between the send and
+    # the checkpoint sends it again
+    checkpoint = get_checkpoint() or {}
+    try:
+        agent_response = checkpoint.get("reply")
+        if agent_response is None:
+            agent_response = get_database_agent().get_response(chat_session_id=sender_number, query=message_content)
+            save_checkpoint({"reply": agent_response, "sent": False})
+
+        if not checkpoint.get("sent"):
+            send_whatsapp_message(kind="reply", from_=receiver_number, to=sender_number, body=agent_response)
+            save_checkpoint({"reply": agent_response, "sent": True})
+    except Exception:
+        release_whatsapp_messages(message_sids)
+        raise
+    complete_whatsapp_messages(message_sids, agent_response)
+
+    # delete chat history when insertion, update or deletion is performed
+    if ends_conversation(agent_response):
+        get_database_agent().clear_chat_history(chat_session_id=sender_number)
+
+
+# function for answering a retried webhook, returns None when the message has not been taken in before
+def whatsapp_duplicate_response(message_sid):
+    if not message_sid:
+        return None
+    record = get_idempotency_store().claim(message_sid)
+    if record is None:
+        return None
+    logger.info("Skipping the retried whatsapp message %s.", message_sid)
+    return HttpResponse(content=record["reply"] or "Responding to whatsapp message.")
+
+
+# function for storing the reply of a turn for every message merged into it
+def complete_whatsapp_messages(message_sids, agent_response):
+    for message_sid in message_sids:
+        get_idempotency_store().complete(message_sid, agent_response)
+
+
+# function for forgetting the messages of a failed turn, so twilio retries of them are processed again
+def release_whatsapp_messages(message_sids):
+    for message_sid in message_sids:
+        get_idempotency_store().release(message_sid)
+
+
+# function for storing a whatsapp message as a held turn of its own, it is in the job queue before the webhook is
+# acknowledged, a restart within the coalescing window answers it on its own instead of losing it
+def hold_whatsapp_message(sender_number, receiver_number, message_content, message_sid):
+    return get_job_queue().hold(key=sender_number,
+                                name="whatsapp_turn",
+                                sender_number=sender_number,
+                                receiver_number=receiver_number,
+                                message_content=message_content,
+                                message_sids=[message_sid] if message_sid else [])
+
+
+# function for releasing the held messages a sender wrote within the coalescing window as one turn
+def enqueue_whatsapp_turn(sender_number, messages, context):
+    # the jobs of one sender are processed in the order they arrived
+    get_job_queue().release([job_id for _, _, job_id in messages],
+                            sender_number=sender_number,
+                            receiver_number=context["receiver_number"],
+                            message_content="\n".join(message for message, _, _ in messages),
+                            message_sids=[message_sid for _, message_sid, _ in messages if message_sid])
+
+
+# messages of a sender arriving within the coalescing window are answered in one agent turn
+whatsapp_coalescer = MessageCoalescer(flush=enqueue_whatsapp_turn,
+                                      window=get_config().coalescing.window,
+                                      max_wait=get_config().coalescing.max_wait)
+
+
+# function for sending response to whatsapp, the twilio webhook is acknowledged before the agent runs
 @csrf_exempt
 def get_response_for_whatsapp(request):
     sender_name = request.POST["ProfileName"]
@@ -67,23 +259,77 @@ def get_response_for_whatsapp(request):
     message_content = request.POST["Body"]
     receiver_number = request.POST["To"]
     sender_number = request.POST["From"]
+    message_sid = request.POST.get("MessageSid")
 
-    agent_response = database_agent.get_response(chat_session_id=sender_number, query=message_content)
-    
-    client.messages.create(from_=receiver_number,
-                           body=agent_response,
-                           to=sender_number)
-    
-    # checking if we do need to clear the chat history or not
-    if agent_response.__contains__("request have been posted.") or agent_response.__contains__("successfully booked"): 
-        # delete chat history when insertion is performed
-        database_agent.clear_chat_history(chat_session_id=sender_number)
-    elif agent_response.__contains__("Your appointment details have been updated."):
-        # delete chat history when update is performed
-        database_agent.clear_chat_history(chat_session_id=sender_number)
-    elif agent_response.__contains__("Appointment canceled for user id"):
-        # delete chat history when deletion is performed
-        database_agent.clear_chat_history(chat_session_id=sender_number)
+    duplicate_response = whatsapp_duplicate_response(message_sid)
+    if duplicate_response is not None:
+        return duplicate_response
+
+    job_id = hold_whatsapp_message(sender_number, receiver_number, message_content, message_sid)
+    whatsapp_coalescer.add(sender_number, (message_content, message_sid, job_id), receiver_number=receiver_number)
+
+    return HttpResponse(content="Responding to whatsapp message.")
+
+
+# latest running whatsapp turn of every sender on the asgi path
+whatsapp_turn_tasks = {}
+
+
+# async function for running the agent on the merged whatsapp messages of a sender and sending the reply, waits for the previous turn of the sender
+async def process_whatsapp_turn_async(previous_turn, sender_number, receiver_number, message_content, message_sids=()):
+    if previous_turn is not None:
+        await asyncio.wait([previous_turn])
+
+    try:
+        agent_response = await get_async_database_agent().get_response(chat_session_id=sender_number, query=message_content)
+
+        await asyncio.to_thread(send_whatsapp_message, kind="reply", from_=receiver_number, to=sender_number, body=agent_response)
+    except Exception:
+        release_whatsapp_messages(message_sids)
+        raise
+    complete_whatsapp_messages(message_sids, agent_response)
+
+    # delete chat history when insertion, update or deletion is performed
+    if ends_conversation(agent_response):
+        await get_async_database_agent().clear_chat_history(chat_session_id=sender_number)
+
+
+# function for starting the turn of the messages a sender wrote within the coalescing window on the event loop
+def start_whatsapp_turn_async(sender_number, messages, context):
+    task = asyncio.create_task(process_whatsapp_turn_async(previous_turn=whatsapp_turn_tasks.get(sender_number),
+                                                           sender_number=sender_number,
+                                                           receiver_number=context["receiver_number"],
+                                                           message_content="\n".join(message for message, _ in messages),
+                                                           message_sids=[message_sid for _, message_sid in messages if message_sid]))
+    whatsapp_turn_tasks[sender_number] = task
+
+    # forgetting the task when it is still the latest turn of the sender
+    def forget_turn(finished_task):
+        if whatsapp_turn_tasks.get(sender_number) is finished_task:
+            del whatsapp_turn_tasks[sender_number]
+    task.add_done_callback(forget_turn)
+
+
+# coalescer of the asgi path, its timers run on the event loop
+whatsapp_coalescer_async = MessageCoalescer(flush=start_whatsapp_turn_async,
+                                            window=get_config().coalescing.window,
+                                            max_wait=get_config().coalescing.max_wait,
+                                            timer=lambda delay, callback: asyncio.get_running_loop().call_later(delay, callback))
+
+
+# async function for sending response to whatsapp, the turn runs on the event loop after the webhook is acknowledged
+@csrf_exempt
+async def get_response_for_whatsapp_async(request):
+    message_content = request.POST["Body"]
+    receiver_number = request.POST["To"]
+    sender_number = request.POST["From"]
+    message_sid = request.POST.get("MessageSid")
+
+    duplicate_response = whatsapp_duplicate_response(message_sid)
+    if duplicate_response is not None:
+        return duplicate_response
+
+    whatsapp_coalescer_async.add(sender_number, (message_content, message_sid), receiver_number=receiver_number)
 
     return HttpResponse(content="Responding to whatsapp message.")
 
@@ -154,13 +400,11 @@ def send_feedback_message(previous_status:str, customer:Customer):
         message = status_rejected_message(customer)
     
     try:
-        client.messages.create(from_=config['whatsapp-bot-number'],
-                            body=message,
-                            to=f"whatsapp:+88{customer.phone_number}")
+        send_whatsapp_message(kind="feedback", from_=get_config().whatsapp_bot_number, to=f"whatsapp:+88{customer.phone_number}", body=message)
         
         # store the recent feedback message into the chat history of that specific user
-        database_agent.add_feedback_message_to_chat_history(chat_session_id=f"whatsapp:+88{customer.phone_number}",
-                                                            feedback_message=message)
+        get_database_agent().add_feedback_message_to_chat_history(chat_session_id=f"whatsapp:+88{customer.phone_number}",
+                                                                  feedback_message=message)
         return True
     except:
         return False
@@ -174,6 +418,7 @@ def edit_customer(request, user_id:str):
             data = json.loads(request.body)
             
             previous_status = customer.status   # storing the previous status
+            previous_date = customer.appointment_date
             
             # Update the customer with new data
             customer.person_name = data.get('person_name')
@@ -184,13 +429,16 @@ def edit_customer(request, user_id:str):
             customer.appointment_end_time = data.get('appointment_end_time')
             customer.status = data.get('status')
             customer.save()
+            availability.invalidate(previous_date)
+            availability.invalidate(customer.appointment_date)
+            invalidate_search_result(user_id)
 
             # trying to send feedback message and getting operation status to check if it is done successfully or not
             operation_status = send_feedback_message(previous_status, customer)
 
             # delete the chat history when update is done
             if operation_status:
-                database_agent.clear_chat_history(chat_session_id=f"whatsapp:+88{customer.phone_number}")
+                get_database_agent().clear_chat_history(chat_session_id=f"whatsapp:+88{customer.phone_number}")
 
             return JsonResponse({'success': operation_status})
         return JsonResponse({'success': False})
@@ -204,8 +452,10 @@ def delete_customer(request, user_id:str):
         if request.method == 'POST':
             customer = get_object_or_404(Customer, user_id=user_id)
             # delete the chat history of the user who's appointment is canceled
-            database_agent.clear_chat_history(chat_session_id=f"whatsapp:+88{customer.phone_number}")
+            get_database_agent().clear_chat_history(chat_session_id=f"whatsapp:+88{customer.phone_number}")
             customer.delete()
+            availability.invalidate(customer.appointment_date)
+            invalidate_search_result(user_id)
             return JsonResponse({'success': True})
         return JsonResponse({'success': False})
     else:
@@ -237,6 +487,8 @@ def add_customer(request):
             appointment_end_time=appointment_end_time,
             status=status
         )
+        availability.invalidate(appointment_date)
+        invalidate_search_result(customer.user_id)
 
         # Return success response with customer data
         return JsonResponse({
@@ -256,6 +508,150 @@ def add_customer(request):
     return JsonResponse({'success': False})
 
 
+# largest number of appointments changed by one bulk status request
+BULK_STATUS_LIMIT = 1000
+
+
+# function for sending the notifications of a bulk status change, runs on a worker of its own so the whatsapp turns
+# are not held up behind it
+@register_job("bulk_status_notifications", queue="notifications")
+def send_bulk_status_notifications(job_id, notifications):
+    # the users already notified are saved with the job, a job resumed after a restart skips them
+    notified = set(get_checkpoint() or [])
+    if get_progress(job_id) is None:    # resumed after a restart by the sqlite job queue
+        start_progress(job_id, len(notifications))
+        update_progress(job_id, sent=len(notified))
+    update_progress(job_id, state="running")
+
+    sender = get_notification_sender()
+    for notification in notifications:
+        if notification["user_id"] in notified:
+            continue
+        try:
+            sender.send_with_retry(to=notification["to"], body=notification["body"])
+        except Exception as e:
+            update_progress(job_id, failed=1, error={"user_id": notification["user_id"], "error": str(e)})
+            continue
+        notified.add(notification["user_id"])
+        save_checkpoint(sorted(notified))
+        update_progress(job_id, sent=1)
+        # store the feedback message into the chat history of that specific user
+        get_database_agent().add_feedback_message_to_chat_history(chat_session_id=notification["to"], feedback_message=notification["body"])
+    update_progress(job_id, state="done")
+
+
+# function for changing the status of many appointments at once, the notifications are sent in the background
+def bulk_update_status(request):
+    if 'username' not in request.session:
+        return JsonResponse({'success': False, 'error': 'Login required.'}, status=401)
+    if request.method != 'POST':
+        return JsonResponse({'success': False, 'error': 'POST required.'}, status=405)
+
+    try:
+        data = json.loads(request.body)
+        user_ids = list(dict.fromkeys(str(user_id) for user_id in data['user_ids']))
+        status = data['status']
+    except (ValueError, KeyError, TypeError):
+        return JsonResponse({'success': False, 'error': 'Expected user_ids and status.'}, status=400)
+    if status not in dict(Customer.STATUS_CHOICES):
+        return JsonResponse({'success': False, 'error': f'Unknown status {status}.'}, status=400)
+    if not user_ids or len(user_ids) > BULK_STATUS_LIMIT:
+        return JsonResponse({'success': False, 'error': f'Select between 1 and {BULK_STATUS_LIMIT} appointments.'}, status=400)
+
+    # the changed rows are locked while they are read for the notifications and updated with a single query
+    with transaction.atomic():
+        customers = list(Customer.objects.select_for_update().filter(user_id__in=user_ids).exclude(status=status))
+        Customer.objects.filter(serial_no__in=[customer.serial_no for customer in customers]).update(status=status)
+
+    notifications = []
+    for customer in customers:
+        customer.status = status
+        availability.invalidate(customer.appointment_date)
+        invalidate_search_result(customer.user_id)
+        if status in STATUS_MESSAGES:
+            notifications.append({'user_id': customer.user_id,
+                                  'to': f"whatsapp:+88{customer.phone_number}",
+                                  'body': STATUS_MESSAGES[status](customer)})
+
+    job_id = uuid.uuid4().hex
+    start_progress(job_id, len(notifications))
+    if notifications:
+        get_job_queue().enqueue(key="bulk_status_notifications", name="bulk_status_notifications", job_id=job_id, notifications=notifications)
+
+    return JsonResponse({
+        'success': True,
+        'job_id': job_id,
+        'updated': len(customers),
+        'notifications': len(notifications),
+    }, status=202)
+
+
+# function for getting the progress of the notifications of a bulk status change
+def bulk_status_progress(request, job_id:str):
+    if 'username' not in request.session:
+        return JsonResponse({'success': False, 'error': 'Login required.'}, status=401)
+    progress = get_progress(job_id)
+    if progress is None:
+        return JsonResponse({'success': False, 'error': f'Unknown job {job_id}.'}, status=404)
+    return JsonResponse({'success': True, **progress})
+
+
+# function for checking a slot and getting the next free slots of a date for the dashboard
+def availability_slots(request):
+    if 'username' not in request.session:
+        return JsonResponse({'success': False, 'error': 'Login required.'}, status=401)
+
+    try:
+        day = date.fromisoformat(request.GET['date'])
+        count = min(max(int(request.GET.get('count', 5)), 1), 50)
+        slot_time = time.fromisoformat(request.GET['time']) if request.GET.get('time') else None
+    except (KeyError, ValueError):
+        return JsonResponse({'success': False, 'error': 'Invalid date, time or count.'}, status=400)
+
+    return JsonResponse({
+        'success': True,
+        'date': day,
+        'time': slot_time,
+        'is_open': availability.is_open(slot_time) if slot_time else None,
+        'is_free': availability.is_free(day, slot_time) if slot_time else None,
+        'free_slots': availability.next_free_slots(day, count=count, after=slot_time),
+        'busy': [[f"{start // 60:02d}:{start % 60:02d}", f"{end // 60:02d}:{end % 60:02d}"] for start, end in availability.schedule(day).busy()],
+    })
+
+
+# function for checking the health of the mysql connection pool
+def database_pool_stats(request):
+    if "username" in request.session:
+        return JsonResponse(get_pool_stats())
+    else:
+        return redirect('login')
+
+
+# function for exposing the prometheus metrics of the bot to the scraper
+def metrics(request):
+    return HttpResponse(generate_latest(), content_type=CONTENT_TYPE_LATEST)
+
+
+# function for showing how many agent turns are waiting and running, and how many whatsapp messages were merged into one turn
+def turn_stats(request):
+    if "username" in request.session:
+        return JsonResponse({'sync': get_turn_gate().stats(),
+                             'async': get_async_turn_gate().stats(),
+                             'whatsapp_coalescing': {'sync': whatsapp_coalescer.stats(), 'async': whatsapp_coalescer_async.stats()}})
+    else:
+        return redirect('login')
+
+
+# function for showing the hit rates of the search result cache, the availability day cache and the whatsapp message ids
+def cache_stats(request):
+    if "username" in request.session:
+        return JsonResponse({'search_results': search_cache.stats(),
+                             'availability_days': availability.days.stats(),
+                             'whatsapp_messages': get_idempotency_store().stats()})
+    else:
+        return redirect('login')
+
+
 # function for handling bad request
 def custom_404_view(request, exception=None):
     return render(request, '404.html', {}, status=404)